@@ -0,0 +1,90 @@
+"""
+Clone time of TreeVersion.clone_from, before and after the set-based rewrite.
+
+"before" replays the original engine: one INSERT and one commit per node,
+edges inserted one by one. "after" is the current INSERT ... SELECT path.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_clone --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from db.database import configure, get_connection, initialize_db
+from src.Tree import Tree
+from src.TreeVersion import TreeVersion, VERSION_CHAIN_CTE, visible_nodes_cte, visible_edges_cte
+from src.TreeNode import TreeNode
+from src.TreeEdge import TreeEdge
+
+
+def legacy_clone_from(version: TreeVersion, parent_version_id: int):
+    """
+    The per-row clone_from this benchmark compares against.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}
+        SELECT id, data_hash FROM visible_nodes
+    """, (parent_version_id,))
+    for row in cursor.fetchall():
+        cursor.execute("""
+            INSERT INTO TreeNode (node_id, tree_version_id, data_hash)
+            VALUES (?, ?, ?)
+        """, (row["id"], version.id, row["data_hash"]))
+        conn.commit()
+
+    cursor.execute(f"""
+        WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte()}
+        SELECT id, incoming_node_id, outgoing_node_id, data_hash FROM visible_edges
+    """, (parent_version_id,))
+    for row in cursor.fetchall():
+        cursor.execute("""
+            INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
+            VALUES (?, ?, ?, ?, ?)
+        """, (row["id"], version.id, row["incoming_node_id"], row["outgoing_node_id"], row["data_hash"]))
+    conn.commit()
+
+
+def seed_version(size: int) -> TreeVersion:
+    """
+    Bulk-load a balanced binary tree of `size` nodes into a fresh version.
+    """
+    Tree.create("bench")
+    version = TreeVersion.create(1)
+    node_ids = TreeNode.create_many(version.id, ({"i": i, "setting": "value"} for i in range(size)))
+    TreeEdge.create_many(version.id, ((node_ids[(i - 1) // 2], node_ids[i], {}) for i in range(1, size)))
+    return version
+
+
+def time_clone(db_path: str, size: int, clone) -> float:
+    configure(db_path)
+    initialize_db(get_connection())
+    source = seed_version(size)
+    target = TreeVersion.create(source.tree_id)
+    start = time.perf_counter()
+    clone(target, source.id)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--skip-before", action="store_true", help="only time the set-based clone")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'nodes':>10} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+        for size in args.sizes:
+            after = time_clone(os.path.join(workdir, f"after-{size}.db"), size, TreeVersion.clone_from)
+            if args.skip_before:
+                print(f"{size:>10} {'-':>12} {after:>12.3f} {'-':>9}")
+                continue
+            before = time_clone(os.path.join(workdir, f"before-{size}.db"), size, legacy_clone_from)
+            print(f"{size:>10} {before:>12.3f} {after:>12.3f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Snapshot export and diff time with the ParallelPipeline, across worker counts.
+
+The version is a balanced binary tree (see bench_clone); the diff compares it with
+a branch that rewrote every tenth node. Each worker count runs on the same file,
+so the timings include spawning the pool. Speedups need as many free cores as
+workers: on fewer, the extra processes only add overhead.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_parallel --size 1000000 --workers 1 2 4 8
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from db.database import configure, get_connection, initialize_db
+from src.Tree import Tree
+from src.Tag import Tag
+from src.Snapshot import SnapshotWriter
+from src.VersionDiff import VersionDiff
+from benchmarks.bench_clone import seed_version
+
+
+def seed(db_path: str, size: int) -> tuple[Tag, Tag]:
+    """
+    The seeded version, tagged "base", and a branch of it with every tenth node rewritten, tagged "changed".
+    """
+    configure(db_path)
+    initialize_db(get_connection())
+    version = seed_version(size)
+    base = Tag.create(version.tree_id, version.id, "base")
+    branch = Tree.get(version.tree_id).create_new_tree_version_from_tag("base")
+    for node in branch.get_all_nodes()[::10]:
+        branch.update_node(node.id, {"i": node.id, "setting": "changed"})
+    return base, branch.create_tag("changed")
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        base, changed = seed(os.path.join(workdir, "parallel.db"), args.size)
+        print(f"{os.cpu_count()} cores, {args.size} nodes")
+        print(f"{'workers':>8} {'export (s)':>11} {'speedup':>8} {'diff (s)':>10} {'speedup':>8}")
+        first = None
+        for workers in args.workers:
+            export = timed(lambda: SnapshotWriter(io.BytesIO(), True, workers).write("bench", base))
+            if workers > 1:
+                diff = timed(lambda: VersionDiff.parallel(base.tree_version_id, changed.tree_version_id, workers))
+            else:
+                diff = timed(lambda: list(VersionDiff(base.tree_version_id, changed.tree_version_id)))
+            first = first or (export, diff)
+            print(f"{workers:>8} {export:>11.3f} {first[0] / export:>7.2f}x {diff:>10.3f} {first[1] / diff:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
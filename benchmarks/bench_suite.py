@@ -0,0 +1,193 @@
+"""
+Timings of the Tree API on synthetic wide, deep, balanced and DAG-shaped trees,
+written as JSON that can be compared across commits to catch regressions.
+
+Every shape and size is loaded into a fresh database and tagged "base", then
+each operation is timed --repeat times and its fastest run kept. Reads start
+cold: the read cache is cleared and a new Tree handle is checked out (outside
+the timing) before every run, so the traversals include loading the adjacency.
+add_node is the mean of --ops calls in a row.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_suite --sizes 1000 10000 100000 1000000 --output results.json
+    python -m benchmarks.bench_suite --output new.json --compare results.json --threshold 1.5
+
+With --compare, the run fails (exit status 1) when an operation is more than
+threshold times slower than in the baseline file; timings below --floor seconds
+on both sides are too noisy to count.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from db.database import configure, get_connection, initialize_db, close_all_connections
+from src.Tree import Tree
+from src.ReadCache import read_cache
+from benchmarks.generators import SHAPES
+
+TRAVERSALS = ("get_root_nodes", "get_child_nodes", "get_descendants", "get_ancestors",
+              "get_nodes_at_depth", "find_path")
+
+
+def load(shape: str, size: int) -> tuple[list[int], float]:
+    """
+    Build the tree of shape with size nodes, tag it "base", and return its node ids and the time it took.
+    """
+    edges, _ = SHAPES[shape]
+    start = time.perf_counter()
+    tree = Tree.create(shape)
+    node_ids = tree.add_nodes({"i": i, "shape": shape} for i in range(size))
+    tree.add_edges((node_ids[parent], node_ids[child], {}) for parent, child in edges(size))
+    tree.create_tag("base")
+    return node_ids, time.perf_counter() - start
+
+
+def measure(fn, repeat: int, setup=None) -> float:
+    """
+    Fastest of repeat runs of fn(setup()), setup excluded from the timing.
+    """
+    best = None
+    for _ in range(repeat):
+        read_cache.clear()
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_case(shape: str, size: int, engines, repeat: int, ops: int) -> list[dict]:
+    node_ids, seconds = load(shape, size)
+    root, leaf = node_ids[0], node_ids[-1]
+    depth = SHAPES[shape][1](size)
+    results = [{"operation": "load", "seconds": seconds}]
+
+    def base(_=None) -> Tree:
+        return Tree.get_by_tag("base")
+
+    def add_nodes(tree):
+        for i in range(ops):
+            tree.add_node({"added": i})
+    results.append({"operation": "add_node", "seconds": measure(add_nodes, repeat, base) / ops})
+
+    def edited(_=None) -> Tree:
+        tree = base()
+        tree.add_node({"added": True})
+        return tree
+    tags = iter(range(repeat))
+    results.append({"operation": "create_tag",
+                    "seconds": measure(lambda tree: tree.create_tag(f"bench-{next(tags)}"), repeat, edited)})
+    results.append({"operation": "get_by_tag", "seconds": measure(base, repeat)})
+    results.append({"operation": "restore_from_tag",
+                    "seconds": measure(lambda tree: tree.restore_from_tag("base"), repeat, base)})
+    results.append({"operation": "get_all_nodes", "seconds": measure(lambda tree: tree.get_all_nodes(), repeat, base)})
+
+    calls = {
+        "get_root_nodes": lambda tree: tree.get_root_nodes(),
+        "get_child_nodes": lambda tree: tree.get_child_nodes(root),
+        "get_descendants": lambda tree: tree.get_descendants(root),
+        "get_ancestors": lambda tree: tree.get_ancestors(leaf),
+        "get_nodes_at_depth": lambda tree: tree.get_nodes_at_depth(depth),
+        "find_path": lambda tree: tree.find_path(root, leaf),
+    }
+    for engine in engines:
+        def checkout(_=None, engine=engine) -> Tree:
+            tree = base()
+            tree.traversal_engine = engine
+            return tree
+        for operation in TRAVERSALS:
+            results.append({"operation": operation, "engine": engine,
+                            "seconds": measure(calls[operation], repeat, checkout)})
+
+    for result in results:
+        result.update(shape=shape, size=size)
+        result.setdefault("engine", None)
+    return results
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def key(result: dict) -> tuple:
+    return result["shape"], result["size"], result["engine"], result["operation"]
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float, floor: float) -> list[tuple]:
+    """
+    The (result, baseline seconds, ratio) of every operation more than threshold times slower than its baseline.
+    """
+    before = {key(r): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None or max(old, result["seconds"]) < floor:
+            continue
+        ratio = result["seconds"] / old if old else float("inf")
+        if ratio > threshold:
+            regressions.append((result, old, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--engines", nargs="+", choices=Tree.TRAVERSAL_ENGINES, default=list(Tree.TRAVERSAL_ENGINES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per operation, the fastest is kept")
+    parser.add_argument("--ops", type=int, default=100, help="add_node calls averaged per run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file written by an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.5, help="slowdown ratio that counts as a regression")
+    parser.add_argument("--floor", type=float, default=0.005, help="ignore timings below this many seconds")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'shape':>9} {'nodes':>8} {'engine':>7} {'operation':>20} {'seconds':>10}")
+        for shape in args.shapes:
+            for size in args.sizes:
+                configure(os.path.join(workdir, f"{shape}-{size}.db"))
+                initialize_db(get_connection())
+                for result in run_case(shape, size, args.engines, args.repeat, args.ops):
+                    print(f"{shape:>9} {size:>8} {result['engine'] or '-':>7} {result['operation']:>20} "
+                          f"{result['seconds']:>10.6f}", flush=True)
+                    results.append(result)
+                close_all_connections()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold, args.floor)
+        print(f"\nCompared with {baseline['meta'].get('commit') or args.compare}: "
+              f"{len(regressions)} regression(s) over {args.threshold}x")
+        for result, old, ratio in regressions:
+            print(f"  {result['shape']} {result['size']} {result['engine'] or '-'} {result['operation']}: "
+                  f"{old:.4f}s -> {result['seconds']:.4f}s ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
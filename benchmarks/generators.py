@@ -0,0 +1,47 @@
+"""
+Synthetic tree shapes for the benchmarks. A shape yields the (parent, child) node
+indices of its edges, node 0 being the root and the last node a deepest leaf;
+nodes_at gives a depth whose level get_nodes_at_depth is timed on.
+"""
+import math
+
+
+def wide(size: int):
+    """
+    One root with every other node as its child.
+    """
+    return ((0, i) for i in range(1, size))
+
+
+def deep(size: int):
+    """
+    A single chain of size nodes.
+    """
+    return ((i - 1, i) for i in range(1, size))
+
+
+def balanced(size: int):
+    """
+    A complete binary tree, filled level by level.
+    """
+    return (((i - 1) // 2, i) for i in range(1, size))
+
+
+def dag(size: int):
+    """
+    The balanced tree plus a second parent, further up, for every third node:
+    many nodes are reachable along more than one path.
+    """
+    for i in range(1, size):
+        yield (i - 1) // 2, i
+        if i % 3 == 0 and i // 3 != (i - 1) // 2:
+            yield i // 3, i
+
+
+# shape: (edges, depth of the level timed by get_nodes_at_depth)
+SHAPES = {
+    "wide": (wide, lambda size: 1),
+    "deep": (deep, lambda size: size - 1),
+    "balanced": (balanced, lambda size: int(math.log2(size))),
+    "dag": (dag, lambda size: int(math.log2(size)) // 2),
+}
@@ -1,10 +1,243 @@
+import atexit
+import os
+from contextlib import contextmanager
 import sqlite3
+import threading
+from urllib.request import pathname2url
+from db.functions import register_functions
+from db.migrate import migrate
 
-def get_connection(db_path="tree_system.db"):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+DEFAULT_DB_PATH = os.environ.get("TREE_SYSTEM_DB", "tree_system.db")
+# Seconds a statement waits for another connection's write lock before failing
+DEFAULT_BUSY_TIMEOUT = 10.0
 
-def initialize_db(conn, schema_path="db/schema.sql"):
-    with open(schema_path, "r") as f:
-        conn.executescript(f.read())
\ No newline at end of file
+
+class ConnectionManager:
+    """
+    Owns the sqlite3 connections of the process: one pooled connection per thread,
+    opened on first use and reused by every model call made on that thread.
+
+    Connections stay open until close() (current thread), close_all() or
+    configure() with a new path. A connection closed by its caller is reopened
+    on the next get_connection().
+
+    Databases run in WAL mode, so several processes can share one: readers see
+    the last committed state and never wait for a writer (e.g. a long clone_from),
+    and writers queue for the write lock for up to busy_timeout seconds.
+
+    A read_only manager opens its connections with mode=ro, as the worker processes
+    of a ParallelPipeline do: any write through them fails. New connections are
+    instances of connection_factory (see db.instrumentation).
+    """
+
+    connection_factory = sqlite3.Connection
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, busy_timeout: float = DEFAULT_BUSY_TIMEOUT,
+                 read_only: bool = False):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.read_only = read_only
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._invalidation_hooks = []
+
+    def configure(self, db_path: str, busy_timeout: float = None, read_only: bool = None):
+        """
+        Point the manager at another database file. Open connections are closed.
+        """
+        self.close_all()
+        self.db_path = str(db_path)
+        if busy_timeout is not None:
+            self.busy_timeout = busy_timeout
+        if read_only is not None:
+            self.read_only = read_only
+        self._invalidate()
+
+    def add_invalidation_hook(self, hook):
+        """
+        Call hook() whenever rows read earlier may no longer be in the database:
+        after configure() and after a transaction() rolls back.
+        """
+        self._invalidation_hooks.append(hook)
+
+    def _invalidate(self):
+        for hook in self._invalidation_hooks:
+            hook()
+
+    def get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._is_open(conn):
+            return conn
+        if self.read_only:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, timeout=self.busy_timeout, check_same_thread=False, uri=True,
+                                   factory=self.connection_factory)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False,
+                                   factory=self.connection_factory)
+        conn.row_factory = sqlite3.Row
+        register_functions(conn)
+        # Every lookup path has a declared index; a transient automatic index would
+        # cost a scan of the whole table on each statement instead
+        conn.execute("PRAGMA automatic_index = OFF")
+        if not self.read_only:
+            # In WAL mode a commit only appends to the log; NORMAL syncs it at checkpoints,
+            # which can lose the last commits on power loss but never corrupts the file
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        self._local.conn = conn
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def after_commit(self, hook, *args):
+        """
+        Call hook(*args) once the calling thread's writes are committed: right away
+        outside a transaction(), else when the outermost block commits. Dropped if
+        it rolls back, as the invalidation hooks run then. The same hook and args
+        queued twice in one transaction run once.
+        """
+        if not getattr(self._local, "depth", 0):
+            hook(*args)
+        else:
+            self._local.pending.setdefault((hook, args))
+
+    def commit(self):
+        """
+        Commit the calling thread's connection, unless a transaction() is open on it.
+        """
+        if not getattr(self._local, "depth", 0):
+            self.get_connection().commit()
+
+    @contextmanager
+    def write(self):
+        """
+        One model write on the calling thread's connection. Outside a transaction()
+        the block is its own transaction: committed when it exits, rolled back if it
+        raises, so a failed statement (e.g. a constraint violation) does not leave
+        the connection holding the write lock. Inside one, the enclosing block
+        commits or rolls back.
+        """
+        if getattr(self._local, "depth", 0):
+            yield self.get_connection()
+        else:
+            with self.transaction() as conn:
+                yield conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work on the calling thread's connection. Model commits inside the
+        block are held back, with their after_commit() hooks, and the outermost
+        block commits once when it exits.
+        Nested blocks are savepoints: if one raises, only its own writes are
+        rolled back, and the exception propagates to the enclosing block.
+        """
+        conn = self.get_connection()
+        depth = getattr(self._local, "depth", 0)
+        savepoint = f"sp_{depth}"
+        if depth:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        elif not conn.in_transaction:
+            # An explicit BEGIN, so releasing the first savepoint does not commit.
+            # IMMEDIATE takes the write lock up front, waiting for it up to busy_timeout:
+            # a deferred transaction that reads first fails at its first write if
+            # another connection committed in between.
+            conn.execute("BEGIN IMMEDIATE")
+        if not depth:
+            self._local.pending = {}
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = depth
+            if depth:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            else:
+                self._local.pending = {}
+                conn.rollback()
+            self._invalidate()
+            raise
+        self._local.depth = depth
+        if depth:
+            conn.execute(f"RELEASE {savepoint}")
+        else:
+            conn.commit()
+            pending, self._local.pending = self._local.pending, {}
+            for hook, args in pending:
+                hook(*args)
+
+    def close(self):
+        """
+        Close the connection of the calling thread, if any.
+        """
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+
+    def close_all(self):
+        """
+        Close the connections of every thread.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    @staticmethod
+    def _is_open(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.in_transaction
+            return True
+        except sqlite3.ProgrammingError:
+            return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close_all()
+
+
+connection_manager = ConnectionManager()
+atexit.register(connection_manager.close_all)
+
+
+def configure(db_path: str, busy_timeout: float = None, read_only: bool = None):
+    connection_manager.configure(db_path, busy_timeout, read_only)
+
+def get_connection() -> sqlite3.Connection:
+    return connection_manager.get_connection()
+
+def commit():
+    connection_manager.commit()
+
+def after_commit(hook, *args):
+    connection_manager.after_commit(hook, *args)
+
+def add_invalidation_hook(hook):
+    connection_manager.add_invalidation_hook(hook)
+
+def transaction():
+    return connection_manager.transaction()
+
+def write():
+    return connection_manager.write()
+
+def close_connection():
+    connection_manager.close()
+
+def close_all_connections():
+    connection_manager.close_all()
+
+def initialize_db(conn):
+    """
+    Create or upgrade the schema by applying pending migrations. Never drops data.
+    """
+    return migrate(conn)
@@ -0,0 +1,21 @@
+"""
+Python functions registered on every connection, for SQL that cannot be written
+in plain SQLite (the migrations included).
+"""
+import hashlib
+import sqlite3
+
+
+def payload_hash(data) -> bytes:
+    """
+    Content address of a JSON payload: the 16-byte BLAKE2b digest of its text.
+    """
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def register_functions(conn: sqlite3.Connection):
+    conn.create_function("payload_hash", 1, payload_hash, deterministic=True)
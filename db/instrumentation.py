@@ -0,0 +1,368 @@
+"""
+Instrumentation of the data-access layer: what the SQL behind a Tree call costs.
+
+Once enable()d, the pooled connections count every statement with its wall time
+(executing and fetching) and the rows it read and wrote, every commit and every
+connection opened, and sample the statements slower than slow_query_seconds with
+their EXPLAIN QUERY PLAN. Each event is reported to the sinks under the current
+operation, a label set with operation() or profile():
+
+    from db import instrumentation
+
+    instrumentation.enable(slow_query_seconds=0.05)
+    with instrumentation.operation("checkout"):
+        tree = Tree.get_by_tag("release-v1.0")
+    print(instrumentation.registry.prometheus())
+
+    with instrumentation.profile("get_by_tag") as p:
+        Tree.get_by_tag("release-v1.0")
+    print(p.counts, p.statements)
+
+enable() reopens every connection, so call it at startup; profile() refuses
+to run before it. registry, the in-process MetricsRegistry, is a sink by
+default; add_sink() plugs in others (subclasses of MetricsSink). Instrumented
+connections cost a Python call per statement and per fetched row: leave it
+disabled when unused.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from db.database import connection_manager
+
+DEFAULT_SLOW_QUERY_SECONDS = 0.1
+COUNTERS = ("statements", "rows_read", "rows_written", "commits", "connections_opened", "seconds")
+
+_local = threading.local()
+_sinks = []
+_slow_query_seconds = DEFAULT_SLOW_QUERY_SECONDS
+
+
+class MetricsSink:
+    """
+    Receives the events of instrumented connections. Methods are called on the
+    thread that ran the statement; the default implementations ignore the event.
+    """
+
+    def statement(self, operation: str, sql: str, seconds: float, rows_read: int, rows_written: int):
+        pass
+
+    def commit(self, operation: str):
+        pass
+
+    def connection_opened(self, operation: str):
+        pass
+
+    def slow_query(self, operation: str, sql: str, seconds: float, plan: list[str]):
+        pass
+
+
+class MetricsRegistry(MetricsSink):
+    """
+    In-process totals per operation, plus the last max_slow_queries slow query samples.
+    """
+
+    def __init__(self, max_slow_queries: int = 100):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.slow_queries = deque(maxlen=max_slow_queries)
+
+    def _add(self, operation: str, **amounts):
+        with self._lock:
+            counters = self.counters.setdefault(operation, dict.fromkeys(COUNTERS, 0))
+            for name, amount in amounts.items():
+                counters[name] += amount
+
+    def statement(self, operation, sql, seconds, rows_read, rows_written):
+        self._add(operation, statements=1, seconds=seconds, rows_read=rows_read, rows_written=rows_written)
+
+    def commit(self, operation):
+        self._add(operation, commits=1)
+
+    def connection_opened(self, operation):
+        self._add(operation, connections_opened=1)
+
+    def slow_query(self, operation, sql, seconds, plan):
+        with self._lock:
+            self.slow_queries.append({"operation": operation, "sql": sql, "seconds": seconds, "plan": plan})
+
+    def snapshot(self) -> dict:
+        """
+        A copy of the counters, {operation: {counter: value}}.
+        """
+        with self._lock:
+            return {operation: dict(counters) for operation, counters in self.counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.slow_queries.clear()
+
+    def prometheus(self, prefix: str = "tree_db") -> str:
+        """
+        The counters in the Prometheus text exposition format, one series per operation.
+        """
+        lines = []
+        counters = self.snapshot()
+        for name in COUNTERS:
+            metric = f"{prefix}_{'statement_seconds' if name == 'seconds' else name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for operation, values in sorted(counters.items()):
+                label = operation.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                lines.append(f'{metric}{{operation="{label}"}} {values[name]}')
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return f"<MetricsRegistry operations={len(self.counters)}, slow_queries={len(self.slow_queries)}>"
+
+
+class Profile(MetricsSink):
+    """
+    The events of one profile() block: counts (as in MetricsRegistry), every
+    statement as a (sql, seconds, rows_read, rows_written) tuple in the order they
+    finished, the slow query samples, and the wall time of the whole block.
+    """
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.statements = []
+        self.slow_queries = []
+        self.wall_time = None
+
+    def statement(self, operation, sql, seconds, rows_read, rows_written):
+        self.counts["statements"] += 1
+        self.counts["seconds"] += seconds
+        self.counts["rows_read"] += rows_read
+        self.counts["rows_written"] += rows_written
+        self.statements.append((sql, seconds, rows_read, rows_written))
+
+    def commit(self, operation):
+        self.counts["commits"] += 1
+
+    def connection_opened(self, operation):
+        self.counts["connections_opened"] += 1
+
+    def slow_query(self, operation, sql, seconds, plan):
+        self.slow_queries.append({"operation": operation, "sql": sql, "seconds": seconds, "plan": plan})
+
+    def __repr__(self):
+        return f"<Profile {self.operation!r} {self.counts}, wall_time={self.wall_time}>"
+
+
+registry = MetricsRegistry()
+_sinks.append(registry)
+
+
+def add_sink(sink: MetricsSink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink: MetricsSink):
+    _sinks.remove(sink)
+
+
+def current_operation() -> str:
+    operations = getattr(_local, "operations", None)
+    return operations[-1] if operations else ""
+
+
+def _emit(event: str, operation: str, *args):
+    for sink in _sinks + getattr(_local, "profiles", []):
+        getattr(sink, event)(operation, *args)
+
+
+def _normalize(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor reporting each statement once it is done: fully fetched, replaced by
+    the next execute, closed or dropped. Its seconds only cover the time spent
+    inside the cursor's calls, not the caller's work between fetches.
+    """
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, parameters, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # No plan for a batch: its parameters are consumed
+            self._begin(sql, None, start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size: int = None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _begin(self, sql, parameters, start: float):
+        self._sql = sql
+        self._parameters = parameters
+        self._operation = current_operation()
+        self._seconds = time.perf_counter() - start
+        self._rows_read = 0
+        self._rows_written = max(self.rowcount, 0)
+
+    def _fetched(self, start: float, rows: int, done: bool):
+        if self._sql is None:
+            return
+        self._seconds += time.perf_counter() - start
+        self._rows_read += rows
+        if done:
+            self._finish()
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = _normalize(self._sql), None
+        _emit("statement", self._operation, sql, self._seconds, self._rows_read, self._rows_written)
+        if self._seconds >= _slow_query_seconds:
+            _emit("slow_query", self._operation, sql, self._seconds, self._plan(sql))
+
+    def _plan(self, sql: str) -> list[str]:
+        """
+        EXPLAIN QUERY PLAN of the statement, on a plain cursor so it is not counted.
+        """
+        if self._parameters is None or sql.upper().startswith(("EXPLAIN", "BEGIN", "COMMIT", "PRAGMA")):
+            return []
+        try:
+            cursor = sqlite3.Cursor(self.connection)
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", self._parameters)
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error:
+            return []
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are InstrumentedCursors, counting its opening and commits.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _emit("connection_opened", current_operation())
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute does not go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        if self.in_transaction:
+            _emit("commit", current_operation())
+        super().commit()
+
+
+def enable(slow_query_seconds: float = None):
+    """
+    Instrument the connections of connection_manager. Open connections are closed,
+    on every thread, so call it at startup or outside transactions.
+    """
+    global _slow_query_seconds
+    if slow_query_seconds is not None:
+        _slow_query_seconds = slow_query_seconds
+    if connection_manager.connection_factory is not InstrumentedConnection:
+        connection_manager.connection_factory = InstrumentedConnection
+        connection_manager.close_all()
+
+
+def disable():
+    if connection_manager.connection_factory is InstrumentedConnection:
+        connection_manager.connection_factory = sqlite3.Connection
+        connection_manager.close_all()
+
+
+def enabled() -> bool:
+    return connection_manager.connection_factory is InstrumentedConnection
+
+
+@contextmanager
+def operation(name: str):
+    """
+    Report the statements run on this thread inside the block under name.
+    """
+    operations = getattr(_local, "operations", None)
+    if operations is None:
+        operations = _local.operations = []
+    operations.append(name)
+    try:
+        yield
+    finally:
+        operations.pop()
+
+
+@contextmanager
+def profile(name: str = "profile"):
+    """
+    Profile the calls made on this thread inside the block, e.g. one Tree call, and
+    yield their Profile. Reported to the sinks as operation name as well.
+    Needs enable() first: enabling reopens every connection, which would lose the
+    open transactions of the calls being profiled.
+    """
+    if not enabled():
+        raise ValueError("Instrumentation is off: call instrumentation.enable() at startup to profile.")
+    result = Profile(name)
+    profiles = getattr(_local, "profiles", None)
+    if profiles is None:
+        profiles = _local.profiles = []
+    profiles.append(result)
+    start = time.perf_counter()
+    try:
+        with operation(name):
+            yield result
+    finally:
+        result.wall_time = time.perf_counter() - start
+        profiles.remove(result)
@@ -0,0 +1,75 @@
+-- Upgrade of a database created before the migration runner in the layout of
+-- migrations/004 (full copies of every node and edge per version) to the
+-- copy-on-write layout of migrations/005, without dropping any row. Used by
+-- db/migrate.py in place of 001-005, whose scripts recreate the schema.
+
+-- ========== 1) TreeNode and TreeEdge ==========
+-- Rebuilt with the node_id/edge_id identity columns, backfilled from the row ids
+-- the edges already point at, and is_deleted
+CREATE TABLE TreeNode_cow (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    node_id INTEGER,
+    tree_version_id INTEGER NOT NULL,
+    data JSON,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+
+    UNIQUE (tree_version_id, node_id)
+);
+INSERT INTO TreeNode_cow (id, node_id, tree_version_id, data, created_at)
+SELECT id, id, tree_version_id, data, created_at FROM TreeNode;
+
+CREATE TABLE TreeEdge_cow (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    edge_id INTEGER,
+    tree_version_id INTEGER NOT NULL,
+    incoming_node_id INTEGER NOT NULL,
+    outgoing_node_id INTEGER NOT NULL,
+    data JSON,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+
+    UNIQUE (tree_version_id, edge_id)
+);
+INSERT INTO TreeEdge_cow (id, edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at)
+SELECT id, id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at FROM TreeEdge;
+
+DROP TABLE TreeEdge;
+DROP TABLE TreeNode;
+ALTER TABLE TreeNode_cow RENAME TO TreeNode;
+ALTER TABLE TreeEdge_cow RENAME TO TreeEdge;
+
+CREATE INDEX idx_treenode_tree_version_id ON TreeNode(tree_version_id);
+CREATE INDEX idx_treeedge_tree_version_id ON TreeEdge(tree_version_id);
+CREATE INDEX IF NOT EXISTS idx_tag_tree_version_id ON Tag(tree_version_id);
+
+CREATE TRIGGER trg_treenode_node_id AFTER INSERT ON TreeNode
+WHEN NEW.node_id IS NULL
+BEGIN
+    UPDATE TreeNode SET node_id = NEW.id WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER trg_treeedge_edge_id AFTER INSERT ON TreeEdge
+WHEN NEW.edge_id IS NULL
+BEGIN
+    UPDATE TreeEdge SET edge_id = NEW.id WHERE id = NEW.id;
+END;
+
+-- ========== 2) Flatten the copies ==========
+-- A cloned version already holds a copy of everything it had, under new ids, so
+-- it must not see its parent's rows through the version chain as well. A
+-- tombstone for each of the parent's own rows hides them, and the parent's
+-- tombstones hide the grandparent's.
+INSERT INTO TreeNode (node_id, tree_version_id, is_deleted)
+SELECT n.node_id, v.id, 1
+FROM TreeVersion v
+JOIN TreeNode n ON n.tree_version_id = v.parent_version_id AND n.is_deleted = 0;
+
+INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, is_deleted)
+SELECT e.edge_id, v.id, e.incoming_node_id, e.outgoing_node_id, 1
+FROM TreeVersion v
+JOIN TreeEdge e ON e.tree_version_id = v.parent_version_id AND e.is_deleted = 0;
@@ -0,0 +1,168 @@
+"""
+Versioned schema migrations.
+
+Applied migrations are recorded in the SchemaMigration table. migrate() applies
+only the pending incremental scripts in migrations/, all in one transaction, so
+upgrading a large database never rebuilds its data.
+
+    python -m db.migrate                  # upgrade $TREE_SYSTEM_DB (default tree_system.db)
+    python -m db.migrate --db path.db     # upgrade another database
+    python -m db.migrate --status         # list applied and pending migrations
+"""
+import argparse
+import os
+import re
+import sqlite3
+from db.functions import register_functions
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema.sql")
+LEGACY_UPGRADE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "legacy_upgrade.sql")
+
+# Migrations 001-005 drop and recreate the whole schema and are kept for history only.
+# Databases created before the runner existed are brought to this version in place:
+# stamped if they already have its copy-on-write layout, upgraded by
+# legacy_upgrade.sql if they still have the full-copy layout of 004.
+BASELINE_VERSION = 5
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+def list_migrations(migrations_dir: str = MIGRATIONS_DIR) -> list[tuple[int, str, str]]:
+    """
+    (version, name, path) of every migration script, in version order.
+    """
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), file_name[:-len(".sql")], os.path.join(migrations_dir, file_name)))
+    return sorted(migrations)
+
+
+def applied_versions(conn: sqlite3.Connection) -> set[int]:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigration (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    return {r[0] for r in conn.execute("SELECT version FROM SchemaMigration")}
+
+
+def has_schema(conn: sqlite3.Connection) -> bool:
+    return conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'Tree'"
+    ).fetchone()[0] > 0
+
+
+def columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def baseline_script(conn: sqlite3.Connection, legacy_upgrade_path: str = LEGACY_UPGRADE_PATH) -> str:
+    """
+    The SQL bringing a database created before the runner to BASELINE_VERSION:
+    nothing if it has the copy-on-write layout, else the legacy upgrade. Older
+    layouts, without TreeVersion, cannot be upgraded in place.
+    """
+    node_columns = columns(conn, "TreeNode")
+    if "node_id" in node_columns:
+        return ""
+    if "tree_version_id" not in node_columns:
+        raise ValueError("The database predates tree versions (migration 003) and cannot be upgraded; "
+                         "export its data and load it into a new database.")
+    with open(legacy_upgrade_path, "r") as f:
+        return f"-- {os.path.basename(legacy_upgrade_path)}\n" + f.read() + "\n"
+
+
+def pending_migrations(conn: sqlite3.Connection, migrations_dir: str = MIGRATIONS_DIR) -> list[tuple[int, str, str]]:
+    applied = applied_versions(conn)
+    if not applied:
+        applied = set(range(BASELINE_VERSION + 1))
+    return [m for m in list_migrations(migrations_dir) if m[0] not in applied]
+
+
+def _stamp(version: int, name: str) -> str:
+    return f"INSERT INTO SchemaMigration (version, name) VALUES ({version}, '{name}');\n"
+
+
+def migrate(conn: sqlite3.Connection, migrations_dir: str = MIGRATIONS_DIR,
+            schema_path: str = SCHEMA_PATH) -> list[str]:
+    """
+    Bring the database up to date and return the names of the migrations applied.
+
+    An empty database gets the current schema from schema.sql, and every migration
+    is recorded as applied. A database created before the runner is brought to
+    BASELINE_VERSION first (see baseline_script()). Pending scripts run in version
+    order in a single transaction; if one fails, none of them is applied.
+    """
+    register_functions(conn)
+    migrations = list_migrations(migrations_dir)
+    script = ""
+    applied = []
+    created = False
+    if not applied_versions(conn):
+        created = not has_schema(conn)
+        if created:
+            # auto_vacuum only changes on an empty file or with a VACUUM, which is
+            # instant while the only table is the empty SchemaMigration
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            with open(schema_path, "r") as f:
+                script += f.read() + "\n"
+            script += "".join(_stamp(version, name) for version, name, _ in migrations)
+            applied.append(os.path.basename(schema_path))
+        else:
+            script += baseline_script(conn)
+            if script:
+                applied.append(os.path.basename(LEGACY_UPGRADE_PATH))
+            script += "".join(_stamp(version, name) for version, name, _ in migrations
+                              if version <= BASELINE_VERSION)
+
+    if not created:
+        for version, name, path in pending_migrations(conn, migrations_dir):
+            with open(path, "r") as f:
+                script += f"-- {name}\n" + f.read() + "\n"
+            script += _stamp(version, name)
+            applied.append(name)
+
+    if not script:
+        return []
+    try:
+        conn.executescript("BEGIN;\n" + script + "COMMIT;")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database file (default: $TREE_SYSTEM_DB or tree_system.db)")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = parser.parse_args()
+
+    from db.database import configure, get_connection, close_all_connections
+    if args.db:
+        configure(args.db)
+    conn = get_connection()
+    if args.status:
+        applied = applied_versions(conn)
+        baseline = not applied and has_schema(conn)
+        for version, name, _ in list_migrations():
+            state = "applied" if version in applied else "pending"
+            if baseline and version <= BASELINE_VERSION:
+                state = "baseline"
+            print(f"{state:>8}  {name}")
+    else:
+        names = migrate(conn)
+        print("\n".join(f"applied {name}" for name in names) or "database is up to date")
+    close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,14 @@
-BEGIN TRANSACTION;
-
-DROP TABLE IF EXISTS Tree;
-DROP TABLE IF EXISTS TreeVersion;
-DROP TABLE IF EXISTS Tag;
-DROP TABLE IF EXISTS TreeNode;
-DROP TABLE IF EXISTS TreeEdge;
+-- Current schema, used by db/migrate.py to create new databases.
+-- Changes go into a new migrations/NNN_*.sql script AND into this file.
 
 -- ========== 1) Tree ==========
+-- head_version_id is the last version tagged on the tree's main line; create_tag
+-- moves it with a compare-and-swap.
 CREATE TABLE IF NOT EXISTS Tree (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    head_version_id INTEGER REFERENCES TreeVersion(id)
 );
 
 -- ========== 2) TreeVersion ==========
@@ -27,6 +25,9 @@ CREATE TABLE IF NOT EXISTS TreeVersion (
 -- Add index on TreeVersion.id
 CREATE INDEX idx_treeversion_id ON TreeVersion(id);
 
+-- Add index on TreeVersion.parent_version_id, to find the children of a version
+CREATE INDEX idx_treeversion_parent_version_id ON TreeVersion(parent_version_id);
+
 -- ========== 3) Tag ==========
 CREATE TABLE IF NOT EXISTS Tag (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,35 +46,78 @@ CREATE TABLE IF NOT EXISTS Tag (
 -- Add index on Tag.tag_name
 CREATE INDEX idx_tag_name ON Tag(tag_name);
 
+-- Add index on Tag.tree_version_id
+CREATE INDEX idx_tag_tree_version_id ON Tag(tree_version_id);
+
 
 -- ========== 4) TreeNode ==========
+-- A version only stores the nodes it added, modified or deleted on top of
+-- its parent_version_id. node_id is the identity of a node across versions;
+-- is_deleted marks a tombstone that hides the node from this version on.
 CREATE TABLE IF NOT EXISTS TreeNode (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    node_id INTEGER,
     tree_version_id INTEGER NOT NULL,
-    data JSON,
+    data_hash BLOB,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
 
-    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id)
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+    FOREIGN KEY (data_hash) REFERENCES Payload(hash),
+
+    UNIQUE (tree_version_id, node_id)
 );
 
 -- Add index on TreeNode.tree_version_id
 CREATE INDEX idx_treenode_tree_version_id ON TreeNode(tree_version_id);
 
+-- Add index on TreeNode.data_hash, to find unreferenced payloads
+CREATE INDEX idx_treenode_data_hash ON TreeNode(data_hash);
+
+-- New nodes take their row id as their identity
+CREATE TRIGGER trg_treenode_node_id AFTER INSERT ON TreeNode
+WHEN NEW.node_id IS NULL
+BEGIN
+    UPDATE TreeNode SET node_id = NEW.id WHERE id = NEW.id;
+END;
+
 -- ========== 5) TreeEdge ==========
+-- Edges follow the same copy-on-write layout as nodes. incoming_node_id and
+-- outgoing_node_id reference TreeNode.node_id.
 CREATE TABLE IF NOT EXISTS TreeEdge (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    edge_id INTEGER,
     tree_version_id INTEGER NOT NULL,
     incoming_node_id INTEGER NOT NULL,
     outgoing_node_id INTEGER NOT NULL,
-    data JSON,
+    data_hash BLOB,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
 
     FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
-    FOREIGN KEY (incoming_node_id) REFERENCES TreeNode(id),
-    FOREIGN KEY (outgoing_node_id) REFERENCES TreeNode(id)
-);
+    FOREIGN KEY (data_hash) REFERENCES Payload(hash),
 
--- Add index on TreeEdge.tree_version_id
-CREATE INDEX idx_treeedge_tree_version_id ON TreeEdge(tree_version_id);
+    UNIQUE (tree_version_id, edge_id)
+);
 
-COMMIT;
+-- Add indices on TreeEdge endpoints, scoped to a version
+CREATE INDEX idx_treeedge_version_incoming ON TreeEdge(tree_version_id, incoming_node_id);
+CREATE INDEX idx_treeedge_version_outgoing ON TreeEdge(tree_version_id, outgoing_node_id);
+
+-- Add index on TreeEdge.data_hash, to find unreferenced payloads
+CREATE INDEX idx_treeedge_data_hash ON TreeEdge(data_hash);
+
+-- New edges take their row id as their identity
+CREATE TRIGGER trg_treeedge_edge_id AFTER INSERT ON TreeEdge
+WHEN NEW.edge_id IS NULL
+BEGIN
+    UPDATE TreeEdge SET edge_id = NEW.id WHERE id = NEW.id;
+END;
+
+-- ========== 6) Payload ==========
+-- Node and edge payloads, stored once per distinct JSON text and addressed by
+-- payload_hash() (db/functions.py)
+CREATE TABLE IF NOT EXISTS Payload (
+    hash BLOB PRIMARY KEY NOT NULL,
+    data TEXT NOT NULL
+);
@@ -0,0 +1,107 @@
+BEGIN TRANSACTION;
+
+DROP TABLE IF EXISTS Tree;
+DROP TABLE IF EXISTS TreeVersion;
+DROP TABLE IF EXISTS Tag;
+DROP TABLE IF EXISTS TreeNode;
+DROP TABLE IF EXISTS TreeEdge;
+
+-- ========== 1) Tree ==========
+CREATE TABLE IF NOT EXISTS Tree (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- ========== 2) TreeVersion ==========
+CREATE TABLE IF NOT EXISTS TreeVersion (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_id INTEGER NOT NULL,
+    parent_version_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_id) REFERENCES Tree(id),
+    FOREIGN KEY (parent_version_id) REFERENCES TreeVersion(id)
+);
+
+-- Add index on TreeVersion.id
+CREATE INDEX idx_treeversion_id ON TreeVersion(id);
+
+-- ========== 3) Tag ==========
+CREATE TABLE IF NOT EXISTS Tag (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tree_version_id INTEGER NOT NULL,
+    tree_id INTEGER NOT NULL,
+    tag_name TEXT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+    FOREIGN KEY (tree_id) REFERENCES Tree(id),
+
+    UNIQUE (tree_id, tag_name)
+);
+
+-- Add index on Tag.tag_name
+CREATE INDEX idx_tag_name ON Tag(tag_name);
+
+-- Add index on Tag.tree_version_id
+CREATE INDEX idx_tag_tree_version_id ON Tag(tree_version_id);
+
+
+-- ========== 4) TreeNode ==========
+-- A version only stores the nodes it added, modified or deleted on top of
+-- its parent_version_id. node_id is the identity of a node across versions;
+-- is_deleted marks a tombstone that hides the node from this version on.
+CREATE TABLE IF NOT EXISTS TreeNode (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    node_id INTEGER,
+    tree_version_id INTEGER NOT NULL,
+    data JSON,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+
+    UNIQUE (tree_version_id, node_id)
+);
+
+-- Add index on TreeNode.tree_version_id
+CREATE INDEX idx_treenode_tree_version_id ON TreeNode(tree_version_id);
+
+-- New nodes take their row id as their identity
+CREATE TRIGGER trg_treenode_node_id AFTER INSERT ON TreeNode
+WHEN NEW.node_id IS NULL
+BEGIN
+    UPDATE TreeNode SET node_id = NEW.id WHERE id = NEW.id;
+END;
+
+-- ========== 5) TreeEdge ==========
+-- Edges follow the same copy-on-write layout as nodes. incoming_node_id and
+-- outgoing_node_id reference TreeNode.node_id.
+CREATE TABLE IF NOT EXISTS TreeEdge (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    edge_id INTEGER,
+    tree_version_id INTEGER NOT NULL,
+    incoming_node_id INTEGER NOT NULL,
+    outgoing_node_id INTEGER NOT NULL,
+    data JSON,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    FOREIGN KEY (tree_version_id) REFERENCES TreeVersion(id),
+
+    UNIQUE (tree_version_id, edge_id)
+);
+
+-- Add index on TreeEdge.tree_version_id
+CREATE INDEX idx_treeedge_tree_version_id ON TreeEdge(tree_version_id);
+
+-- New edges take their row id as their identity
+CREATE TRIGGER trg_treeedge_edge_id AFTER INSERT ON TreeEdge
+WHEN NEW.edge_id IS NULL
+BEGIN
+    UPDATE TreeEdge SET edge_id = NEW.id WHERE id = NEW.id;
+END;
+
+COMMIT;
@@ -0,0 +1,6 @@
+-- Neighbour lookups filter edges on one endpoint within a version
+CREATE INDEX IF NOT EXISTS idx_treeedge_version_incoming ON TreeEdge(tree_version_id, incoming_node_id);
+CREATE INDEX IF NOT EXISTS idx_treeedge_version_outgoing ON TreeEdge(tree_version_id, outgoing_node_id);
+
+-- Covered by the leading column of the indexes above
+DROP INDEX IF EXISTS idx_treeedge_tree_version_id;
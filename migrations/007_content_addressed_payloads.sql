@@ -0,0 +1,23 @@
+-- Node and edge payloads are stored once per distinct JSON text in Payload,
+-- addressed by payload_hash() (db/functions.py), and rows reference the hash
+CREATE TABLE IF NOT EXISTS Payload (
+    hash BLOB PRIMARY KEY NOT NULL,
+    data TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO Payload (hash, data)
+SELECT payload_hash(data), data FROM TreeNode WHERE data IS NOT NULL;
+INSERT OR IGNORE INTO Payload (hash, data)
+SELECT payload_hash(data), data FROM TreeEdge WHERE data IS NOT NULL;
+
+ALTER TABLE TreeNode ADD COLUMN data_hash BLOB REFERENCES Payload(hash);
+UPDATE TreeNode SET data_hash = payload_hash(data) WHERE data IS NOT NULL;
+ALTER TABLE TreeNode DROP COLUMN data;
+
+ALTER TABLE TreeEdge ADD COLUMN data_hash BLOB REFERENCES Payload(hash);
+UPDATE TreeEdge SET data_hash = payload_hash(data) WHERE data IS NOT NULL;
+ALTER TABLE TreeEdge DROP COLUMN data;
+
+-- Lets the garbage collector find payloads no row references any more
+CREATE INDEX IF NOT EXISTS idx_treenode_data_hash ON TreeNode(data_hash);
+CREATE INDEX IF NOT EXISTS idx_treeedge_data_hash ON TreeEdge(data_hash);
@@ -0,0 +1,2 @@
+-- Descendant lookups follow parent_version_id from parent to children
+CREATE INDEX IF NOT EXISTS idx_treeversion_parent_version_id ON TreeVersion(parent_version_id);
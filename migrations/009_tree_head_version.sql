@@ -0,0 +1,6 @@
+-- The version a tree's main line is at, moved with a compare-and-swap by create_tag.
+-- Existing trees start at their most recently tagged version.
+ALTER TABLE Tree ADD COLUMN head_version_id INTEGER REFERENCES TreeVersion(id);
+UPDATE Tree SET head_version_id = (
+    SELECT t.tree_version_id FROM Tag t WHERE t.tree_id = Tree.id ORDER BY t.id DESC LIMIT 1
+);
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from src.Tree import Tree
+
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    The bounded pool the AsyncTree calls run on by default, created on first use.
+    Each of its threads keeps its own pooled connection (see db.database).
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="tree-db")
+    return _executor
+
+
+def _read(name: str):
+    async def method(self, *args, **kwargs):
+        return await self._run(getattr(self.tree, name), *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(Tree, name).__doc__
+    return method
+
+
+def _write(name: str):
+    async def method(self, *args, **kwargs):
+        async with self._write_lock:
+            return await self._run(getattr(self.tree, name), *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(Tree, name).__doc__
+    return method
+
+
+class AsyncTree:
+    """
+    asyncio facade of a Tree: every call runs on a bounded thread pool instead of
+    the event loop, so a long clone or scan does not stall other tasks.
+
+    Reads of one AsyncTree may run concurrently, each on its own pooled connection.
+    Writes through it are serialized, since they move the handle's working version;
+    reads see a new working version once the write that created it has committed.
+    Traversals share the handle's graph index with the writes that update it, so
+    those take turns on it (see Tree.graph_index).
+    A transaction only spans one pool call: group writes that must commit together
+    in a function and pass it to run().
+    """
+
+    def __init__(self, tree: Tree, executor: ThreadPoolExecutor = None):
+        self.tree = tree
+        self.executor = executor
+        self._write_lock = asyncio.Lock()
+
+    async def _run(self, fn, *args, **kwargs):
+        return await self._call(self.executor, fn, *args, **kwargs)
+
+    @staticmethod
+    async def _call(executor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or get_executor(), functools.partial(fn, *args, **kwargs))
+
+    @classmethod
+    async def _wrap(cls, executor, fn, *args) -> "AsyncTree":
+        tree = await cls._call(executor, fn, *args)
+        return cls(tree, executor) if tree is not None else None
+
+    @classmethod
+    async def create(cls, name: str, executor: ThreadPoolExecutor = None) -> "AsyncTree":
+        return await cls._wrap(executor, Tree.create, name)
+
+    @classmethod
+    async def get(cls, tree_id: int, executor: ThreadPoolExecutor = None) -> "AsyncTree":
+        return await cls._wrap(executor, Tree.get, tree_id)
+
+    @classmethod
+    async def get_head(cls, tree_id: int, executor: ThreadPoolExecutor = None) -> "AsyncTree":
+        return await cls._wrap(executor, Tree.get_head, tree_id)
+
+    @classmethod
+    async def get_by_tag(cls, tag_name: str, executor: ThreadPoolExecutor = None) -> "AsyncTree":
+        return await cls._wrap(executor, Tree.get_by_tag, tag_name)
+
+    async def create_new_tree_version_from_tag(self, tag_name: str) -> "AsyncTree":
+        return AsyncTree(await self._run(self.tree.create_new_tree_version_from_tag, tag_name), self.executor)
+
+    async def restore_from_tag(self, tag_name: str) -> "AsyncTree":
+        return AsyncTree(await self._run(self.tree.restore_from_tag, tag_name), self.executor)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn(tree, *args, **kwargs) in one pool call, inside tree.transaction(),
+        serialized with the other writes.
+        """
+        def call():
+            with self.tree.transaction():
+                return fn(self.tree, *args, **kwargs)
+        async with self._write_lock:
+            return await self._run(call)
+
+    async def diff(self, version_a, version_b, workers: int = 1) -> list:
+        return await self._run(lambda: list(self.tree.diff(version_a, version_b, workers)))
+
+    async def iter_nodes(self, fields=None, page_size: int = 10_000):
+        """
+        Async generator over the nodes of the version, one page per pool call.
+        """
+        async for node in self._stream(self.tree.iter_nodes(fields, page_size), page_size):
+            yield node
+
+    async def iter_edges(self, fields=None, page_size: int = 10_000):
+        async for edge in self._stream(self.tree.iter_edges(fields, page_size), page_size):
+            yield edge
+
+    async def _stream(self, rows, page_size: int):
+        while True:
+            page = await self._run(lambda: list(islice(rows, page_size)))
+            if not page:
+                return
+            for row in page:
+                yield row
+
+    create_tag = _write("create_tag")
+    merge = _write("merge")
+    add_node = _write("add_node")
+    add_nodes = _write("add_nodes")
+    add_edge = _write("add_edge")
+    add_edges = _write("add_edges")
+    update_node = _write("update_node")
+    remove_node = _write("remove_node")
+    update_edge = _write("update_edge")
+    remove_edge = _write("remove_edge")
+
+    get_all_nodes = _read("get_all_nodes")
+    get_all_edges = _read("get_all_edges")
+    find_nodes = _read("find_nodes")
+    get_node = _read("get_node")
+    get_node_edges = _read("get_node_edges")
+    log = _read("log")
+    merge_base = _read("merge_base")
+    descendants = _read("descendants")
+    get_child_nodes = _read("get_child_nodes")
+    get_parent_nodes = _read("get_parent_nodes")
+    get_root_nodes = _read("get_root_nodes")
+    get_nodes_at_depth = _read("get_nodes_at_depth")
+    get_descendants = _read("get_descendants")
+    get_ancestors = _read("get_ancestors")
+    find_path = _read("find_path")
+    export_snapshot = _read("export_snapshot")
+
+    def __repr__(self):
+        return f"<AsyncTree {self.tree!r}>"
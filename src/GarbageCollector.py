@@ -0,0 +1,174 @@
+"""
+Garbage collection of versions that nothing can reach any more.
+
+A version is live when it is tagged, was created within the grace period (it may
+be the working version of an open Tree handle), is in the keep list, or is an
+ancestor of a live version. Every other version is swept together with its nodes
+and edges, in batches of bounded size, then the payloads no row references any
+more, and the freed pages are handed back with an incremental VACUUM.
+
+    python -m src.GarbageCollector --dry-run          # report reclaimable rows only
+    python -m src.GarbageCollector --max-seconds 5    # sweep for at most 5 seconds
+"""
+import argparse
+import json
+import time
+from db.database import get_connection, commit, transaction
+from src.TreeVersion import TreeVersion
+from src.Payload import Payload
+
+
+class GarbageCollector:
+    """
+    Mark-and-sweep over TreeVersion rows. grace_period is in seconds.
+    """
+
+    def __init__(self, grace_period: float = 3600, keep_version_ids=(), batch_size: int = 10_000):
+        self.grace_period = grace_period
+        self.keep_version_ids = list(keep_version_ids)
+        self.batch_size = batch_size
+
+    def unreachable_versions(self) -> list[TreeVersion]:
+        """
+        Mark phase: the versions not reachable from a tag, the grace period or the
+        keep list through parent_version_id chains, newest first.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH RECURSIVE reachable(version_id) AS (
+                SELECT tree_version_id FROM Tag
+                UNION
+                SELECT id FROM TreeVersion WHERE created_at > datetime('now', ?)
+                UNION
+                SELECT value FROM json_each(?)
+                UNION
+                SELECT v.parent_version_id
+                FROM TreeVersion v
+                JOIN reachable r ON v.id = r.version_id
+                WHERE v.parent_version_id IS NOT NULL
+            )
+            SELECT id, tree_id, parent_version_id, created_at
+            FROM TreeVersion
+            WHERE id NOT IN (SELECT version_id FROM reachable)
+            ORDER BY id DESC
+        """, (f"-{int(self.grace_period)} seconds", json.dumps(self.keep_version_ids)))
+        return [TreeVersion(r["id"], r["tree_id"], r["parent_version_id"], r["created_at"])
+                for r in cursor.fetchall()]
+
+    def report(self) -> dict:
+        """
+        Dry run: what collect() would reclaim, without deleting anything.
+        """
+        dead = self.unreachable_versions()
+        conn = get_connection()
+        cursor = conn.cursor()
+        counts = {"versions": len(dead)}
+        for key, table in (("nodes", "TreeNode"), ("edges", "TreeEdge")):
+            cursor.execute(f"""
+                SELECT COUNT(*) FROM {table}
+                WHERE tree_version_id IN (SELECT value FROM json_each(?))
+            """, (json.dumps([v.id for v in dead]),))
+            counts[key] = cursor.fetchone()[0]
+        return counts
+
+    def collect(self, max_seconds: float = None, vacuum_pages: int = None) -> dict:
+        """
+        Sweep the unreachable versions, one transaction of at most batch_size rows at
+        a time, then run an incremental VACUUM of at most vacuum_pages pages.
+
+        With max_seconds, stops after the batch that crosses the deadline (at least
+        one batch always runs); run it again to carry on. The result tells how far
+        it got: versions, rows and payloads deleted, whether the sweep is complete,
+        and the pages returned to the OS.
+
+        Each batch marks again inside its own transaction, under the write lock, and
+        skips the versions that were tagged or checked out since the last one.
+        """
+        deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+        dead = self.unreachable_versions()
+        result = {"versions": 0, "rows": 0, "payloads": 0, "complete": False, "pages_freed": 0}
+        while dead:
+            with transaction():
+                still_dead = {v.id for v in self.unreachable_versions()}
+                dead = [v for v in dead if v.id in still_dead]
+                budget = self.batch_size
+                while dead and budget > 0:
+                    deleted = dead[-1].delete_all_nodes_and_edges(limit=budget)
+                    result["rows"] += deleted
+                    if deleted < budget:
+                        dead.pop().delete()
+                        result["versions"] += 1
+                    budget -= deleted
+            if dead and deadline is not None and time.monotonic() >= deadline:
+                return result
+        while True:
+            with transaction():
+                deleted = Payload.delete_unreferenced(self.batch_size)
+            result["payloads"] += deleted
+            if deleted < self.batch_size:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return result
+        result["complete"] = True
+        if deadline is None or time.monotonic() < deadline:
+            result["pages_freed"] = self.vacuum(vacuum_pages)
+        return result
+
+    @staticmethod
+    def vacuum(pages: int = None) -> int:
+        """
+        Return up to pages free pages (all of them by default) to the OS.
+        Only databases in auto_vacuum=INCREMENTAL mode can do this online;
+        see enable_incremental_vacuum() for older ones.
+        """
+        conn = get_connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages or 0)})").fetchall()
+        commit()
+        return free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    @staticmethod
+    def enable_incremental_vacuum():
+        """
+        Switch a database created before auto_vacuum=INCREMENTAL to that mode.
+        Runs a full VACUUM, which rewrites the whole file: do it offline, once.
+        """
+        conn = get_connection()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    def __repr__(self):
+        return (f"<GarbageCollector grace_period={self.grace_period}, "
+                f"keep={self.keep_version_ids}, batch_size={self.batch_size}>")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database file (default: $TREE_SYSTEM_DB or tree_system.db)")
+    parser.add_argument("--dry-run", action="store_true", help="report reclaimable rows without deleting them")
+    parser.add_argument("--grace", type=float, default=3600, help="keep versions younger than this many seconds")
+    parser.add_argument("--keep", type=int, nargs="*", default=[], help="version ids to keep")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows deleted per transaction")
+    parser.add_argument("--max-seconds", type=float, help="stop sweeping after this many seconds")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="convert the database to auto_vacuum=INCREMENTAL with a full VACUUM first")
+    args = parser.parse_args()
+
+    from db.database import configure, close_all_connections
+    if args.db:
+        configure(args.db)
+    if args.enable_incremental_vacuum:
+        GarbageCollector.enable_incremental_vacuum()
+    collector = GarbageCollector(args.grace, args.keep, args.batch_size)
+    if args.dry_run:
+        print(collector.report())
+    else:
+        print(collector.collect(args.max_seconds))
+    close_all_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+from array import array
+from bisect import bisect_left
+from collections import deque
+from db.database import get_connection
+from src.TreeVersion import VERSION_CHAIN_CTE, visible_nodes_cte, visible_edges_cte
+
+
+class GraphIndex:
+    """
+    In-memory adjacency of one version, loaded in one pass and kept in CSR form:
+    the out-edges of the node at position i are out_targets/out_edge_ids[out_offsets[i]:out_offsets[i + 1]],
+    and the in-edges are stored the same way. Node ids are kept sorted, so a
+    node's position is found by bisection instead of a dict.
+
+    Only ids are held in memory; callers fetch payloads for the nodes they return.
+    Nodes and edges added after the load go into small overflow lists, which are
+    folded back into the arrays once they grow past a quarter of the edge count.
+    """
+
+    def __init__(self, tree_version_id: int, node_ids, edges):
+        """
+        node_ids: ascending node ids. edges: iterable of (edge_id, incoming_node_id, outgoing_node_id).
+        """
+        self.tree_version_id = tree_version_id
+        self.node_ids = array("q", node_ids)
+        self._build(list(edges))
+
+    @classmethod
+    def load(cls, tree_version_id: int) -> "GraphIndex":
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}
+            SELECT id FROM visible_nodes ORDER BY id
+        """, (tree_version_id,))
+        node_ids = [r[0] for r in cursor.fetchall()]
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte()}
+            SELECT id, incoming_node_id, outgoing_node_id FROM visible_edges ORDER BY id
+        """, (tree_version_id,))
+        return cls(tree_version_id, node_ids, cursor.fetchall())
+
+    def _build(self, edges):
+        n = len(self.node_ids)
+        out_degree = [0] * (n + 1)
+        in_degree = [0] * (n + 1)
+        resolved = []
+        for edge_id, node_in, node_out in edges:
+            i, j = self.position(node_in), self.position(node_out)
+            # Edges pointing at a removed node are not part of the graph
+            if i is None or j is None:
+                continue
+            resolved.append((edge_id, i, j))
+            out_degree[i + 1] += 1
+            in_degree[j + 1] += 1
+        for k in range(n):
+            out_degree[k + 1] += out_degree[k]
+            in_degree[k + 1] += in_degree[k]
+        self.out_offsets = array("q", out_degree)
+        self.in_offsets = array("q", in_degree)
+        self.out_targets = array("q", bytes(8 * len(resolved)))
+        self.out_edge_ids = array("q", bytes(8 * len(resolved)))
+        self.in_sources = array("q", bytes(8 * len(resolved)))
+        self.in_edge_ids = array("q", bytes(8 * len(resolved)))
+        out_fill = list(out_degree[:n])
+        in_fill = list(in_degree[:n])
+        for edge_id, i, j in resolved:
+            self.out_targets[out_fill[i]] = self.node_ids[j]
+            self.out_edge_ids[out_fill[i]] = edge_id
+            out_fill[i] += 1
+            self.in_sources[in_fill[j]] = self.node_ids[i]
+            self.in_edge_ids[in_fill[j]] = edge_id
+            in_fill[j] += 1
+        self.edge_count = len(resolved)
+        self._indexed_nodes = n
+        self._extra_out = {}
+        self._extra_in = {}
+        self._extra_edges = 0
+
+    def _edges(self):
+        for i in range(self._indexed_nodes):
+            node_in = self.node_ids[i]
+            for k in range(self.out_offsets[i], self.out_offsets[i + 1]):
+                yield self.out_edge_ids[k], node_in, self.out_targets[k]
+        for node_in, pairs in self._extra_out.items():
+            for edge_id, node_out in pairs:
+                yield edge_id, node_in, node_out
+
+    def compact(self):
+        """
+        Fold the overflow lists into the CSR arrays.
+        """
+        self._build(list(self._edges()))
+
+    # ------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------
+
+    def add_node(self, node_id: int):
+        if self.node_ids and node_id <= self.node_ids[-1]:
+            # Ids are allocated in increasing order; anything else needs a rebuild
+            if node_id in self:
+                return
+            edges = list(self._edges())
+            self.node_ids.insert(bisect_left(self.node_ids, node_id), node_id)
+            self._build(edges)
+        else:
+            self.node_ids.append(node_id)
+
+    def add_edge(self, edge_id: int, node_in: int, node_out: int):
+        if node_in not in self or node_out not in self:
+            return
+        self._extra_out.setdefault(node_in, []).append((edge_id, node_out))
+        self._extra_in.setdefault(node_out, []).append((edge_id, node_in))
+        self._extra_edges += 1
+        if self._extra_edges > max(64, self.edge_count // 4):
+            self.compact()
+
+    # ------------------------------------------------------------------
+    # Lookups (all in node ids)
+    # ------------------------------------------------------------------
+
+    def position(self, node_id: int):
+        i = bisect_left(self.node_ids, node_id)
+        if i < len(self.node_ids) and self.node_ids[i] == node_id:
+            return i
+        return None
+
+    def __contains__(self, node_id: int) -> bool:
+        return self.position(node_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def out_edges(self, node_id: int) -> list[tuple[int, int]]:
+        """
+        (edge_id, outgoing_node_id) pairs of the edges leaving node_id.
+        """
+        i = self.position(node_id)
+        if i is None:
+            return []
+        pairs = []
+        if i < self._indexed_nodes:
+            start, end = self.out_offsets[i], self.out_offsets[i + 1]
+            pairs = list(zip(self.out_edge_ids[start:end], self.out_targets[start:end]))
+        return pairs + self._extra_out.get(node_id, [])
+
+    def in_edges(self, node_id: int) -> list[tuple[int, int]]:
+        """
+        (edge_id, incoming_node_id) pairs of the edges entering node_id.
+        """
+        i = self.position(node_id)
+        if i is None:
+            return []
+        pairs = []
+        if i < self._indexed_nodes:
+            start, end = self.in_offsets[i], self.in_offsets[i + 1]
+            pairs = list(zip(self.in_edge_ids[start:end], self.in_sources[start:end]))
+        return pairs + self._extra_in.get(node_id, [])
+
+    def children(self, node_id: int) -> list[int]:
+        return [node_out for _, node_out in self.out_edges(node_id)]
+
+    def parents(self, node_id: int) -> list[int]:
+        return [node_in for _, node_in in self.in_edges(node_id)]
+
+    def roots(self) -> list[int]:
+        roots = []
+        for i, node_id in enumerate(self.node_ids):
+            if i < self._indexed_nodes and self.in_offsets[i] != self.in_offsets[i + 1]:
+                continue
+            if node_id in self._extra_in:
+                continue
+            roots.append(node_id)
+        return roots
+
+    def nodes_at_depth(self, depth: int) -> list[int]:
+        """
+        Nodes whose shortest distance from a root is depth (breadth-first, level by level).
+        """
+        if depth < 0:
+            return []
+        visited = bytearray(len(self.node_ids))
+        frontier = self.roots()
+        for node_id in frontier:
+            visited[self.position(node_id)] = 1
+        for _ in range(depth):
+            next_frontier = []
+            for node_id in frontier:
+                for child in self.children(node_id):
+                    j = self.position(child)
+                    if not visited[j]:
+                        visited[j] = 1
+                        next_frontier.append(child)
+            frontier = next_frontier
+            if not frontier:
+                break
+        return frontier
+
+    def descendants(self, node_id: int, max_depth: int = None) -> list[int]:
+        """
+        Nodes reachable from node_id (excluded), nearest first.
+        """
+        if node_id not in self:
+            return []
+        seen = {node_id}
+        frontier = [node_id]
+        results = []
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+            for current in frontier:
+                for child in self.children(current):
+                    if child not in seen:
+                        seen.add(child)
+                        next_frontier.append(child)
+            results.extend(next_frontier)
+            frontier = next_frontier
+            depth += 1
+        return results
+
+    def ancestors(self, node_id: int) -> list[int]:
+        """
+        Nodes node_id can be reached from (excluded), nearest first.
+        """
+        if node_id not in self:
+            return []
+        seen = {node_id}
+        queue = deque([node_id])
+        results = []
+        while queue:
+            for parent in self.parents(queue.popleft()):
+                if parent not in seen:
+                    seen.add(parent)
+                    results.append(parent)
+                    queue.append(parent)
+        return results
+
+    def find_path(self, start_node_id: int, end_node_id: int) -> list[tuple[int, int]]:
+        """
+        Shortest path following edge direction, as (node_id, edge_id to the next node) pairs.
+        The last pair carries None as its edge. Empty when there is no path.
+        """
+        if start_node_id not in self or end_node_id not in self:
+            return []
+        # came_from[node] = (previous node, edge used to reach node)
+        came_from = {start_node_id: None}
+        queue = deque([start_node_id])
+        while queue:
+            current = queue.popleft()
+            if current == end_node_id:
+                break
+            for edge_id, nxt in self.out_edges(current):
+                if nxt not in came_from:
+                    came_from[nxt] = (current, edge_id)
+                    queue.append(nxt)
+        if end_node_id not in came_from:
+            return []
+
+        path = [(end_node_id, None)]
+        node_id = end_node_id
+        while came_from[node_id] is not None:
+            node_id, edge_id = came_from[node_id]
+            path.append((node_id, edge_id))
+        path.reverse()
+        return path
+
+    def __repr__(self):
+        return (f"<GraphIndex version={self.tree_version_id}, nodes={len(self.node_ids)}, "
+                f"edges={self.edge_count + self._extra_edges}>")
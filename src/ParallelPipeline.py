@@ -0,0 +1,81 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from db.database import connection_manager, configure, get_connection
+from src.TreeVersion import VERSION_CHAIN_CTE
+
+
+def _open_read_only(db_path: str, busy_timeout: float):
+    configure(db_path, busy_timeout, read_only=True)
+
+
+class ParallelPipeline:
+    """
+    Opt-in process pool for the reads over a whole version that spend their time in
+    Python rather than in SQLite: snapshot export (encoding and compression) and diff.
+
+    The version is split into partitions of contiguous node or edge ids. Each worker
+    process resolves and encodes its partitions on its own read-only connection, so
+    the partitions run on separate cores without sharing the GIL, and the caller
+    merges the results in id order through the one writer it already has.
+
+    Workers read the last committed state of the file: commit before using them.
+    Processes are spawned, not forked, so no connection of the caller is inherited.
+    """
+
+    def __init__(self, workers: int, partitions: int = None):
+        if workers < 1:
+            raise ValueError("A ParallelPipeline needs at least one worker.")
+        if connection_manager.db_path == ":memory:":
+            raise ValueError("Worker processes cannot open an in-memory database.")
+        self.workers = workers
+        self.partitions = partitions or workers
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_open_read_only, initargs=(connection_manager.db_path, connection_manager.busy_timeout)
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._pool.shutdown(cancel_futures=exc_type is not None)
+        self._pool = None
+
+    def ranges(self, table: str, id_column: str, *version_ids: int) -> list[tuple[int, int]]:
+        """
+        Split the ids of table in the chains of version_ids into inclusive (low, high)
+        ranges of equal width, in id order. Empty when the chains have no rows.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        low = high = None
+        for version_id in version_ids:
+            # One index seek per version for each bound, instead of a scan of the chain's rows
+            cursor.execute(f"""
+                WITH RECURSIVE {VERSION_CHAIN_CTE}
+                SELECT MIN((SELECT MIN(t.{id_column}) FROM {table} t WHERE t.tree_version_id = c.version_id)),
+                       MAX((SELECT MAX(t.{id_column}) FROM {table} t WHERE t.tree_version_id = c.version_id))
+                FROM version_chain c
+            """, (version_id,))
+            chain_low, chain_high = cursor.fetchone()
+            if chain_low is not None:
+                low = chain_low if low is None else min(low, chain_low)
+                high = chain_high if high is None else max(high, chain_high)
+        if low is None:
+            return []
+        width = -(-(high - low + 1) // self.partitions)
+        return [(start, min(start + width - 1, high)) for start in range(low, high + 1, width)]
+
+    def map(self, fn, ranges: list[tuple[int, int]], *args) -> list:
+        """
+        fn(*args, low, high) for every range on the pool, results in the order of ranges.
+        fn must be a module-level function, so the spawned workers can import it.
+        """
+        if self._pool is None:
+            raise ValueError("Use the ParallelPipeline as a context manager.")
+        futures = [self._pool.submit(fn, *args, low, high) for low, high in ranges]
+        return [future.result() for future in futures]
+
+    def __repr__(self):
+        return f"<ParallelPipeline workers={self.workers}, partitions={self.partitions}>"
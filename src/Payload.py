@@ -0,0 +1,128 @@
+import json
+import re
+from db.database import get_connection
+from db.functions import payload_hash
+
+PAYLOAD_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+INDEX_PREFIX = "idx_payload_"
+
+
+class Payload:
+    """
+    Content-addressed store of node and edge payloads: every distinct JSON text is
+    stored once, under its payload_hash, and TreeNode / TreeEdge rows hold the hash.
+    Identical payloads within and across versions share one row, and rows with the
+    same hash are known to be equal without reading their data.
+
+    put() and put_many() do not commit; they are part of the caller's write.
+
+    Hot keys can be indexed with create_index(); lookups by such a key (see
+    TreeNode.find) then search the index instead of decoding every payload.
+    """
+
+    @staticmethod
+    def key_expression(key: str, column: str = "data") -> str:
+        """
+        json_extract of key ("setting" or a dotted path like "attrs.a") from column.
+        The path is inlined, since SQLite only uses an index on an expression for the
+        very same expression, so keys are restricted to identifiers.
+        """
+        if not PAYLOAD_KEY.match(key):
+            raise ValueError(f"Invalid payload key '{key}', expected identifiers separated by dots.")
+        return f"json_extract({column}, '$.{key}')"
+
+    @staticmethod
+    def index_name(key: str) -> str:
+        """
+        Name of the index on key. "_" is escaped before "." is, so that distinct
+        keys such as "a.b" and "a__b" never share a name.
+        """
+        return INDEX_PREFIX + key.replace("_", "_u").replace(".", "_d")
+
+    @classmethod
+    def create_index(cls, key: str):
+        """
+        Index the payloads on key. Applies to the payloads of every tree.
+        """
+        expression = cls.key_expression(key)
+        if key in cls._indexes():
+            return
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {cls.index_name(key)} ON Payload({expression})")
+
+    @classmethod
+    def drop_index(cls, key: str):
+        cls.key_expression(key)
+        conn = get_connection()
+        cursor = conn.cursor()
+        # By expression, so indexes named by an earlier scheme are found too
+        for name in cls._indexes().get(key, []):
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+    @classmethod
+    def indexed_keys(cls) -> list[str]:
+        return sorted(cls._indexes())
+
+    @staticmethod
+    def _indexes() -> dict[str, list[str]]:
+        """
+        The payload key indexes, as {key: [index names]}.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = 'Payload' AND name LIKE ?
+            ORDER BY name
+        """, (INDEX_PREFIX + "%",))
+        indexes = {}
+        for r in cursor.fetchall():
+            indexes.setdefault(re.search(r"'\$\.([^']*)'", r["sql"]).group(1), []).append(r["name"])
+        return indexes
+
+    @staticmethod
+    def put(data: dict) -> bytes:
+        text = json.dumps(data)
+        digest = payload_hash(text)
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO Payload (hash, data) VALUES (?, ?)", (digest, text))
+        return digest
+
+    @staticmethod
+    def put_many(datas) -> list[bytes]:
+        """
+        Store every payload of datas with one executemany; return their hashes in order.
+        """
+        return Payload.put_texts([json.dumps(data) for data in datas])
+
+    @staticmethod
+    def put_texts(texts: list[str]) -> list[bytes]:
+        """
+        put_many for payloads that are already JSON text, e.g. read from a snapshot.
+        """
+        digests = [payload_hash(text) for text in texts]
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.executemany("INSERT OR IGNORE INTO Payload (hash, data) VALUES (?, ?)", zip(digests, texts))
+        return digests
+
+    @staticmethod
+    def delete_unreferenced(limit: int = None) -> int:
+        """
+        Delete up to limit payloads no node or edge row references any more and
+        return how many were deleted. Does not commit.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE FROM Payload
+            WHERE hash IN (
+                SELECT p.hash FROM Payload p
+                WHERE NOT EXISTS (SELECT 1 FROM TreeNode n WHERE n.data_hash = p.hash)
+                  AND NOT EXISTS (SELECT 1 FROM TreeEdge e WHERE e.data_hash = p.hash)
+                LIMIT ?
+            )
+        """, (-1 if limit is None else limit,))
+        return cursor.rowcount
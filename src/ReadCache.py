@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict
+from db.database import add_invalidation_hook, after_commit
+
+# Rough per-entry cost of the key, the row tuple and the bookkeeping, on top of
+# the payload text the entry is charged for.
+ENTRY_OVERHEAD = 256
+# Versions whose last invalidation is remembered for put(); past that, the
+# record is dropped and every read in flight is treated as stale
+MAX_TRACKED_VERSIONS = 10_000
+
+
+class ReadCache:
+    """
+    Bounded LRU cache of model lookups, shared by all threads of the process.
+
+    Entries are keyed by a tuple such as ("node", version_id, node_id) and filed
+    under the version they were read from. Model writes invalidate every entry of
+    the version they write to, once when they run and again when they commit: until
+    then other threads still read, and may cache, the old rows. Tagged versions are
+    never written to, so their entries stay until they are evicted. The whole cache
+    is dropped when the database is switched or a transaction rolls back.
+
+    Readers take a stamp() before querying and hand it to put(), which drops the
+    value if its version was invalidated in between: a read that started before a
+    commit can return the old rows after the commit's invalidation has run.
+
+    Values are tuples of row values, which nobody can modify: the models build
+    fresh objects from them on every hit.
+    """
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_version = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, max_entries: int = None, max_bytes: int = None):
+        """
+        Change the budget. max_entries=0 turns the cache off.
+        """
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key):
+        """
+        The cached value for key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def stamp(self) -> int:
+        """
+        Token to pass to put() for a value read from the database from now on.
+        """
+        with self._lock:
+            return self._clock
+
+    def put(self, key, version_id, value, size: int = 0, stamp: int = None):
+        """
+        Cache value under key, charged size bytes of payload, and file it under
+        version_id (None for entries that no version write affects). With the
+        stamp() taken before the read, a value that may be stale is not cached.
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            if stamp is not None and max(self._cleared, self._invalidated.get(version_id, 0)) > stamp:
+                return
+            self._remove(key)
+            size += ENTRY_OVERHEAD
+            self._entries[key] = (value, version_id, size)
+            self._by_version.setdefault(version_id, set()).add(key)
+            self._bytes += size
+            self._evict()
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._remove(key):
+                self.invalidations += 1
+
+    def invalidate_version(self, version_id: int):
+        """
+        Drop the entries read from version_id, after a write to it, and again
+        once the write commits.
+        """
+        self._invalidate_version(version_id)
+        after_commit(self._invalidate_version, version_id)
+
+    def _invalidate_version(self, version_id: int):
+        with self._lock:
+            self._clock += 1
+            if len(self._invalidated) >= MAX_TRACKED_VERSIONS:
+                self._invalidated.clear()
+                self._cleared = self._clock
+            self._invalidated[version_id] = self._clock
+            for key in self._by_version.pop(version_id, ()):
+                _, _, size = self._entries.pop(key)
+                self._bytes -= size
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._invalidated.clear()
+            self._cleared = self._clock
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_version.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Counters for monitoring.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+                "entries": len(self._entries), "bytes": self._bytes,
+            }
+
+    def _remove(self, key) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        _, version_id, size = entry
+        self._bytes -= size
+        keys = self._by_version.get(version_id)
+        keys.discard(key)
+        if not keys:
+            del self._by_version[version_id]
+        return True
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def __repr__(self):
+        return f"<ReadCache entries={len(self._entries)}, bytes={self._bytes}, max_entries={self.max_entries}>"
+
+
+read_cache = ReadCache()
+add_invalidation_hook(read_cache.clear)
@@ -0,0 +1,357 @@
+"""
+Binary snapshots of a tagged version, to move it between databases without
+copying the whole file.
+
+    header  MAGIC, format version byte, flags byte (FLAG_ZLIB: the body is compressed)
+    body    tree name, tag name, tag description   (varint length + UTF-8)
+            node blocks, then edge blocks
+
+Each block holds the payloads first used in it, appended to a dictionary shared
+by nodes and edges, then its records; a block without records ends the section:
+
+    varint flags (BLOCK_RESET: empty the dictionary and restart the ids at 0 first)
+    varint payload count, payloads (varint length + JSON text)
+    varint record count, varint size of the records in bytes, records
+        node    varint id delta, varint payload index
+        edge    varint id delta, varint incoming node id, varint outgoing node id, varint payload index
+
+Records are sorted by id and store the gap to the previous id. Every value is an
+unsigned LEB128 varint. Blocks are written and read as the version is streamed:
+besides one block, the writer only keeps the payload dictionary in memory, and
+the reader the dictionary and the map of old to new node ids.
+
+A parallel export (see ParallelPipeline) encodes partitions of the ids apart, each
+starting with BLOCK_RESET, and concatenates them. That is why a compressed body is a
+raw deflate stream since format version 2 (zlib-wrapped in version 1, whose blocks
+have no flags): deflate segments flushed on a byte boundary concatenate, a zlib
+checksum over the whole body could not be computed from the partitions' own.
+"""
+import io
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from db.database import get_connection
+from src.Tag import Tag
+from src.TreeVersion import TreeVersion, VERSION_CHAIN_CTE, visible_nodes_cte, visible_edges_cte
+from src.TreeNode import TreeNode
+from src.TreeEdge import TreeEdge
+from src.Payload import Payload
+from src.ParallelPipeline import ParallelPipeline
+
+MAGIC = b"KTVSNAP"
+FORMAT_VERSION = 2
+FLAG_ZLIB = 1
+BLOCK_RESET = 1
+BLOCK_SIZE = 10_000
+READ_SIZE = 1 << 16
+
+# section: (table, id column, alias in its CTE, visible rows CTE, columns written)
+SECTIONS = {
+    "nodes": ("TreeNode", "node_id", "n", visible_nodes_cte, "id, data_hash, data"),
+    "edges": ("TreeEdge", "edge_id", "e", visible_edges_cte,
+              "id, incoming_node_id, outgoing_node_id, data_hash, data"),
+}
+# The values a record stores between its id delta and its payload index
+SECTION_FIELDS = {
+    "nodes": lambda r: (),
+    "edges": lambda r: (r["incoming_node_id"], r["outgoing_node_id"]),
+}
+
+
+def write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varints(data: bytes) -> list[int]:
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            values.append(value)
+            value = shift = 0
+        else:
+            shift += 7
+    if shift:
+        raise ValueError("Truncated varint in snapshot.")
+    return values
+
+
+def write_string(out: bytearray, text: str):
+    data = text.encode()
+    write_varint(out, len(data))
+    out += data
+
+
+class SnapshotWriter:
+    """
+    Writes the live nodes and edges of a tagged version to a binary stream.
+    With workers > 1, each section is encoded in partitions on a ParallelPipeline.
+    """
+
+    def __init__(self, stream, compress: bool = True, workers: int = 1):
+        self.stream = stream
+        self.compress = compress
+        self.workers = workers
+        self._compressor = zlib.compressobj(wbits=-15) if compress else None
+        self._payloads = {}
+        self._new_payloads = []
+        self._flags = 0
+        self.counts = {"nodes": 0, "edges": 0, "payloads": 0, "bytes": 0}
+
+    def write(self, tree_name: str, tag: Tag) -> dict:
+        """
+        Write the snapshot of tag and return the number of nodes, edges and
+        payloads written and the size of the snapshot in bytes. A parallel export
+        writes a payload once per partition that uses it.
+        """
+        self._write_raw(MAGIC + bytes((FORMAT_VERSION, FLAG_ZLIB if self._compressor else 0)))
+        out = bytearray()
+        for text in (tree_name, tag.tag_name, tag.description or ""):
+            write_string(out, text)
+        self._write(out)
+
+        if self.workers > 1:
+            with ParallelPipeline(self.workers) as pipeline:
+                for section in SECTIONS:
+                    self.counts[section] = self._write_partitions(pipeline, section, tag.tree_version_id)
+        else:
+            for section in SECTIONS:
+                self.counts[section] = self._write_section(self._rows(section, tag.tree_version_id), section)
+                self._write_block(bytearray(), 0)
+
+        if self._compressor:
+            self._write_raw(self._compressor.flush())
+        self.counts["payloads"] += len(self._payloads)
+        return self.counts
+
+    @staticmethod
+    def _rows(section: str, version_id: int, low: int = None, high: int = None):
+        """
+        Cursor over the live rows of section ("nodes" or "edges") in id order,
+        only those with an id between low and high when given.
+        """
+        table, id_column, alias, cte, columns = SECTIONS[section]
+        where = f"{alias}.{id_column} BETWEEN ? AND ?" if low is not None else "1"
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {cte(where)}
+            SELECT {columns} FROM visible_{section} ORDER BY id
+        """, (version_id,) if low is None else (version_id, low, high))
+        return cursor
+
+    def _write_section(self, rows, section: str) -> int:
+        fields = SECTION_FIELDS[section]
+        count = 0
+        records = bytearray()
+        in_block = 0
+        last_id = 0
+        for r in rows:
+            write_varint(records, r["id"] - last_id)
+            last_id = r["id"]
+            for value in fields(r):
+                write_varint(records, value)
+            write_varint(records, self._payload_index(r["data_hash"], r["data"]))
+            in_block += 1
+            if in_block == BLOCK_SIZE:
+                self._write_block(records, in_block)
+                count += in_block
+                records = bytearray()
+                in_block = 0
+        if in_block:
+            self._write_block(records, in_block)
+            count += in_block
+        return count
+
+    def _write_partitions(self, pipeline: ParallelPipeline, section: str, version_id: int) -> int:
+        table, id_column = SECTIONS[section][:2]
+        ranges = pipeline.ranges(table, id_column, version_id)
+        if self._compressor:
+            # End on a byte boundary, with no back-reference the partitions could break
+            self._write_raw(self._compressor.flush(zlib.Z_FULL_FLUSH))
+        count = 0
+        for data, records, payloads in pipeline.map(_write_partition, ranges, section, version_id, self.compress):
+            self._write_raw(data)
+            count += records
+            self.counts["payloads"] += payloads
+        self._write_block(bytearray(), 0)
+        return count
+
+    def _payload_index(self, data_hash: bytes, data: str) -> int:
+        index = self._payloads.get(data_hash)
+        if index is None:
+            index = self._payloads[data_hash] = len(self._payloads)
+            self._new_payloads.append(data)
+        return index
+
+    def _write_block(self, records: bytearray, count: int):
+        out = bytearray()
+        write_varint(out, self._flags)
+        self._flags = 0
+        write_varint(out, len(self._new_payloads))
+        for text in self._new_payloads:
+            write_string(out, text)
+        self._new_payloads = []
+        write_varint(out, count)
+        write_varint(out, len(records))
+        out += records
+        self._write(out)
+
+    def _write(self, data: bytes):
+        self._write_raw(self._compressor.compress(data) if self._compressor else data)
+
+    def _write_raw(self, data: bytes):
+        if data:
+            self.stream.write(data)
+            self.counts["bytes"] += len(data)
+
+
+def _write_partition(section: str, version_id: int, compress: bool, low: int, high: int) -> tuple[bytes, int, int]:
+    """
+    Worker side of a parallel export: the blocks of the ids between low and high,
+    the first one with BLOCK_RESET, compressed to a segment that ends on a byte
+    boundary. Returns the data and the number of records and payloads in it.
+    """
+    writer = SnapshotWriter(io.BytesIO(), compress)
+    writer._flags = BLOCK_RESET
+    count = writer._write_section(writer._rows(section, version_id, low, high), section)
+    if writer._compressor:
+        writer._write_raw(writer._compressor.flush(zlib.Z_SYNC_FLUSH))
+    return writer.stream.getvalue(), count, len(writer._payloads)
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot written by SnapshotWriter from a binary stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffer = b""
+        self._pos = 0
+        self._decompressor = None
+        self._eof = False
+        header = stream.read(len(MAGIC) + 2)
+        if len(header) != len(MAGIC) + 2 or header[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a tree snapshot.")
+        self.format_version = header[len(MAGIC)]
+        if self.format_version not in (1, FORMAT_VERSION):
+            raise ValueError(f"Unsupported snapshot format version {self.format_version}.")
+        if header[len(MAGIC) + 1] & FLAG_ZLIB:
+            self._decompressor = zlib.decompressobj() if self.format_version == 1 else zlib.decompressobj(-15)
+        self.tree_name = self._read_string()
+        self.tag_name = self._read_string()
+        self.description = self._read_string()
+
+    def load(self, tree_id: int, tag_name: str = None) -> Tag:
+        """
+        Insert the snapshot as the root version of tree_id, tagged tag_name (by default
+        the tag it was exported from), and return the tag. Node and edge ids are
+        assigned anew; edge endpoints are remapped to them.
+
+        Does not commit: run it inside a transaction, so a bad snapshot loads nothing.
+        """
+        tag_name = tag_name or self.tag_name
+        if Tag.get_by_name(tag_name):
+            raise ValueError(f"Tag '{tag_name}' already exists.")
+        version = TreeVersion.create(tree_id)
+        payloads = []
+        # Old ids come sorted, so two flat arrays and a bisect map them to the new
+        # ids in a fraction of the memory of a dict
+        old_ids, new_ids = array("q"), array("q")
+        for ids, records in self._read_section(payloads, 1):
+            old_ids.extend(ids)
+            new_ids.extend(TreeNode.create_many_hashed(version.id, (payloads[r[0]] for r in records), BLOCK_SIZE))
+
+        def node_id(old_id: int) -> int:
+            i = bisect_left(old_ids, old_id)
+            if i == len(old_ids) or old_ids[i] != old_id:
+                raise ValueError(f"Snapshot edge references unknown node {old_id}.")
+            return new_ids[i]
+
+        for _, records in self._read_section(payloads, 3):
+            TreeEdge.create_many_hashed(version.id, (
+                (node_id(node_in), node_id(node_out), payloads[index]) for node_in, node_out, index in records
+            ), BLOCK_SIZE)
+        return Tag.create(tree_id, version.id, tag_name, self.description)
+
+    def _read_section(self, payloads: list, fields: int):
+        """
+        Yield (ids, records) per block, records being tuples of fields varints,
+        storing the block's new payloads first and appending their hashes to payloads.
+        """
+        last_id = 0
+        while True:
+            if self.format_version > 1 and self._read_varint() & BLOCK_RESET:
+                # A partition of a parallel export: its payload indices and ids start over
+                payloads.clear()
+                last_id = 0
+            texts = [self._read_string() for _ in range(self._read_varint())]
+            if texts:
+                payloads.extend(Payload.put_texts(texts))
+            count = self._read_varint()
+            size = self._read_varint()
+            if not count:
+                return
+            # Decoding the whole block in one loop is much faster than per value
+            values = read_varints(self._read_bytes(size))
+            if len(values) != count * (fields + 1):
+                raise ValueError("Corrupt snapshot block.")
+            ids = list(accumulate(values[::fields + 1], initial=last_id))[1:]
+            last_id = ids[-1]
+            records = list(zip(*(values[i::fields + 1] for i in range(1, fields + 1))))
+            yield ids, records
+
+    def _read_varint(self) -> int:
+        if self._pos + 10 > len(self._buffer):
+            self._fill(10)
+        buffer, pos = self._buffer, self._pos
+        value = shift = 0
+        try:
+            while True:
+                byte = buffer[pos]
+                pos += 1
+                value |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+        except IndexError:
+            raise ValueError("Truncated snapshot.") from None
+        self._pos = pos
+        return value
+
+    def _read_string(self) -> str:
+        return self._read_bytes(self._read_varint()).decode()
+
+    def _read_bytes(self, size: int) -> bytes:
+        if self._pos + size > len(self._buffer):
+            self._fill(size)
+            if size > len(self._buffer):
+                raise ValueError("Truncated snapshot.")
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+    def _fill(self, size: int):
+        """
+        Read from the stream until size bytes are buffered or it ends.
+        """
+        chunks = [self._buffer[self._pos:]]
+        available = len(chunks[0])
+        while available < size and not self._eof:
+            data = self.stream.read(READ_SIZE)
+            if not data:
+                self._eof = True
+                if self._decompressor:
+                    data = self._decompressor.flush()
+            elif self._decompressor:
+                data = self._decompressor.decompress(data)
+            chunks.append(data)
+            available += len(data)
+        self._buffer = b"".join(chunks)
+        self._pos = 0
@@ -0,0 +1,158 @@
+import json
+from db.database import get_connection
+from src.TreeVersion import VERSION_CHAIN_CTE, LIVE_EDGES_CTE, visible_nodes_cte
+
+
+class SqlTraversal:
+    """
+    Traversals of one version pushed down into SQLite with WITH RECURSIVE queries.
+    Nothing but the result ids is brought into Python, which makes it the engine
+    to use on versions too large to load into a GraphIndex.
+
+    Offers the same id-based interface as GraphIndex.
+    """
+
+    def __init__(self, tree_version_id: int):
+        self.tree_version_id = tree_version_id
+
+    def _ids(self, sql: str, params: tuple) -> list[int]:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(sql, (self.tree_version_id,) + params)
+        return [r[0] for r in cursor.fetchall()]
+
+    def children(self, node_id: int) -> list[int]:
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE}
+            SELECT outgoing_node_id FROM live_edges WHERE incoming_node_id = ?
+        """, (node_id,))
+
+    def parents(self, node_id: int) -> list[int]:
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE}
+            SELECT incoming_node_id FROM live_edges WHERE outgoing_node_id = ?
+        """, (node_id,))
+
+    def roots(self) -> list[int]:
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}, {LIVE_EDGES_CTE}
+            SELECT n.id FROM visible_nodes n
+            WHERE NOT EXISTS (SELECT 1 FROM live_edges e WHERE e.outgoing_node_id = n.id)
+            ORDER BY n.id
+        """, ())
+
+    def nodes_at_depth(self, depth: int) -> list[int]:
+        """
+        Nodes whose shortest distance from a root is depth, in one query.
+        """
+        if depth < 0:
+            return []
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}, {LIVE_EDGES_CTE},
+            walk(node_id, depth) AS (
+                SELECT n.id, 0 FROM visible_nodes n
+                WHERE NOT EXISTS (SELECT 1 FROM live_edges e WHERE e.outgoing_node_id = n.id)
+                UNION
+                SELECT e.outgoing_node_id, w.depth + 1
+                FROM walk w
+                CROSS JOIN live_edges e ON e.incoming_node_id = w.node_id
+                WHERE w.depth < ?
+            )
+            SELECT node_id FROM walk
+            GROUP BY node_id
+            HAVING MIN(depth) = ?
+            ORDER BY node_id
+        """, (depth, depth))
+
+    def descendants(self, node_id: int, max_depth: int = None) -> list[int]:
+        """
+        Nodes reachable from node_id (excluded), nearest first, in one query.
+        """
+        if max_depth is None:
+            # Deduplicating on the node alone terminates on cycles as well
+            return self._ids(f"""
+                WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE},
+                walk(node_id) AS (
+                    SELECT ?
+                    UNION
+                    SELECT e.outgoing_node_id
+                    FROM walk w
+                    CROSS JOIN live_edges e ON e.incoming_node_id = w.node_id
+                )
+                SELECT node_id FROM walk WHERE node_id != ?
+            """, (node_id, node_id))
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE},
+            walk(node_id, depth) AS (
+                SELECT ?, 0
+                UNION
+                SELECT e.outgoing_node_id, w.depth + 1
+                FROM walk w
+                CROSS JOIN live_edges e ON e.incoming_node_id = w.node_id
+                WHERE w.depth < ?
+            )
+            SELECT node_id FROM walk
+            WHERE node_id != ?
+            GROUP BY node_id
+            ORDER BY MIN(depth), node_id
+        """, (node_id, max_depth, node_id))
+
+    def ancestors(self, node_id: int) -> list[int]:
+        """
+        Nodes node_id can be reached from (excluded), in one query.
+        """
+        return self._ids(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE},
+            walk(node_id) AS (
+                SELECT ?
+                UNION
+                SELECT e.incoming_node_id
+                FROM walk w
+                CROSS JOIN live_edges e ON e.outgoing_node_id = w.node_id
+            )
+            SELECT node_id FROM walk WHERE node_id != ?
+        """, (node_id, node_id))
+
+    def find_path(self, start_node_id: int, end_node_id: int) -> list[tuple[int, int]]:
+        """
+        Shortest path following edge direction, as (node_id, edge_id to the next node) pairs.
+        Breadth-first with one query per level, each returning the whole next frontier.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte("n.node_id IN (?, ?)")}
+            SELECT COUNT(*) FROM visible_nodes
+        """, (self.tree_version_id, start_node_id, end_node_id))
+        if cursor.fetchone()[0] != len({start_node_id, end_node_id}):
+            return []
+
+        came_from = {start_node_id: None}
+        frontier = [start_node_id]
+        while frontier and end_node_id not in came_from:
+            cursor.execute(f"""
+                WITH RECURSIVE {VERSION_CHAIN_CTE}, {LIVE_EDGES_CTE}
+                SELECT incoming_node_id, id, outgoing_node_id
+                FROM live_edges
+                WHERE incoming_node_id IN (SELECT value FROM json_each(?))
+                ORDER BY incoming_node_id, id
+            """, (self.tree_version_id, json.dumps(frontier)))
+            next_frontier = []
+            for node_in, edge_id, node_out in cursor.fetchall():
+                if node_out not in came_from:
+                    came_from[node_out] = (node_in, edge_id)
+                    next_frontier.append(node_out)
+            frontier = next_frontier
+        if end_node_id not in came_from:
+            return []
+
+        path = [(end_node_id, None)]
+        node_id = end_node_id
+        while came_from[node_id] is not None:
+            node_id, edge_id = came_from[node_id]
+            path.append((node_id, edge_id))
+        path.reverse()
+        return path
+
+    def __repr__(self):
+        return f"<SqlTraversal version={self.tree_version_id}>"
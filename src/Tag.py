@@ -1,9 +1,12 @@
 
 from datetime import datetime
-from db.database import get_connection
+from db.database import get_connection, write
+from src.ReadCache import read_cache
 
 
 class Tag:
+    __slots__ = ("id", "tree_id", "tree_version_id", "tag_name", "description", "created_at")
+
     def __init__(self, id_, tree_id, tree_version_id, tag_name, description, created_at):
         self.id = id_
         self.tree_id = tree_id
@@ -14,17 +17,22 @@ class Tag:
 
     @classmethod
     def create(cls, tree_id: int, tree_version_id: int, tag_name: str, description: str="") -> "Tag":
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO Tag (tree_id, tree_version_id, tag_name, description)
-            VALUES (?, ?, ?, ?)
-        """, (tree_id, tree_version_id, tag_name, description))
-        conn.commit()
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO Tag (tree_id, tree_version_id, tag_name, description)
+                VALUES (?, ?, ?, ?)
+            """, (tree_id, tree_version_id, tag_name, description))
+        read_cache.invalidate(("tag", tag_name))
         return cls(cursor.lastrowid, tree_id, tree_version_id, tag_name, description, datetime.now())
 
     @classmethod
     def get_by_name(cls, tag_name: str) -> "Tag" :
+        key = ("tag", tag_name)
+        row = read_cache.get(key)
+        if row is not None:
+            return cls(*row)
+        stamp = read_cache.stamp()
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
@@ -35,7 +43,10 @@ class Tag:
         row = cursor.fetchone()
         if not row:
             return None
-        return cls(row["id"], row["tree_id"], row["tree_version_id"], row["tag_name"], row["description"], row["created_at"])
+        row = (row["id"], row["tree_id"], row["tree_version_id"], row["tag_name"], row["description"], row["created_at"])
+        # Tags are never moved, so no version write can make the entry stale
+        read_cache.put(key, None, row, len(row[4] or ""), stamp)
+        return cls(*row)
 
     @classmethod
     def get_version_id_for_tag(cls, tag_name: str) -> int :
@@ -1,11 +1,17 @@
-import json
+import io
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from db.database import get_connection
-from collections import deque
+from db.database import get_connection, write, transaction, after_commit
 from src.Tag import Tag
-from src.TreeVersion import TreeVersion
+from src.TreeVersion import TreeVersion, VERSION_CHAIN_CTE, visible_nodes_cte, visible_edges_cte
 from src.TreeNode import TreeNode
 from src.TreeEdge import TreeEdge
+from src.GraphIndex import GraphIndex
+from src.SqlTraversal import SqlTraversal
+from src.VersionDiff import VersionDiff
+from src.VersionMerge import VersionMerge
+from src.Snapshot import SnapshotWriter, SnapshotReader
 
 class Tree:
     """
@@ -13,22 +19,83 @@ class Tree:
     Internally, each Tree has multiple 'TreeVersion' rows. 
     The user does not see TreeVersion, Tag, etc. 
     The user only calls Tree methods: create_tag, create_new_tree_version_from_tag, etc.
+
+    traversal_engine picks how traversals run: "index" walks an in-memory GraphIndex,
+    "sql" runs them inside SQLite with recursive queries (for very large versions).
+
+    head_version_id is the tip of the tree's main line as this handle last saw it.
+    A handle checked out at the head (get_head, or get_by_tag of the head's tag)
+    moves it when it tags; if another handle moved it in the meantime, its changes
+    are rebased onto the new head. Branches (create_new_tree_version_from_tag) don't.
     """
 
-    def __init__(self, id_, name, created_at):
+    TRAVERSAL_ENGINES = ("index", "sql")
+    traversal_engine = "index"
+
+    def __init__(self, id_, name, created_at, head_version_id=None):
         self.id = id_
         self.name = name
         self.created_at = created_at
+        self.head_version_id = head_version_id
         # We create attributes working version and checpoint_version to keep track of changes and the last added tag
-        self.working_version = None
+        self._working_version = None
         self.checkpoint_version = None
+        # The thread whose open transaction created _working_version; until it
+        # commits, reads on other threads stay on the checkpoint (see version_id)
+        self._created_by = None
+        self._graph_index = None
+        # Guards _graph_index, which the threads sharing this handle (an AsyncTree's
+        # reads and writes) use at once; writes hold it until the index is updated
+        self._index_lock = threading.RLock()
+
+    @property
+    def working_version(self) -> TreeVersion:
+        """
+        The version writes go to. It is created on first use, as a copy-on-write child
+        of checkpoint_version (or as the first version of the tree), so read-only
+        handles never write. Reads go through version_id and do not create it.
+        """
+        if self._working_version is None:
+            parent_version_id = self.checkpoint_version.id if self.checkpoint_version else None
+            version = self.create_new_version(parent_version_id)
+            self._created_by = threading.get_ident()
+            self._working_version = version
+            after_commit(self._version_committed, version)
+            # Same contents as the checkpoint, so a loaded index carries over
+            with self._index_lock:
+                if self._graph_index is not None and self._graph_index.tree_version_id == parent_version_id:
+                    self._graph_index.tree_version_id = version.id
+        return self._working_version
+
+    @working_version.setter
+    def working_version(self, version: TreeVersion):
+        self._created_by = None
+        self._working_version = version
+
+    def _version_committed(self, version: TreeVersion):
+        if self._working_version is version:
+            self._created_by = None
+
+    @property
+    def version_id(self) -> int:
+        """
+        The version reads resolve against: the working version once it exists, else the
+        checkpoint. None for a tree without versions, which reads as empty. Other
+        threads sharing the handle only see the working version once the
+        transaction that created it has committed.
+        """
+        working_version = self._working_version
+        if working_version is not None and self._created_by in (None, threading.get_ident()):
+            return working_version.id
+        if self.checkpoint_version is not None:
+            return self.checkpoint_version.id
+        return None
 
     @classmethod
     def create(cls, name: str) -> "Tree":
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO Tree (name) VALUES (?)", (name,))
-        conn.commit()
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO Tree (name) VALUES (?)", (name,))
         return cls(cursor.lastrowid, name, datetime.now())
 
     @classmethod
@@ -36,25 +103,34 @@ class Tree:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT id, name, created_at
+            SELECT id, name, created_at, head_version_id
             FROM Tree
             WHERE id = ?
         """, (tree_id,))
         row = cursor.fetchone()
         if not row:
             return None
-        
-        instance = cls(row["id"], row["name"], row["created_at"])
-        instance.working_version = TreeVersion.create(instance.id)
-        return instance 
+        # The working version is only created by the first write
+        return cls(row["id"], row["name"], row["created_at"], row["head_version_id"])
+
+    @classmethod
+    def get_head(cls, tree_id: int) -> "Tree":
+        """
+        Return the tree checked out at its head version, the handle concurrent
+        workers should write through: its tags move the head.
+        """
+        tree = cls.get(tree_id)
+        if tree and tree.head_version_id is not None:
+            tree.checkpoint_version = TreeVersion.get(tree.head_version_id)
+        return tree
 
     @classmethod
     def get_by_tag(cls, tag_name: str) -> "Tree":
         """
         Return a 'Tree' object referencing the version indicated by tag_name.
         
-        We clear all the nodes and edges associated with the working version 
-        and clone all the nodes and edges from the specified version, using the tag name
+        Nothing is written: the working version is created, as a copy-on-write
+        child of the tagged version, by the first modification.
         """
         version = TreeVersion.get_by_tag(tag_name)
         if not version:
@@ -64,8 +140,6 @@ class Tree:
             return None
         # Store the version ID so we can do node/edge ops
         base_tree.checkpoint_version = version
-        base_tree.working_version = base_tree.create_new_version()
-        base_tree.working_version.clone_from(base_tree.checkpoint_version.id)
         return base_tree
 
     def create_new_version(self, parent_version_id: int = None) -> int:
@@ -78,45 +152,192 @@ class Tree:
 
     def create_tag(self, tag_name: str, description: str = "") -> "Tag":
         """
-        Clone the working version into a new version
-        Link the New Version to a tag 
-        Reference the Checkpoint Version as Parent of new Version
-        Set New Version as the new Checkpoint 
-        """
+        Link the working version to a tag, freezing it
+        Set the tagged version as the new Checkpoint
+        The next write creates a new working version as a copy-on-write child of it
 
-        if not self.checkpoint_version:
-            self.checkpoint_version = self.create_new_version()
-        else: 
-            self.checkpoint_version = self.create_new_version(self.checkpoint_version.id)
+        Nothing is copied, so tagging costs the same for any size of tree.
+        Without writes since the last checkpoint, the checkpoint itself is tagged.
 
-        self.checkpoint_version.clone_from(self.working_version.id)
-        return Tag.create(self.id, self.checkpoint_version.id, tag_name, description)
+        If the working version was built on the head, the head moves to it. If another
+        handle moved the head first, the working version's changes are merged onto
+        the new head and the merged version is tagged instead; overlapping changes
+        raise a ValueError and nothing is tagged.
+        """
+        if self._working_version is None and self.checkpoint_version is not None:
+            return Tag.create(self.id, self.checkpoint_version.id, tag_name, description)
+        # Tree.transaction(): if tagging fails, the working version created here is
+        # rolled back and the handle must not keep pointing at it
+        with self.transaction():
+            version = self.working_version
+            advanced = version.parent_version_id == self.head_version_id
+            if advanced:
+                version = self._advance_head(version)
+            tag = Tag.create(self.id, version.id, tag_name, description)
+        if advanced:
+            # Only once committed: a failed tag leaves the handle on the old head
+            self.head_version_id = version.id
+        self.checkpoint_version = version
+        self._working_version = None
+        return tag
+
+    def _advance_head(self, version: TreeVersion) -> TreeVersion:
+        """
+        Compare-and-swap the head from version's parent to version. When the head has
+        moved, rebase version onto it with a three-way merge and swap again; the
+        transaction holds the write lock, so the second swap cannot lose a race.
+        Returns the version the head now points at; the caller updates
+        head_version_id once the transaction commits.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE Tree SET head_version_id = ?
+            WHERE id = ? AND head_version_id IS ?
+        """, (version.id, self.id, version.parent_version_id))
+        if cursor.rowcount == 0:
+            head_id = cursor.execute("SELECT head_version_id FROM Tree WHERE id = ?", (self.id,)).fetchone()[0]
+            base_id = TreeVersion.merge_base(version.id, head_id)
+            if base_id is None:
+                # e.g. two handles that both started the tree: there is nothing to rebase onto
+                raise ValueError(f"Tree '{self.name}' was modified concurrently: version {version.id} "
+                                 f"shares no ancestor with head version {head_id}.")
+            merge = VersionMerge(base_id, version.id, head_id)
+            version = merge.write(self.id)
+            if merge.conflicts:
+                raise ValueError(f"Tree '{self.name}' was modified concurrently: "
+                                 f"{len(merge.conflicts)} conflicting changes with head version {head_id}.")
+            cursor.execute("UPDATE Tree SET head_version_id = ? WHERE id = ?", (version.id, self.id))
+        return version
 
     def create_new_tree_version_from_tag(self, tag_name: str) -> "Tree":
         """
         1. Find the TreeVersion for tag_name.
         2. Set the checkpoint_version to this Version
-        3. Create a New working version 
-        4. Clone all changes 
+        3. The first write creates a new working version as a copy-on-write child of it
         """
         parent_version = TreeVersion.get_by_tag(tag_name)
         if not parent_version:
             raise ValueError(f"No tag '{tag_name}' found.")
 
         # Return a new Tree object that references this new version
+        # A branch: without a head_version_id, its tags never move the tree's head
         new_tree = Tree(self.id, self.name, self.created_at)
-        new_tree.working_version = self.create_new_version()
-        new_tree.working_version.clone_from(parent_version.id)
         new_tree.checkpoint_version = parent_version
+        new_tree.traversal_engine = self.traversal_engine
         return new_tree
 
     def restore_from_tag(self, tag_name: str) -> "Tree":
         """
         "Rollback": just like create_new_tree_version_from_tag,
-        we produce a new version cloned from the old tagged version.
+        we produce a new version on top of the old tagged version.
         """
         return self.create_new_tree_version_from_tag(tag_name)
 
+    def diff(self, version_a, version_b, workers: int = 1):
+        """
+        Stream the changes from version_a to version_b, each given as a tag name or
+        a TreeVersion id, as (kind, change, before, after) tuples. See VersionDiff.
+            for kind, change, before, after in tree.diff("release-v1.0", "release-v1.1"):
+                ...
+        With workers > 1, the changes are computed up front by that many processes
+        (see ParallelPipeline), in the same order.
+        """
+        version_a, version_b = self._resolve_version(version_a), self._resolve_version(version_b)
+        if workers > 1:
+            return iter(VersionDiff.parallel(version_a, version_b, workers))
+        return iter(VersionDiff(version_a, version_b))
+
+    def log(self, version=None) -> list[tuple[TreeVersion, list[str]]]:
+        """
+        Lineage of version (a tag name or TreeVersion id; this Tree's version by
+        default): the version and its ancestors, nearest first, with their tag names.
+        """
+        version_id = self.version_id if version is None else self._resolve_version(version)
+        if version_id is None:
+            return []
+        return TreeVersion.log(version_id)
+
+    def merge_base(self, version_a, version_b) -> TreeVersion:
+        """
+        The common ancestor of two versions (tag names or ids) nearest to them,
+        the point their branches diverged from. None if they share no history.
+        """
+        version_id = TreeVersion.merge_base(self._resolve_version(version_a), self._resolve_version(version_b))
+        return TreeVersion.get(version_id) if version_id is not None else None
+
+    def descendants(self, version) -> list[tuple[TreeVersion, list[str]]]:
+        """
+        Every version built on version (a tag name or id), oldest first, with
+        their tag names; e.g. the tags released since a given tag.
+        """
+        return TreeVersion.descendants(self._resolve_version(version))
+
+    def merge(self, source_tag, target_tag, tag_name: str = None, description: str = "",
+              prefer: str = "target") -> VersionMerge:
+        """
+        Three-way merge of source_tag into target_tag (tag names or version ids)
+        against their merge base, written in one transaction as a new version on top
+        of the target and tagged tag_name (by default "<source>-into-<target>").
+        Returns the VersionMerge, with the conflicts found and how they were resolved.
+        The branches are left as they are; check the result out with get_by_tag.
+        """
+        source_id, target_id = self._resolve_version(source_tag), self._resolve_version(target_tag)
+        base_id = TreeVersion.merge_base(source_id, target_id)
+        if base_id is None:
+            raise ValueError(f"'{source_tag}' and '{target_tag}' share no history.")
+        merge = VersionMerge(base_id, source_id, target_id, prefer)
+        with transaction():
+            version = merge.write(self.id)
+            Tag.create(self.id, version.id, tag_name or f"{source_tag}-into-{target_tag}", description)
+        return merge
+
+    @staticmethod
+    def _resolve_version(version) -> int:
+        if isinstance(version, str):
+            version_id = Tag.get_version_id_for_tag(version)
+            if version_id is None:
+                raise ValueError(f"No tag '{version}' found.")
+            return version_id
+        if not TreeVersion.get(version):
+            raise ValueError(f"No version {version} found.")
+        return version
+
+    def export_snapshot(self, tag_name: str, stream=None, compress: bool = True, workers: int = 1):
+        """
+        Write the version tagged tag_name to the binary stream (e.g. a file opened
+        "wb") as a compact snapshot, see src.Snapshot, and return its counts.
+        Without a stream, return the snapshot as bytes. With workers > 1, the
+        nodes and edges are encoded by that many processes (see ParallelPipeline).
+        """
+        tag = Tag.get_by_name(tag_name)
+        if not tag or tag.tree_id != self.id:
+            raise ValueError(f"No tag '{tag_name}' found in tree '{self.name}'.")
+        if stream is None:
+            buffer = io.BytesIO()
+            SnapshotWriter(buffer, compress, workers).write(self.name, tag)
+            return buffer.getvalue()
+        return SnapshotWriter(stream, compress, workers).write(self.name, tag)
+
+    @classmethod
+    def import_snapshot(cls, stream, name: str = None, tag_name: str = None) -> "Tree":
+        """
+        Load a snapshot (a binary stream or bytes) as a new tree, in a single
+        transaction, and return it checked out at the imported tag. The tree and the
+        tag keep their exported names unless name / tag_name are given.
+        """
+        if isinstance(stream, (bytes, bytearray)):
+            stream = io.BytesIO(stream)
+        reader = SnapshotReader(stream)
+        with transaction():
+            tree = cls.create(name or reader.tree_name)
+            tag = reader.load(tree.id, tag_name)
+            tree.checkpoint_version = TreeVersion.get(tag.tree_version_id)
+            tree._advance_head(tree.checkpoint_version)
+        # Once committed, as in create_tag: the handle's tags then move the head
+        tree.head_version_id = tree.checkpoint_version.id
+        return tree
+
     # ------------------------------------------------------------------
     # Node & Edge Operations
     # ------------------------------------------------------------------
@@ -128,14 +349,14 @@ class Tree:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT id, tree_version_id, data, created_at FROM TreeNode WHERE tree_version_id = ?",
-            (self.working_version.id,)
+            f"WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()} "
+            "SELECT id, tree_version_id, data, created_at FROM visible_nodes",
+            (self.version_id,)
         )
         rows = cursor.fetchall()
         nodes = []
         for r in rows:
-            data_dict = json.loads(r["data"] or "{}")
-            nodes.append(TreeNode(r["id"], r["tree_version_id"], data_dict, r["created_at"]))
+            nodes.append(TreeNode(r["id"], r["tree_version_id"], r["data"], r["created_at"]))
         return nodes
 
     def get_all_edges(self):
@@ -145,117 +366,258 @@ class Tree:
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
+            f"WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte()} "
             "SELECT id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at "
-            "FROM TreeEdge WHERE tree_version_id = ?",
-            (self.working_version.id,)
+            "FROM visible_edges",
+            (self.version_id,)
         )
         rows = cursor.fetchall()
         edges = []
         for r in rows:
-            data_dict = json.loads(r["data"] or "{}")
             edges.append(
                 TreeEdge(
                     r["id"],
                     r["tree_version_id"],
                     r["incoming_node_id"],
                     r["outgoing_node_id"],
-                    data_dict,
+                    r["data"],
                     r["created_at"]
                 )
             )
         return edges
 
+    def iter_nodes(self, fields=None, page_size: int = 10_000):
+        """
+        Generator over the nodes of this Tree (version), fetched page_size at a time,
+        for exports and scans of versions too large for get_all_nodes. Given fields
+        (e.g. ["name", "attrs.a"]), payloads only hold those keys.
+        """
+        return TreeNode.iter_all(self.version_id, fields, page_size)
+
+    def iter_edges(self, fields=None, page_size: int = 10_000):
+        """
+        Generator over the edges of this Tree (version), like iter_nodes.
+        """
+        return TreeEdge.iter_all(self.version_id, fields, page_size)
+
+    def find_nodes(self, **predicates) -> list[TreeNode]:
+        """
+        Nodes of this Tree (version) whose data matches every predicate, e.g.
+        find_nodes(setting="X", attrs__a=1) for data["attrs"]["a"] == 1.
+        Index hot keys once with Payload.create_index("setting").
+        """
+        return TreeNode.find(self.version_id, {k.replace("__", "."): v for k, v in predicates.items()})
+
     def add_node(self, data: dict) -> TreeNode:
-        if not self.working_version.id:
-            # No current version? Create one quickly
-            self.working_version.id = self.create_new_version()
-        return TreeNode.create(self.working_version.id, data)
+        with self._index_lock:
+            node = TreeNode.create(self.working_version.id, data)
+            index = self._loaded_index(node.tree_version_id)
+            if index is not None:
+                index.add_node(node.id)
+        return node
 
     def add_edge(self, node_id_1: int, node_id_2: int, data: dict) -> TreeEdge:
-        if not self.working_version.id:
-            self.working_version.id = self.create_new_version()
-        return TreeEdge.create(self.working_version.id, node_id_1, node_id_2, data)
+        with self._index_lock:
+            edge = TreeEdge.create(self.working_version.id, node_id_1, node_id_2, data)
+            index = self._loaded_index(edge.tree_version_id)
+            if index is not None:
+                index.add_edge(edge.id, node_id_1, node_id_2)
+        return edge
+
+    def add_nodes(self, datas, chunk_size: int = 10_000) -> list[int]:
+        """
+        Bulk add_node: insert one node per dict of the iterable in a single transaction,
+        chunk_size rows per executemany. Returns the new node ids in input order.
+        """
+        with self._index_lock:
+            with self.transaction():
+                ids = TreeNode.create_many(self.working_version.id, datas, chunk_size)
+            index = self._loaded_index(self.working_version.id)
+            if index is not None:
+                for node_id in ids:
+                    index.add_node(node_id)
+        return ids
+
+    def add_edges(self, triples, chunk_size: int = 10_000) -> list[int]:
+        """
+        Bulk add_edge: insert one edge per (node_id_1, node_id_2, data) triple in a single
+        transaction, chunk_size rows per executemany. Returns the new edge ids in input order.
+        """
+        endpoints = []
+
+        def record(triples):
+            for node_in, node_out, data in triples:
+                endpoints.append((node_in, node_out))
+                yield node_in, node_out, data
+
+        with self._index_lock:
+            if self._graph_index is not None:
+                triples = record(triples)
+            with self.transaction():
+                ids = TreeEdge.create_many(self.working_version.id, triples, chunk_size)
+            index = self._loaded_index(self.working_version.id)
+            if index is not None:
+                for edge_id, (node_in, node_out) in zip(ids, endpoints):
+                    index.add_edge(edge_id, node_in, node_out)
+        return ids
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group node, edge, version and tag operations into one SQLite transaction:
+            with tree.transaction():
+                a = tree.add_node({...})
+                b = tree.add_node({...})
+                tree.add_edge(a.id, b.id, {})
+                tree.create_tag("v1")
+        Commits once when the outermost block exits. Nested blocks are savepoints;
+        a block that raises rolls back its own writes and the working and
+        checkpoint versions and the head it started with.
+        """
+        working_version, checkpoint_version = self._working_version, self.checkpoint_version
+        head_version_id, created_by = self.head_version_id, self._created_by
+        try:
+            with transaction():
+                yield self
+        except BaseException:
+            self._working_version, self.checkpoint_version = working_version, checkpoint_version
+            self.head_version_id, self._created_by = head_version_id, created_by
+            # The index may hold rows that were just rolled back
+            with self._index_lock:
+                self._graph_index = None
+            raise
+
+    def batch(self):
+        """
+        Alias of transaction(), kept for the callers of the earlier batch API:
+            with tree.batch():
+                ...
+        """
+        return self.transaction()
+
+    def update_node(self, node_id: int, data: dict) -> TreeNode:
+        if not self.get_node(node_id):
+            raise ValueError(f"No node {node_id} in the working version.")
+        return TreeNode.update(self.working_version.id, node_id, data)
+
+    def remove_node(self, node_id: int):
+        """
+        Remove a node and every edge touching it from the working version.
+        Ancestor versions (and their tags) keep them.
+        """
+        if not self.get_node(node_id):
+            raise ValueError(f"No node {node_id} in the working version.")
+        with self._index_lock:
+            # Tree.transaction(): a working version created here is rolled back with it
+            with self.transaction():
+                for e in self.get_node_edges(node_id):
+                    TreeEdge.delete(self.working_version.id, e)
+                TreeNode.delete(self.working_version.id, node_id)
+            self._graph_index = None
+
+    def update_edge(self, edge_id: int, data: dict) -> TreeEdge:
+        edge = TreeEdge.get(self.version_id, edge_id)
+        if not edge:
+            raise ValueError(f"No edge {edge_id} in the working version.")
+        return TreeEdge.update(self.working_version.id, edge, data)
+
+    def remove_edge(self, edge_id: int):
+        edge = TreeEdge.get(self.version_id, edge_id)
+        if not edge:
+            raise ValueError(f"No edge {edge_id} in the working version.")
+        with self._index_lock:
+            TreeEdge.delete(self.working_version.id, edge)
+            self._graph_index = None
 
     def get_node(self, node_id: int) -> TreeNode:
-        return TreeNode.get(node_id)
+        return TreeNode.get(self.version_id, node_id)
 
     def get_node_edges(self, node_id: int) -> list[TreeEdge]:
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version to reference edges.")
-        return TreeEdge.get_for_node(self.working_version.id, node_id)
+        return TreeEdge.get_for_node(self.version_id, node_id)
+
+    # ------------------------------------------------------------------
+    # Traversals
+    # ------------------------------------------------------------------
+
+    def _loaded_index(self, version_id: int) -> GraphIndex:
+        """
+        The loaded graph index, if it is the one of version_id: another thread
+        may have loaded the checkpoint's while this one writes.
+        """
+        index = self._graph_index
+        return index if index is not None and index.tree_version_id == version_id else None
+
+    def graph_index(self) -> GraphIndex:
+        """
+        The in-memory adjacency of the working version, loaded on first use.
+        add_node/add_edge keep it up to date; removals drop it so it is reloaded.
+        Writes through other threads may update it while it is used: the
+        traversal methods below hold the handle's lock for that.
+        """
+        with self._index_lock:
+            if self._graph_index is None or self._graph_index.tree_version_id != self.version_id:
+                self._graph_index = GraphIndex.load(self.version_id)
+            return self._graph_index
+
+    def traversal(self):
+        """
+        The engine selected by traversal_engine, bound to the working version.
+        """
+        if self.traversal_engine == "sql":
+            return SqlTraversal(self.version_id)
+        if self.traversal_engine == "index":
+            return self.graph_index()
+        raise ValueError(f"Unknown traversal engine '{self.traversal_engine}', "
+                         f"expected one of {self.TRAVERSAL_ENGINES}.")
+
+    def _traverse(self, name: str, *args) -> list:
+        """
+        Call name(*args) on the traversal engine. The graph index is shared by
+        the threads using this handle, so it is only read under its lock.
+        """
+        if self.traversal_engine != "index":
+            return getattr(self.traversal(), name)(*args)
+        with self._index_lock:
+            return getattr(self.graph_index(), name)(*args)
 
     def get_child_nodes(self, node_id: int) -> list[TreeNode]:
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version for child lookup.")
-        return TreeNode.get_children(self.working_version.id, node_id)
+        return TreeNode.get_many(self.version_id, self._traverse("children", node_id))
 
     def get_parent_nodes(self, node_id: int) -> list[TreeNode]:
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version for parent lookup.")
-        return TreeNode.get_parents(self.working_version.id, node_id)
+        return TreeNode.get_many(self.version_id, self._traverse("parents", node_id))
 
     def get_root_nodes(self) -> list[TreeNode]:
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version for root lookup.")
-        return TreeNode.get_roots(self.working_version.id)
+        return TreeNode.get_many(self.version_id, self._traverse("roots"))
 
     def get_nodes_at_depth(self, depth: int) -> list[TreeNode]:
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version for depth lookup.")
         if depth < 0:
             return []
+        return TreeNode.get_many(self.version_id, self._traverse("nodes_at_depth", depth))
+
+    def get_descendants(self, node_id: int, max_depth: int = None) -> list[TreeNode]:
+        """
+        Nodes reachable from node_id, nearest first, at most max_depth edges away if given.
+        """
+        return TreeNode.get_many(self.version_id, self._traverse("descendants", node_id, max_depth))
 
-        queue = deque([(n.id, 0) for n in self.get_root_nodes()])
-        results = []
-        visited = set()
-
-        while queue:
-            nid, lvl = queue.popleft()
-            if nid in visited:
-                continue
-            visited.add(nid)
-
-            if lvl == depth:
-                node_obj = self.get_node(nid)
-                if node_obj:
-                    results.append(node_obj)
-            elif lvl < depth:
-                children = self.get_child_nodes(nid)
-                for c in children:
-                    queue.append((c.id, lvl + 1))
-        return results
+    def get_ancestors(self, node_id: int) -> list[TreeNode]:
+        """
+        Nodes from which node_id can be reached.
+        """
+        return TreeNode.get_many(self.version_id, self._traverse("ancestors", node_id))
 
     def find_path(self, start_node_id: int, end_node_id: int) -> list[tuple[TreeNode, TreeEdge]]:
         """
         BFS to find a path from start_node_id to end_node_id.
         Return list of (TreeNode, TreeEdge) pairs.
         """
-        if not self.working_version.id:
-            raise ValueError("Tree has no current version for pathfinding.")
 
-        start_node = self.get_node(start_node_id)
-        if not start_node:
+        path = self._traverse("find_path", start_node_id, end_node_id)
+        if not path:
             return []
-
-        queue = deque([(start_node, [])])
-        visited = set([start_node_id])
-
-        while queue:
-            current_node, path_so_far = queue.popleft()
-            if current_node.id == end_node_id:
-                return path_so_far + [(current_node, None)]
-
-            edges = self.get_node_edges(current_node.id)
-            for e in edges:
-                if e.incoming_node_id == current_node.id:
-                    nxt = e.outgoing_node_id
-                    if nxt not in visited:
-                        visited.add(nxt)
-                        next_node = self.get_node(nxt)
-                        new_path = path_so_far + [(current_node, e)]
-                        queue.append((next_node, new_path))
-        return []
+        nodes = TreeNode.get_many(self.version_id, [nid for nid, _ in path])
+        edges = TreeEdge.get_many(self.version_id, [eid for _, eid in path if eid is not None])
+        return list(zip(nodes, edges + [None]))
 
     def __repr__(self):
-        vid = getattr(self, "working_version.id", None)
-        return f"<Tree id={self.id}, name='{self.name}', working_version={vid}>"
+        return f"<Tree id={self.id}, name='{self.name}', version={self.version_id}>"
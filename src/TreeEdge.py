@@ -1,8 +1,17 @@
 import json
 from datetime import datetime
-from db.database import get_connection
+from itertools import islice
+from db.database import get_connection, write
+from src.ReadCache import read_cache
+from src.Payload import Payload
+from src.TreeVersion import TreeVersion, VERSION_CHAIN_CTE, visible_edges_cte, payload_projection
 
 class TreeEdge:
+    """
+    data is decoded lazily, as in TreeNode.
+    """
+    __slots__ = ("id", "tree_version_id", "incoming_node_id", "outgoing_node_id", "_data", "_raw", "created_at")
+
     def __init__(self, id_, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at):
         self.id = id_
         self.tree_version_id = tree_version_id
@@ -11,40 +20,230 @@ class TreeEdge:
         self.data = data
         self.created_at = created_at
 
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = json.loads(self._raw or "{}")
+            self._raw = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        if data is None or isinstance(data, (str, bytes)):
+            self._data, self._raw = None, data
+        else:
+            self._data, self._raw = data, None
+
     @classmethod
     def create(cls, tree_version_id: int, node_in: int, node_out: int, data: dict) -> "TreeEdge":
+        """
+        Add a brand new edge to the version. Its row id becomes its edge id.
+        """
+        with write() as conn:
+            data_hash = Payload.put(data)
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
+                VALUES (?, ?, ?, ?)
+            """, (tree_version_id, node_in, node_out, data_hash))
+        read_cache.invalidate_version(tree_version_id)
+        return cls(cursor.lastrowid, tree_version_id, node_in, node_out, data, datetime.now())
+
+    @classmethod
+    def create_many(cls, tree_version_id: int, triples, chunk_size: int = 10_000) -> list[int]:
+        """
+        Add one new edge per (node_in, node_out, data) triple, streamed through executemany
+        in chunks of chunk_size, and return their ids in input order. Commits once at the end.
+        """
+        triples = iter(triples)
+        ids = []
+        with write():
+            while True:
+                chunk = list(islice(triples, chunk_size))
+                if not chunk:
+                    break
+                data_hashes = Payload.put_many(data for _, _, data in chunk)
+                ids.extend(cls._insert_many(tree_version_id, [
+                    (node_in, node_out, data_hash) for (node_in, node_out, _), data_hash in zip(chunk, data_hashes)
+                ]))
+        read_cache.invalidate_version(tree_version_id)
+        return ids
+
+    @classmethod
+    def create_many_hashed(cls, tree_version_id: int, triples, chunk_size: int = 10_000) -> list[int]:
+        """
+        create_many for (node_in, node_out, data_hash) triples whose payloads are
+        already stored in Payload.
+        """
+        triples = iter(triples)
+        ids = []
+        with write():
+            while True:
+                chunk = list(islice(triples, chunk_size))
+                if not chunk:
+                    break
+                ids.extend(cls._insert_many(tree_version_id, chunk))
+        read_cache.invalidate_version(tree_version_id)
+        return ids
+
+    @staticmethod
+    def _insert_many(tree_version_id: int, triples: list[tuple]) -> range:
+        # Explicit ids after the first row's, see TreeNode._insert_many
         conn = get_connection()
         cursor = conn.cursor()
+        node_in, node_out, data_hash = triples[0]
         cursor.execute("""
-            INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data)
+            INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
             VALUES (?, ?, ?, ?)
-        """, (tree_version_id, node_in, node_out, json.dumps(data)))
-        conn.commit()
-        return cls(cursor.lastrowid, tree_version_id, node_in, node_out, data, datetime.now())
+        """, (tree_version_id, node_in, node_out, data_hash))
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO TreeEdge (id, edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, ((first_id + i, first_id + i, tree_version_id, node_in, node_out, data_hash)
+              for i, (node_in, node_out, data_hash) in enumerate(triples[1:], 1)))
+        return range(first_id, first_id + len(triples))
+
+    @classmethod
+    def update(cls, tree_version_id: int, edge: "TreeEdge", data: dict) -> "TreeEdge":
+        """
+        Record new data for an existing edge in this version, shadowing the ancestors' row.
+        """
+        with write() as conn:
+            data_hash = Payload.put(data)
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (tree_version_id, edge_id)
+                DO UPDATE SET data_hash = excluded.data_hash, is_deleted = 0
+            """, (edge.id, tree_version_id, edge.incoming_node_id, edge.outgoing_node_id, data_hash))
+        read_cache.invalidate_version(tree_version_id)
+        return cls(edge.id, tree_version_id, edge.incoming_node_id, edge.outgoing_node_id, data, datetime.now())
+
+    @classmethod
+    def delete(cls, tree_version_id: int, edge: "TreeEdge"):
+        """
+        Record a tombstone for an existing edge, hiding it from this version and its children.
+        """
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash, is_deleted)
+                VALUES (?, ?, ?, ?, NULL, 1)
+                ON CONFLICT (tree_version_id, edge_id)
+                DO UPDATE SET data_hash = NULL, is_deleted = 1
+            """, (edge.id, tree_version_id, edge.incoming_node_id, edge.outgoing_node_id))
+        read_cache.invalidate_version(tree_version_id)
+
+    @classmethod
+    def get(cls, tree_version_id: int, edge_id: int) -> "TreeEdge":
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte("e.edge_id = ?")}
+            SELECT id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at
+            FROM visible_edges
+        """, (tree_version_id, edge_id))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return cls(
+            row["id"], row["tree_version_id"],
+            row["incoming_node_id"], row["outgoing_node_id"],
+            row["data"], row["created_at"]
+        )
+
+    @classmethod
+    def get_many(cls, tree_version_id: int, edge_ids: list[int]) -> list["TreeEdge"]:
+        """
+        Return the live edges among edge_ids with one query, in the order given.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE},
+            {visible_edges_cte("e.edge_id IN (SELECT value FROM json_each(?))")}
+            SELECT id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at
+            FROM visible_edges
+        """, (tree_version_id, json.dumps(list(edge_ids))))
+        by_id = {}
+        for r in cursor.fetchall():
+            by_id[r["id"]] = cls(
+                r["id"], r["tree_version_id"],
+                r["incoming_node_id"], r["outgoing_node_id"],
+                r["data"], r["created_at"]
+            )
+        return [by_id[i] for i in edge_ids if i in by_id]
+
+    @classmethod
+    def iter_all(cls, tree_version_id: int, fields=None, page_size: int = 10_000):
+        """
+        Stream the live edges of the version, page_size rows per query, in constant
+        memory. Same paging and projection as TreeNode.iter_all.
+        """
+        data, data_params = payload_projection("p.data", fields)
+        chain = TreeVersion.chain_ids(tree_version_id)
+        for depth, version_id in enumerate(chain):
+            nearer = json.dumps(chain[:depth])
+            last_id = -1
+            while True:
+                conn = get_connection()
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT e.edge_id AS id, e.tree_version_id, e.incoming_node_id, e.outgoing_node_id,
+                           {data} AS data, e.created_at
+                    FROM TreeEdge e
+                    LEFT JOIN Payload p ON p.hash = e.data_hash
+                    WHERE e.tree_version_id = ? AND e.edge_id > ? AND e.is_deleted = 0
+                      AND NOT EXISTS (
+                        SELECT 1 FROM TreeEdge e2
+                        WHERE e2.tree_version_id IN (SELECT value FROM json_each(?))
+                          AND e2.edge_id = e.edge_id
+                      )
+                    ORDER BY e.edge_id
+                    LIMIT ?
+                """, (*data_params, version_id, last_id, nearer, page_size))
+                rows = cursor.fetchall()
+                for r in rows:
+                    yield cls(r["id"], r["tree_version_id"], r["incoming_node_id"], r["outgoing_node_id"],
+                              r["data"], r["created_at"])
+                if len(rows) < page_size:
+                    break
+                last_id = rows[-1]["id"]
 
     @classmethod
     def get_for_node(cls, tree_version_id: int, node_id: int) -> list["TreeEdge"]:
         """
         Return edges where node_id is either incoming or outgoing in this version.
         """
+        key = ("edges_for_node", tree_version_id, node_id)
+        rows = read_cache.get(key)
+        if rows is not None:
+            return [cls(*r) for r in rows]
+        stamp = read_cache.stamp()
+        # A UNION of one lookup per endpoint, so each side can use its endpoint index
+        candidates = """e.edge_id IN (
+                SELECT e1.edge_id FROM TreeEdge e1
+                JOIN version_chain c1 ON e1.tree_version_id = c1.version_id
+                WHERE e1.incoming_node_id = ?
+                UNION
+                SELECT e2.edge_id FROM TreeEdge e2
+                JOIN version_chain c2 ON e2.tree_version_id = c2.version_id
+                WHERE e2.outgoing_node_id = ?
+            )"""
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte(candidates)}
             SELECT id, tree_version_id, incoming_node_id, outgoing_node_id, data, created_at
-            FROM TreeEdge
-            WHERE tree_version_id = ?
-              AND (incoming_node_id = ? OR outgoing_node_id = ?)
+            FROM visible_edges
         """, (tree_version_id, node_id, node_id))
-        rows = cursor.fetchall()
-        results = []
-        for r in rows:
-            data_dict = json.loads(r["data"] or "{}")
-            results.append(cls(
-                r["id"], r["tree_version_id"],
-                r["incoming_node_id"], r["outgoing_node_id"],
-                data_dict, r["created_at"]
-            ))
-        return results
+        # The rows, not the edges: every caller gets a list and edges of its own
+        rows = tuple((r["id"], r["tree_version_id"], r["incoming_node_id"], r["outgoing_node_id"],
+                      r["data"], r["created_at"]) for r in cursor.fetchall())
+        read_cache.put(key, tree_version_id, rows, sum(len(r[4] or "") for r in rows), stamp)
+        return [cls(*r) for r in rows]
 
     def __repr__(self):
         return (f"<TreeEdge id={self.id}, version={self.tree_version_id}, "
@@ -1,44 +1,269 @@
 import json
 from datetime import datetime
-from db.database import get_connection
-from collections import deque
+from itertools import islice
+from db.database import get_connection, write
+from src.ReadCache import read_cache
+from src.Payload import Payload
+from src.TreeVersion import (TreeVersion, VERSION_CHAIN_CTE, LIVE_EDGES_CTE, visible_nodes_cte,
+                             visible_edges_cte, payload_projection)
 
 class TreeNode:
+    """
+    data may be given decoded, or as the JSON text stored in the row. The text is
+    only decoded when .data is first read, so reads that just need ids or pass
+    nodes along never pay for json.loads. __slots__ keeps millions of them small.
+    """
+    __slots__ = ("id", "tree_version_id", "_data", "_raw", "created_at")
+
     def __init__(self, id_, tree_version_id, data, created_at):
         self.id = id_
         self.tree_version_id = tree_version_id
         self.data = data
         self.created_at = created_at
 
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = json.loads(self._raw or "{}")
+            self._raw = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        if data is None or isinstance(data, (str, bytes)):
+            self._data, self._raw = None, data
+        else:
+            self._data, self._raw = data, None
+
     @classmethod
     def create(cls, tree_version_id: int, data: dict) -> "TreeNode":
+        """
+        Add a brand new node to the version. Its row id becomes its node id.
+        """
+        with write() as conn:
+            data_hash = Payload.put(data)
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeNode (tree_version_id, data_hash)
+                VALUES (?, ?)
+            """, (tree_version_id, data_hash))
+        read_cache.invalidate_version(tree_version_id)
+        return cls(cursor.lastrowid, tree_version_id, data, datetime.now())
+
+    @classmethod
+    def create_many(cls, tree_version_id: int, datas, chunk_size: int = 10_000) -> list[int]:
+        """
+        Add one new node per dict in datas, streamed through executemany in chunks of
+        chunk_size, and return their ids in input order. Commits once at the end.
+        """
+        datas = iter(datas)
+        ids = []
+        with write():
+            while True:
+                chunk = list(islice(datas, chunk_size))
+                if not chunk:
+                    break
+                ids.extend(cls._insert_many(tree_version_id, Payload.put_many(chunk)))
+        read_cache.invalidate_version(tree_version_id)
+        return ids
+
+    @classmethod
+    def create_many_hashed(cls, tree_version_id: int, data_hashes, chunk_size: int = 10_000) -> list[int]:
+        """
+        create_many for payloads already stored in Payload, given by their hashes.
+        """
+        data_hashes = iter(data_hashes)
+        ids = []
+        with write():
+            while True:
+                chunk = list(islice(data_hashes, chunk_size))
+                if not chunk:
+                    break
+                ids.extend(cls._insert_many(tree_version_id, chunk))
+        read_cache.invalidate_version(tree_version_id)
+        return ids
+
+    @staticmethod
+    def _insert_many(tree_version_id: int, data_hashes: list[bytes]) -> range:
+        """
+        The first row takes the next AUTOINCREMENT id and the write lock, so the
+        others can take the ids after it; giving node_id explicitly skips the
+        trigger's UPDATE of every row.
+        """
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO TreeNode (tree_version_id, data)
+            INSERT INTO TreeNode (tree_version_id, data_hash)
             VALUES (?, ?)
-        """, (tree_version_id, json.dumps(data)))
-        conn.commit()
-        return cls(cursor.lastrowid, tree_version_id, data, datetime.now())
+        """, (tree_version_id, data_hashes[0]))
+        first_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO TreeNode (id, node_id, tree_version_id, data_hash)
+            VALUES (?, ?, ?, ?)
+        """, ((first_id + i, first_id + i, tree_version_id, data_hash)
+              for i, data_hash in enumerate(data_hashes[1:], 1)))
+        return range(first_id, first_id + len(data_hashes))
 
     @classmethod
-    def get(cls, node_id: int) -> "TreeNode" :
+    def update(cls, tree_version_id: int, node_id: int, data: dict) -> "TreeNode":
+        """
+        Record new data for node_id in this version, shadowing the ancestors' row.
+        """
+        with write() as conn:
+            data_hash = Payload.put(data)
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeNode (node_id, tree_version_id, data_hash)
+                VALUES (?, ?, ?)
+                ON CONFLICT (tree_version_id, node_id)
+                DO UPDATE SET data_hash = excluded.data_hash, is_deleted = 0
+            """, (node_id, tree_version_id, data_hash))
+        read_cache.invalidate_version(tree_version_id)
+        return cls(node_id, tree_version_id, data, datetime.now())
+
+    @classmethod
+    def delete(cls, tree_version_id: int, node_id: int):
+        """
+        Record a tombstone for node_id, hiding it from this version and its children.
+        """
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeNode (node_id, tree_version_id, data_hash, is_deleted)
+                VALUES (?, ?, NULL, 1)
+                ON CONFLICT (tree_version_id, node_id)
+                DO UPDATE SET data_hash = NULL, is_deleted = 1
+            """, (node_id, tree_version_id))
+        read_cache.invalidate_version(tree_version_id)
+
+    @classmethod
+    def get(cls, tree_version_id: int, node_id: int) -> "TreeNode" :
+        key = ("node", tree_version_id, node_id)
+        row = read_cache.get(key)
+        if row is not None:
+            return cls(*row)
+        stamp = read_cache.stamp()
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte("n.node_id = ?")}
             SELECT id, tree_version_id, data, created_at
-            FROM TreeNode
-            WHERE id = ?
-        """, (node_id,))
+            FROM visible_nodes
+        """, (tree_version_id, node_id))
         row = cursor.fetchone()
         if not row:
             return None
-        return cls(
-            row["id"],
-            row["tree_version_id"],
-            json.loads(row["data"] or "{}"),
-            row["created_at"]
-        )
+        # The row, not the node: every caller gets a node of its own to modify
+        row = (row["id"], row["tree_version_id"], row["data"], row["created_at"])
+        read_cache.put(key, tree_version_id, row, len(row[2] or ""), stamp)
+        return cls(*row)
+
+    @classmethod
+    def get_many(cls, tree_version_id: int, node_ids: list[int]) -> list["TreeNode"]:
+        """
+        Return the live nodes among node_ids with one query, in the order given.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE},
+            {visible_nodes_cte("n.node_id IN (SELECT value FROM json_each(?))")}
+            SELECT id, tree_version_id, data, created_at
+            FROM visible_nodes
+        """, (tree_version_id, json.dumps(list(node_ids))))
+        by_id = {}
+        for r in cursor.fetchall():
+            by_id[r["id"]] = cls(
+                r["id"], r["tree_version_id"],
+                r["data"],
+                r["created_at"]
+            )
+        return [by_id[i] for i in node_ids if i in by_id]
+
+    @classmethod
+    def find(cls, tree_version_id: int, predicates: dict) -> list["TreeNode"]:
+        """
+        Return the live nodes of the version whose payload has every key of predicates
+        (dotted paths allowed) equal to the given scalar; None matches a missing key.
+
+        Matching payloads are looked up first, through the Payload index of a key
+        when one was created (see Payload.create_index), then the nodes holding them
+        through idx_treenode_data_hash. The match is checked again on the resolved
+        row, since an older row of a node may match where the visible one does not.
+        """
+        if not predicates:
+            raise ValueError("find needs at least one predicate.")
+        conditions, params = [], []
+        for key, value in predicates.items():
+            if isinstance(value, (dict, list, tuple)):
+                raise ValueError(f"Can only match '{key}' against a scalar, got {type(value).__name__}.")
+            if value is None:
+                conditions.append(f"{Payload.key_expression(key)} IS NULL")
+            else:
+                conditions.append(f"{Payload.key_expression(key)} = ?")
+                params.append(int(value) if isinstance(value, bool) else value)
+        candidates = """n.node_id IN (
+                SELECT n2.node_id FROM matching m
+                CROSS JOIN TreeNode n2 ON n2.data_hash = m.hash
+                WHERE n2.tree_version_id IN (SELECT version_id FROM version_chain)
+            )"""
+        # CROSS JOIN keeps the matching payloads as the outer loop, so the nodes are
+        # looked up by hash rather than by scanning the version
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE},
+            matching(hash) AS MATERIALIZED (
+                SELECT hash FROM Payload WHERE {" AND ".join(conditions)}
+            ),
+            {visible_nodes_cte(candidates)}
+            SELECT id, tree_version_id, data, created_at
+            FROM visible_nodes
+            WHERE data_hash IN (SELECT hash FROM matching)
+            ORDER BY id
+        """, (tree_version_id, *params))
+        return [cls(r["id"], r["tree_version_id"], r["data"], r["created_at"]) for r in cursor.fetchall()]
+
+    @classmethod
+    def iter_all(cls, tree_version_id: int, fields=None, page_size: int = 10_000):
+        """
+        Stream the live nodes of the version, page_size rows per query, in constant memory.
+        fields narrows each payload to those keys, see payload_projection.
+
+        Pages are keyset-paginated over each version of the chain in turn (nearest
+        first, then by node id), so every page is one index range read and the
+        first rows come back without sorting the whole version.
+
+        Each page runs on the connection of the thread that resumes the generator,
+        so it may be consumed from a different thread than the one that started it.
+        """
+        data, data_params = payload_projection("p.data", fields)
+        chain = TreeVersion.chain_ids(tree_version_id)
+        for depth, version_id in enumerate(chain):
+            nearer = json.dumps(chain[:depth])
+            last_id = -1
+            while True:
+                conn = get_connection()
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT n.node_id AS id, n.tree_version_id, {data} AS data, n.created_at
+                    FROM TreeNode n
+                    LEFT JOIN Payload p ON p.hash = n.data_hash
+                    WHERE n.tree_version_id = ? AND n.node_id > ? AND n.is_deleted = 0
+                      AND NOT EXISTS (
+                        SELECT 1 FROM TreeNode n2
+                        WHERE n2.tree_version_id IN (SELECT value FROM json_each(?))
+                          AND n2.node_id = n.node_id
+                      )
+                    ORDER BY n.node_id
+                    LIMIT ?
+                """, (*data_params, version_id, last_id, nearer, page_size))
+                rows = cursor.fetchall()
+                for r in rows:
+                    yield cls(r["id"], r["tree_version_id"], r["data"], r["created_at"])
+                if len(rows) < page_size:
+                    break
+                last_id = rows[-1]["id"]
 
     @classmethod
     def get_children(cls, tree_version_id: int, node_id: int) -> list["TreeNode"]:
@@ -47,20 +272,20 @@ class TreeNode:
         """
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE},
+            {visible_edges_cte("e.incoming_node_id = ?")},
+            {visible_nodes_cte("n.node_id IN (SELECT outgoing_node_id FROM visible_edges)")}
             SELECT n.id, n.tree_version_id, n.data, n.created_at
-            FROM TreeNode n
-            JOIN TreeEdge e ON e.outgoing_node_id = n.id
-            WHERE n.tree_version_id = ?
-              AND e.tree_version_id = ?
-              AND e.incoming_node_id = ?
-        """, (tree_version_id, tree_version_id, node_id))
+            FROM visible_nodes n
+            JOIN visible_edges ve ON ve.outgoing_node_id = n.id
+        """, (tree_version_id, node_id))
         rows = cursor.fetchall()
         results = []
         for r in rows:
             results.append(cls(
                 r["id"], r["tree_version_id"],
-                json.loads(r["data"] or "{}"),
+                r["data"],
                 r["created_at"]
             ))
         return results
@@ -72,20 +297,20 @@ class TreeNode:
         """
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE},
+            {visible_edges_cte("e.outgoing_node_id = ?")},
+            {visible_nodes_cte("n.node_id IN (SELECT incoming_node_id FROM visible_edges)")}
             SELECT n.id, n.tree_version_id, n.data, n.created_at
-            FROM TreeNode n
-            JOIN TreeEdge e ON e.incoming_node_id = n.id
-            WHERE n.tree_version_id = ?
-              AND e.tree_version_id = ?
-              AND e.outgoing_node_id = ?
-        """, (tree_version_id, tree_version_id, node_id))
+            FROM visible_nodes n
+            JOIN visible_edges ve ON ve.incoming_node_id = n.id
+        """, (tree_version_id, node_id))
         rows = cursor.fetchall()
         results = []
         for r in rows:
             results.append(cls(
                 r["id"], r["tree_version_id"],
-                json.loads(r["data"] or "{}"),
+                r["data"],
                 r["created_at"]
             ))
         return results
@@ -97,22 +322,22 @@ class TreeNode:
         """
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute("""
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}, {LIVE_EDGES_CTE}
             SELECT n.id, n.tree_version_id, n.data, n.created_at
-            FROM TreeNode n
-            WHERE n.tree_version_id = ?
-              AND n.id NOT IN (
-                SELECT outgoing_node_id
-                FROM TreeEdge
-                WHERE tree_version_id = ?
+            FROM visible_nodes n
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM live_edges e
+                WHERE e.outgoing_node_id = n.id
               )
-        """, (tree_version_id, tree_version_id))
+        """, (tree_version_id,))
         rows = cursor.fetchall()
         results = []
         for r in rows:
             results.append(cls(
                 r["id"], r["tree_version_id"],
-                json.loads(r["data"] or "{}"),
+                r["data"],
                 r["created_at"]
             ))
         return results
@@ -1,8 +1,109 @@
+import json
 from datetime import datetime
-from db.database import get_connection
+from db.database import get_connection, write
+from src.ReadCache import read_cache
 from src.Tag import Tag
 
+# A version only stores the nodes/edges it added, modified or deleted on top of
+# its parent_version_id. Reads walk the ancestor chain (the version itself at
+# depth 0, its parent at depth 1, ...) and resolve every node/edge to the row
+# nearest to the version. Binds one parameter: the version id.
+def version_chain_cte(name: str = "version_chain") -> str:
+    return f"""
+    {name}(version_id, depth) AS (
+        SELECT ?, 0
+        UNION ALL
+        SELECT v.parent_version_id, c.depth + 1
+        FROM TreeVersion v
+        JOIN {name} c ON v.id = c.version_id
+        WHERE v.parent_version_id IS NOT NULL
+    )"""
+
+
+VERSION_CHAIN_CTE = version_chain_cte()
+
+
+def visible_nodes_cte(where: str = "1", name: str = "visible_nodes", chain: str = "version_chain") -> str:
+    """
+    CTE 'visible_nodes' (id, tree_version_id, data, data_hash, created_at) of the live nodes
+    in version_chain. `where` narrows the candidate rows (alias n) and must only
+    filter on columns shared by every row of a node, e.g. n.node_id.
+    SQLite takes the bare columns from the row that produced MIN(c.depth).
+    name and chain rename the CTE and the chain it reads, to resolve two versions in one query.
+    """
+    return f"""
+    {name} AS (
+        SELECT id, tree_version_id, (SELECT p.data FROM Payload p WHERE p.hash = data_hash) AS data,
+               data_hash, created_at FROM (
+            SELECT n.node_id AS id, n.tree_version_id, n.data_hash, n.is_deleted, n.created_at,
+                   MIN(c.depth)
+            FROM TreeNode n
+            JOIN {chain} c ON n.tree_version_id = c.version_id
+            WHERE {where}
+            GROUP BY n.node_id
+        )
+        WHERE is_deleted = 0
+    )"""
+
+
+def visible_edges_cte(where: str = "1", name: str = "visible_edges", chain: str = "version_chain") -> str:
+    """
+    CTE 'visible_edges' (id, tree_version_id, incoming_node_id, outgoing_node_id,
+    data, data_hash, created_at) of the live edges in version_chain. `where` narrows the
+    candidate rows (alias e); the endpoints of an edge never change, so it may
+    filter on them as well as on e.edge_id. name and chain as in visible_nodes_cte.
+    """
+    return f"""
+    {name} AS (
+        SELECT id, tree_version_id, incoming_node_id, outgoing_node_id,
+               (SELECT p.data FROM Payload p WHERE p.hash = data_hash) AS data, data_hash, created_at FROM (
+            SELECT e.edge_id AS id, e.tree_version_id, e.incoming_node_id, e.outgoing_node_id,
+                   e.data_hash, e.is_deleted, e.created_at, MIN(c.depth)
+            FROM TreeEdge e
+            JOIN {chain} c ON e.tree_version_id = c.version_id
+            WHERE {where}
+            GROUP BY e.edge_id
+        )
+        WHERE is_deleted = 0
+    )"""
+
+
+def payload_projection(column: str, fields=None) -> tuple[str, list]:
+    """
+    SQL expression (and its parameters) reading the JSON payload in column, narrowed
+    with json_extract to the given keys ("name" or dotted paths like "attrs.a")
+    when fields is given. Missing keys come back as null.
+    """
+    if fields is None:
+        return column, []
+    params = []
+    for field in fields:
+        params += [field, f"$.{field}"]
+    return f"json_object({', '.join(f'?, json_extract({column}, ?)' for _ in fields)})", params
+
+
+# Live edges of version_chain without an aggregate, so it can be joined from the
+# recursive term of a WITH RECURSIVE traversal: an edge row is live when it is not
+# a tombstone and no version nearer in the chain has a row for the same edge.
+# NOT MATERIALIZED keeps it inlined (index lookups by endpoint) when used twice.
+LIVE_EDGES_CTE = """
+    live_edges AS NOT MATERIALIZED (
+        SELECT e.edge_id AS id, e.incoming_node_id, e.outgoing_node_id
+        FROM TreeEdge e
+        JOIN version_chain c ON e.tree_version_id = c.version_id
+        WHERE e.is_deleted = 0
+          AND NOT EXISTS (
+            SELECT 1
+            FROM TreeEdge e2
+            JOIN version_chain c2 ON e2.tree_version_id = c2.version_id
+            WHERE e2.edge_id = e.edge_id AND c2.depth < c.depth
+          )
+    )"""
+
+
 class TreeVersion:
+    __slots__ = ("id", "tree_id", "parent_version_id", "created_at")
+
     def __init__(self, id_, tree_id, parent_version_id, created_at):
         self.id = id_
         self.tree_id = tree_id
@@ -14,19 +115,23 @@ class TreeVersion:
         """
         Create a new row in TreeVersion for the given Tree (tree_id),
         optionally referencing a parent_version_id for branching.
+        The new version starts out with exactly the contents of its parent.
         """
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO TreeVersion (tree_id, parent_version_id)
-            VALUES (?, ?)
-        """, (tree_id, parent_version_id))
-        conn.commit()
-
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO TreeVersion (tree_id, parent_version_id)
+                VALUES (?, ?)
+            """, (tree_id, parent_version_id))
         return cls(cursor.lastrowid, tree_id, parent_version_id, datetime.now())
 
     @classmethod
     def get(cls, version_id: int) -> "TreeVersion":
+        key = ("version", version_id)
+        row = read_cache.get(key)
+        if row is not None:
+            return cls(*row)
+        stamp = read_cache.stamp()
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
@@ -37,7 +142,88 @@ class TreeVersion:
         row = cursor.fetchone()
         if not row:
             return None
-        return cls(row["id"], row["tree_id"], row["parent_version_id"], row["created_at"])
+        row = (row["id"], row["tree_id"], row["parent_version_id"], row["created_at"])
+        read_cache.put(key, version_id, row, stamp=stamp)
+        return cls(*row)
+
+    @classmethod
+    def chain_ids(cls, version_id: int) -> list[int]:
+        """
+        Ids of version_id and its ancestors, nearest first.
+        """
+        if version_id is None:
+            return []
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}
+            SELECT version_id FROM version_chain ORDER BY depth
+        """, (version_id,))
+        return [r[0] for r in cursor.fetchall()]
+
+    @classmethod
+    def log(cls, version_id: int) -> list[tuple["TreeVersion", list[str]]]:
+        """
+        version_id and its ancestors, nearest first, each with the names of its tags.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}
+            SELECT v.id, v.tree_id, v.parent_version_id, v.created_at,
+                   json_group_array(t.tag_name) FILTER (WHERE t.tag_name IS NOT NULL) AS tags
+            FROM version_chain c
+            JOIN TreeVersion v ON v.id = c.version_id
+            LEFT JOIN Tag t ON t.tree_version_id = v.id
+            GROUP BY c.depth
+            ORDER BY c.depth
+        """, (version_id,))
+        return [(cls(r["id"], r["tree_id"], r["parent_version_id"], r["created_at"]), json.loads(r["tags"]))
+                for r in cursor.fetchall()]
+
+    @classmethod
+    def descendants(cls, version_id: int) -> list[tuple["TreeVersion", list[str]]]:
+        """
+        Every version branched off version_id, directly or not, oldest first, each
+        with the names of its tags. version_id itself is not included.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH RECURSIVE descendants(version_id) AS (
+                SELECT id FROM TreeVersion WHERE parent_version_id = ?
+                UNION ALL
+                SELECT v.id FROM TreeVersion v
+                JOIN descendants d ON v.parent_version_id = d.version_id
+            )
+            SELECT v.id, v.tree_id, v.parent_version_id, v.created_at,
+                   json_group_array(t.tag_name) FILTER (WHERE t.tag_name IS NOT NULL) AS tags
+            FROM descendants d
+            JOIN TreeVersion v ON v.id = d.version_id
+            LEFT JOIN Tag t ON t.tree_version_id = v.id
+            GROUP BY v.id
+            ORDER BY v.id
+        """, (version_id,))
+        return [(cls(r["id"], r["tree_id"], r["parent_version_id"], r["created_at"]), json.loads(r["tags"]))
+                for r in cursor.fetchall()]
+
+    @classmethod
+    def merge_base(cls, version_a_id: int, version_b_id: int) -> int:
+        """
+        The nearest version that both version_a_id and version_b_id descend from
+        (either of them, if one descends from the other), or None.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {version_chain_cte("chain_a")}, {version_chain_cte("chain_b")}
+            SELECT a.version_id FROM chain_a a
+            WHERE a.version_id IN (SELECT version_id FROM chain_b)
+            ORDER BY a.depth
+            LIMIT 1
+        """, (version_a_id, version_b_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
 
     @classmethod
     def get_by_tag(cls, tag_name: str) -> "TreeVersion" :
@@ -52,74 +238,72 @@ class TreeVersion:
     def clone_from(self, parent_version_id: int):
 
         """
-        Copy nodes/edges from parent_version_id into this version's ID.
+        Materialize the resolved nodes/edges of parent_version_id as rows of this version.
+        Node and edge identities are kept, so ids stay valid in the copy.
+
+        Versions normally share rows with their ancestors; this is only needed
+        to flatten a version that should not depend on its ancestor chain.
+        Both copies are set-based INSERT ... SELECT statements run in a single
+        transaction. Since identities are stable, no old-to-new id mapping is needed,
+        and only payload hashes are copied, never the payloads.
         """
-        conn = get_connection()
-        cursor = conn.cursor()
+        with write() as conn:
+            cursor = conn.cursor()
 
-        # 1) Copy Nodes
-        cursor.execute("""
-            SELECT id, data
-            FROM TreeNode
-            WHERE tree_version_id = ?
-        """, (parent_version_id,))
-        old_nodes = cursor.fetchall()
-
-        old_to_new = {}
-        for row in old_nodes:
-            old_id = row["id"]
-            data_json = row["data"]
-            cursor.execute("""
-                INSERT INTO TreeNode (tree_version_id, data)
-                VALUES (?, ?)
-            """, (self.id, data_json))
-            conn.commit()
-            new_id = cursor.lastrowid
-            old_to_new[old_id] = new_id
+            # 1) Copy Nodes
+            cursor.execute(f"""
+                WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_nodes_cte()}
+                INSERT INTO TreeNode (node_id, tree_version_id, data_hash)
+                SELECT id, ?, data_hash FROM visible_nodes
+            """, (parent_version_id, self.id))
 
-        # 2) Copy Edges
-        cursor.execute("""
-            SELECT incoming_node_id, outgoing_node_id, data
-            FROM TreeEdge
-            WHERE tree_version_id = ?
-        """, (parent_version_id,))
-        old_edges = cursor.fetchall()
+            # 2) Copy Edges
+            cursor.execute(f"""
+                WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte()}
+                INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash)
+                SELECT id, ?, incoming_node_id, outgoing_node_id, data_hash FROM visible_edges
+            """, (parent_version_id, self.id))
+        read_cache.invalidate_version(self.id)
 
-        for edge_row in old_edges:
-            old_in = edge_row["incoming_node_id"]
-            old_out = edge_row["outgoing_node_id"]
-            edge_data = edge_row["data"]
+    def delete_all_nodes_and_edges(self, limit: int = None) -> int:
+        """
+        Delete all TreeNode and TreeEdge rows associated with this TreeVersion.
+        Note: This permanently removes them from the database!
 
-            new_in = old_to_new[old_in]
-            new_out = old_to_new[old_out]
+        With a limit, at most that many rows (edges first) are deleted per call, so
+        large versions can be removed in bounded batches. Returns the rows deleted.
+        """
+        if limit is None:
+            limit = -1
+        with write() as conn:
+            cursor = conn.cursor()
 
+            # 1) Delete edges that belong to this version
             cursor.execute("""
-                INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data)
-                VALUES (?, ?, ?, ?)
-            """, (self.id, new_in, new_out, edge_data))
-        conn.commit()
+                DELETE FROM TreeEdge
+                WHERE id IN (SELECT id FROM TreeEdge WHERE tree_version_id = ? LIMIT ?)
+            """, (self.id, limit))
+            deleted = cursor.rowcount
+
+            # 2) Delete nodes that belong to this version
+            if limit < 0 or deleted < limit:
+                cursor.execute("""
+                    DELETE FROM TreeNode
+                    WHERE id IN (SELECT id FROM TreeNode WHERE tree_version_id = ? LIMIT ?)
+                """, (self.id, limit - deleted if limit >= 0 else -1))
+                deleted += cursor.rowcount
 
-    def delete_all_nodes_and_edges(self):
+        read_cache.invalidate_version(self.id)
+        return deleted
+
+    def delete(self):
         """
-        Delete all TreeNode and TreeEdge rows associated with this TreeVersion.
-        Note: This permanently removes them from the database!
+        Delete this TreeVersion row. Its nodes and edges must be deleted first.
         """
-        conn = get_connection() 
-        cursor = conn.cursor()
-        
-        # 1) Delete edges that belong to this version
-        cursor.execute("""
-            DELETE FROM TreeEdge
-            WHERE tree_version_id = ?
-        """, (self.id,))
-        
-        # 2) Delete nodes that belong to this version
-        cursor.execute("""
-            DELETE FROM TreeNode
-            WHERE tree_version_id = ?
-        """, (self.id,))
-        
-        conn.commit()
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM TreeVersion WHERE id = ?", (self.id,))
+        read_cache.invalidate_version(self.id)
 
     def __repr__(self):
         return (f"<TreeVersion id={self.id}, tree_id={self.tree_id}, "
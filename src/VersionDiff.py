@@ -0,0 +1,170 @@
+from db.database import get_connection
+from src.TreeVersion import version_chain_cte, visible_nodes_cte, visible_edges_cte
+from src.TreeNode import TreeNode
+from src.TreeEdge import TreeEdge
+from src.ParallelPipeline import ParallelPipeline
+
+# Only a node/edge with a row in a version on one chain but not the other can
+# resolve differently: rows of the shared ancestors are seen the same way from
+# both sides. Binds two parameters: the version ids of side a and side b.
+CHANGED_IDS_CTE = """
+    {chain_a}, {chain_b},
+    candidates(item_id) AS (
+        SELECT t.{id_column} FROM {table} t
+        JOIN chain_a c ON t.tree_version_id = c.version_id
+        WHERE c.version_id NOT IN (SELECT version_id FROM chain_b){id_range}
+        UNION
+        SELECT t.{id_column} FROM {table} t
+        JOIN chain_b c ON t.tree_version_id = c.version_id
+        WHERE c.version_id NOT IN (SELECT version_id FROM chain_a){id_range}
+    )"""
+
+
+class VersionDiff:
+    """
+    Changes between two versions, matched on stable node and edge ids and computed
+    set-wise in SQLite. Iterating yields (kind, change, before, after) tuples:
+    kind is "node" or "edge", change is "added", "removed" or "modified", and
+    before/after are the TreeNode/TreeEdge in version a and b (None when absent).
+
+    Rows are streamed from the cursor, so a large diff never has to fit in memory.
+    Its cost grows with the rows written since the versions' common ancestor,
+    not with the size of the versions.
+
+    id_range, an inclusive (low, high) pair, limits it to the nodes and edges with
+    ids in that range: parallel() diffs the ranges of a large change set on a
+    ParallelPipeline and chains them back in order.
+    """
+
+    def __init__(self, version_a_id: int, version_b_id: int, id_range: tuple[int, int] = None):
+        # An empty chain would make every row look shared, so the diff would be empty
+        if version_a_id is None or version_b_id is None:
+            raise ValueError("A diff needs two versions.")
+        self.version_a_id = version_a_id
+        self.version_b_id = version_b_id
+        self.id_range = id_range
+
+    @classmethod
+    def parallel(cls, version_a_id: int, version_b_id: int, workers: int) -> list[tuple]:
+        """
+        The changes of VersionDiff(version_a_id, version_b_id) as a list in the same
+        order, the node and the edge ids partitioned across workers processes.
+        """
+        changes = []
+        with ParallelPipeline(workers) as pipeline:
+            for kind, table, id_column in (("node", "TreeNode", "node_id"), ("edge", "TreeEdge", "edge_id")):
+                ranges = pipeline.ranges(table, id_column, version_a_id, version_b_id)
+                for part in pipeline.map(_diff_partition, ranges, kind, version_a_id, version_b_id):
+                    changes += part
+        return changes
+
+    def _changed_ids_cte(self, table: str, id_column: str) -> str:
+        id_range = ""
+        if self.id_range is not None:
+            low, high = self.id_range
+            id_range = f" AND t.{id_column} BETWEEN {int(low)} AND {int(high)}"
+        return CHANGED_IDS_CTE.format(
+            chain_a=version_chain_cte("chain_a"), chain_b=version_chain_cte("chain_b"),
+            table=table, id_column=id_column, id_range=id_range
+        )
+
+    def node_rows(self):
+        """
+        (a, b) row pairs of the nodes that differ, with data_hash; None for a missing side.
+        """
+        where = "n.node_id IN (SELECT item_id FROM candidates)"
+        return self._resolved(f"""
+            WITH RECURSIVE {self._changed_ids_cte("TreeNode", "node_id")},
+            {visible_nodes_cte(where, name="nodes_a", chain="chain_a")},
+            {visible_nodes_cte(where, name="nodes_b", chain="chain_b")}
+            SELECT 0 AS side, id, tree_version_id, data, data_hash, created_at FROM nodes_a
+            UNION ALL
+            SELECT 1 AS side, id, tree_version_id, data, data_hash, created_at FROM nodes_b
+            ORDER BY id, side
+        """)
+
+    def edge_rows(self):
+        """
+        (a, b) row pairs of the edges that differ, like node_rows.
+        """
+        where = "e.edge_id IN (SELECT item_id FROM candidates)"
+        return self._resolved(f"""
+            WITH RECURSIVE {self._changed_ids_cte("TreeEdge", "edge_id")},
+            {visible_edges_cte(where, name="edges_a", chain="chain_a")},
+            {visible_edges_cte(where, name="edges_b", chain="chain_b")}
+            SELECT 0 AS side, id, tree_version_id, incoming_node_id, outgoing_node_id, data, data_hash, created_at
+            FROM edges_a
+            UNION ALL
+            SELECT 1 AS side, id, tree_version_id, incoming_node_id, outgoing_node_id, data, data_hash, created_at
+            FROM edges_b
+            ORDER BY id, side
+        """)
+
+    def nodes(self):
+        for a, b in self.node_rows():
+            before, after = self.node(a), self.node(b)
+            yield ("node", self._change(before, after), before, after)
+
+    def edges(self):
+        for a, b in self.edge_rows():
+            before, after = self.edge(a), self.edge(b)
+            yield ("edge", self._change(before, after), before, after)
+
+    @staticmethod
+    def node(row) -> TreeNode:
+        if row is None:
+            return None
+        return TreeNode(row["id"], row["tree_version_id"], row["data"], row["created_at"])
+
+    @staticmethod
+    def edge(row) -> TreeEdge:
+        if row is None:
+            return None
+        return TreeEdge(row["id"], row["tree_version_id"], row["incoming_node_id"], row["outgoing_node_id"],
+                        row["data"], row["created_at"])
+
+    def _resolved(self, sql: str):
+        """
+        Run sql, whose rows are the resolved candidates of side a (side 0) and b (side 1)
+        ordered by id, and yield the (a, b) row pairs that differ, None for a missing side.
+        Merging the sorted stream here avoids joining two unindexed CTEs in SQLite.
+        """
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(sql, (self.version_a_id, self.version_b_id))
+        pending = None
+        for row in cursor:
+            if pending is not None and pending["id"] == row["id"]:
+                # Payloads are content-addressed: equal hashes, equal data
+                if pending["data_hash"] != row["data_hash"]:
+                    yield pending, row
+                pending = None
+                continue
+            if pending is not None:
+                yield (pending, None) if pending["side"] == 0 else (None, pending)
+            pending = row
+        if pending is not None:
+            yield (pending, None) if pending["side"] == 0 else (None, pending)
+
+    @staticmethod
+    def _change(before, after) -> str:
+        if before is None:
+            return "added"
+        if after is None:
+            return "removed"
+        return "modified"
+
+    def __iter__(self):
+        yield from self.nodes()
+        yield from self.edges()
+
+    def __repr__(self):
+        return f"<VersionDiff a={self.version_a_id}, b={self.version_b_id}>"
+
+
+def _diff_partition(kind: str, version_a_id: int, version_b_id: int, low: int, high: int) -> list[tuple]:
+    """
+    Worker side of VersionDiff.parallel: the node or edge changes with ids between low and high.
+    """
+    diff = VersionDiff(version_a_id, version_b_id, (low, high))
+    return list(diff.nodes() if kind == "node" else diff.edges())
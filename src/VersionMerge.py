@@ -0,0 +1,162 @@
+import json
+from db.database import get_connection, write
+from src.ReadCache import read_cache
+from src.TreeVersion import TreeVersion, VERSION_CHAIN_CTE, visible_edges_cte
+from src.TreeNode import TreeNode
+from src.VersionDiff import VersionDiff
+
+
+class VersionMerge:
+    """
+    Three-way merge of a source version into a target version, against their
+    merge base. The result is a new child version of the target that also holds
+    the source's changes, written as rows on top of the target like any other
+    copy-on-write version, so the cost grows with the changes on both branches
+    (found by VersionDiff), not with the size of the versions.
+
+    A node or edge changed differently on both branches is a conflict, resolved
+    in favour of prefer ("target" or "source"). So are the changes that would
+    leave an edge dangling: a source edge to a node the target removed, and a
+    source removal of a node the target added edges to. Those keep the target's
+    side. conflicts lists (kind, id, base, source, target) tuples, with the
+    TreeNode/TreeEdge of each version (None when absent).
+    """
+
+    PREFER = ("target", "source")
+
+    def __init__(self, base_version_id: int, source_version_id: int, target_version_id: int,
+                 prefer: str = "target"):
+        if prefer not in self.PREFER:
+            raise ValueError(f"Unknown merge preference '{prefer}', expected one of {self.PREFER}.")
+        if base_version_id is None:
+            # Diffing against no base would find no changes and silently drop the source's
+            raise ValueError("A merge needs a base version: the source and target share no history.")
+        self.base_version_id = base_version_id
+        self.source_version_id = source_version_id
+        self.target_version_id = target_version_id
+        self.prefer = prefer
+        self.version_id = None
+        self.applied = 0
+        self.conflicts = []
+
+    def write(self, tree_id: int) -> TreeVersion:
+        """
+        Write the merged version and return it. Does not commit on its own: run it
+        in a transaction, so a failed merge leaves nothing behind.
+        """
+        nodes = self._changes(VersionDiff.node_rows, VersionDiff.node, "node")
+        edges = self._changes(VersionDiff.edge_rows, VersionDiff.edge, "edge")
+        version = TreeVersion.create(tree_id, self.target_version_id)
+        self.version_id = version.id
+
+        removed = [(node_id, rows) for node_id, rows in nodes.items() if rows[1] is None]
+        self._write_nodes([(node_id, rows[1]["data_hash"], 0) for node_id, rows in nodes.items() if rows[1]])
+
+        # Source edges may only point at nodes the merged version has
+        endpoints = {row[key] for _, (_, row, _) in edges.items() if row
+                     for key in ("incoming_node_id", "outgoing_node_id")}
+        live = {node.id for node in TreeNode.get_many(self.version_id, list(endpoints))}
+        edge_rows = []
+        for edge_id, (base, source, target) in edges.items():
+            if source is None:
+                edge_rows.append((edge_id, base["incoming_node_id"], base["outgoing_node_id"], None, 1))
+            elif source["incoming_node_id"] in live and source["outgoing_node_id"] in live:
+                edge_rows.append((edge_id, source["incoming_node_id"], source["outgoing_node_id"],
+                                  source["data_hash"], 0))
+            else:
+                self._conflict("edge", edge_id, VersionDiff.edge, base, source, target)
+        self._write_edges(edge_rows)
+
+        # A node is only removed once no edge of the merged version touches it
+        attached = self._attached([node_id for node_id, _ in removed])
+        tombstones = []
+        for node_id, (base, source, target) in removed:
+            if node_id in attached:
+                self._conflict("node", node_id, VersionDiff.node, base, source, target)
+            else:
+                tombstones.append((node_id, None, 1))
+        self._write_nodes(tombstones)
+        return version
+
+    def _changes(self, rows, model, kind: str) -> dict:
+        """
+        The source's changes to apply, as {id: (base row, source row, target row)}.
+        Changes the target made the same way are dropped, conflicting ones resolved.
+        """
+        target = {}
+        for base, after in rows(VersionDiff(self.base_version_id, self.target_version_id)):
+            target[(base or after)["id"]] = after
+        changes = {}
+        for base, source in rows(VersionDiff(self.base_version_id, self.source_version_id)):
+            item_id = (base or source)["id"]
+            if item_id not in target:
+                changes[item_id] = (base, source, None)
+                continue
+            theirs = target[item_id]
+            if self._hash(source) == self._hash(theirs):
+                continue
+            self._conflict(kind, item_id, model, base, source, theirs)
+            if self.prefer == "source":
+                changes[item_id] = (base or theirs, source, theirs)
+        return changes
+
+    def _conflict(self, kind: str, item_id: int, model, base, source, target):
+        # Reported once, even when the preferred source side then fails the edge checks
+        if any(c[0] == kind and c[1] == item_id for c in self.conflicts):
+            return
+        self.conflicts.append((kind, item_id, model(base), model(source), model(target)))
+
+    def _attached(self, node_ids: list[int]) -> set[int]:
+        """
+        The nodes among node_ids with a live edge in the merged version.
+        """
+        if not node_ids:
+            return set()
+        candidates = """e.edge_id IN (
+                SELECT e1.edge_id FROM TreeEdge e1
+                JOIN version_chain c1 ON e1.tree_version_id = c1.version_id
+                WHERE e1.incoming_node_id IN (SELECT value FROM json_each(?2))
+                UNION
+                SELECT e2.edge_id FROM TreeEdge e2
+                JOIN version_chain c2 ON e2.tree_version_id = c2.version_id
+                WHERE e2.outgoing_node_id IN (SELECT value FROM json_each(?2))
+            )"""
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE {VERSION_CHAIN_CTE}, {visible_edges_cte(candidates)}
+            SELECT incoming_node_id, outgoing_node_id FROM visible_edges
+        """, (self.version_id, json.dumps(node_ids)))
+        return {node_id for r in cursor.fetchall() for node_id in r} & set(node_ids)
+
+    def _write_nodes(self, rows: list[tuple]):
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO TreeNode (node_id, tree_version_id, data_hash, is_deleted)
+                VALUES (?, ?, ?, ?)
+            """, ((node_id, self.version_id, data_hash, is_deleted) for node_id, data_hash, is_deleted in rows))
+        self._written(len(rows))
+
+    def _write_edges(self, rows: list[tuple]):
+        with write() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO TreeEdge (edge_id, tree_version_id, incoming_node_id, outgoing_node_id, data_hash, is_deleted)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, ((edge_id, self.version_id, node_in, node_out, data_hash, is_deleted)
+                  for edge_id, node_in, node_out, data_hash, is_deleted in rows))
+        self._written(len(rows))
+
+    def _written(self, count: int):
+        self.applied += count
+        read_cache.invalidate_version(self.version_id)
+
+    @staticmethod
+    def _hash(row):
+        # Both sides removed it: None on both
+        return row["data_hash"] if row is not None else None
+
+    def __repr__(self):
+        return (f"<VersionMerge base={self.base_version_id}, source={self.source_version_id}, "
+                f"target={self.target_version_id}, applied={self.applied}, conflicts={len(self.conflicts)}>")
@@ -1,4 +1,4 @@
-from db.database import get_connection, initialize_db
+from db.database import get_connection, initialize_db, close_all_connections
 from src.Tree import Tree
 from src.TreeVersion import TreeVersion 
 from src.Tag import Tag
@@ -9,7 +9,6 @@ def main():
      # 1) Initialize the database (run migrations)
     conn = get_connection()
     initialize_db(conn)  # creates tables if not exist
-    conn.close()
 
     # 1) Create a Tree
     Tree.create('My Configuration')
@@ -56,6 +55,7 @@ def main():
         root_nodes = historical_tree.get_root_nodes()
         for root in root_nodes:
             traverse_tree(historical_tree, root.id)
+    close_all_connections()
 
 def traverse_tree(tree_obj: Tree, node_id: int):
     node = tree_obj.get_node(node_id)
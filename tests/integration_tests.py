@@ -1,6 +1,6 @@
 import pytest
 import os
-from db.database import get_connection, initialize_db
+from db.database import configure, get_connection, initialize_db, close_all_connections
 from src.Tree import Tree
 
 """
@@ -13,11 +13,12 @@ are the same.
 """
 
 @pytest.fixture(scope="function")
-def db_conn():
+def db_conn(tmp_path):
+    configure(tmp_path / "tree_system.db")
     conn = get_connection()
     initialize_db(conn)
     yield conn
-    conn.close()
+    close_all_connections()
 
 def test_restore_and_tagging(db_conn):
     """
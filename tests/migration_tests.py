@@ -0,0 +1,139 @@
+import sqlite3
+import pytest
+from db.migrate import migrate, list_migrations, pending_migrations, BASELINE_VERSION
+from db.database import configure, close_all_connections
+from src.Tree import Tree
+
+
+@pytest.fixture(scope="function")
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "tree_system.db")
+    yield conn
+    conn.close()
+
+
+def applied(conn):
+    return [r[0] for r in conn.execute("SELECT version FROM SchemaMigration ORDER BY version")]
+
+
+def index_names(conn):
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_new_database_gets_current_schema(conn):
+    applied_names = migrate(conn)
+
+    assert applied_names == ["schema.sql"]
+    assert applied(conn) == [version for version, _, _ in list_migrations()]
+    assert "idx_treeedge_version_incoming" in index_names(conn)
+    assert pending_migrations(conn) == []
+    assert migrate(conn) == []
+
+
+def test_database_created_before_runner_is_upgraded_in_place(conn):
+    """
+    A database at the last full-rebuild migration keeps its rows and only gets the incremental scripts.
+    """
+    baseline = [path for version, _, path in list_migrations() if version == BASELINE_VERSION][0]
+    with open(baseline) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO Tree (name) VALUES ('Existing')")
+    conn.commit()
+
+    applied_names = migrate(conn)
+
+    assert applied_names == [name for version, name, _ in list_migrations() if version > BASELINE_VERSION]
+    assert conn.execute("SELECT name FROM Tree").fetchall() == [("Existing",)]
+    assert "idx_treeedge_version_outgoing" in index_names(conn)
+    assert "idx_treeedge_tree_version_id" not in index_names(conn)
+    assert "idx_treeversion_parent_version_id" in index_names(conn)
+    assert "head_version_id" in [r[1] for r in conn.execute("PRAGMA table_info(Tree)")]
+
+
+def test_failing_migration_rolls_back_every_pending_script(conn, tmp_path):
+    migrate(conn)
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    for _, name, path in list_migrations():
+        with open(path) as f:
+            (migrations_dir / f"{name}.sql").write_text(f.read())
+    (migrations_dir / "900_add_column.sql").write_text("ALTER TABLE Tree ADD COLUMN owner TEXT;")
+    (migrations_dir / "901_broken.sql").write_text("CREATE INDEX idx_broken ON MissingTable(id);")
+
+    with pytest.raises(sqlite3.OperationalError):
+        migrate(conn, str(migrations_dir))
+
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(Tree)")]
+    assert "owner" not in columns
+    assert 900 not in applied(conn)
+    assert [version for version, _, _ in pending_migrations(conn, str(migrations_dir))] == [900, 901]
+
+
+def test_upgrade_moves_payloads_into_payload_table(conn):
+    baseline = [path for version, _, path in list_migrations() if version == BASELINE_VERSION][0]
+    with open(baseline) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO Tree (name) VALUES ('Existing')")
+    conn.execute("INSERT INTO TreeVersion (tree_id) VALUES (1)")
+    conn.executemany("INSERT INTO TreeNode (tree_version_id, data) VALUES (1, ?)",
+                     [('{"k": 1}',), ('{"k": 1}',), ('{"k": 2}',)])
+    conn.commit()
+
+    migrate(conn)
+
+    assert "data" not in [r[1] for r in conn.execute("PRAGMA table_info(TreeNode)")]
+    assert conn.execute("SELECT COUNT(*) FROM Payload").fetchone()[0] == 2
+    assert conn.execute("""
+        SELECT p.data FROM TreeNode n JOIN Payload p ON p.hash = n.data_hash ORDER BY n.id
+    """).fetchall() == [('{"k": 1}',), ('{"k": 1}',), ('{"k": 2}',)]
+
+
+def test_full_copy_database_is_upgraded_in_place(conn, tmp_path):
+    """
+    A database in the layout of 004, where a cloned version holds copies of all its
+    parent's rows, gets node and edge identities and keeps every version's contents.
+    """
+    legacy = [path for version, _, path in list_migrations() if version == 4][0]
+    with open(legacy) as f:
+        conn.executescript(f.read())
+    conn.executescript("""
+        INSERT INTO Tree (name) VALUES ('Existing');
+        INSERT INTO TreeVersion (tree_id) VALUES (1);
+        INSERT INTO TreeNode (tree_version_id, data) VALUES (1, '{"n": "a"}'), (1, '{"n": "b"}');
+        INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data) VALUES (1, 1, 2, '{}');
+        INSERT INTO TreeVersion (tree_id, parent_version_id) VALUES (1, 1);
+        INSERT INTO TreeNode (tree_version_id, data) VALUES (2, '{"n": "a"}'), (2, '{"n": "b"}'), (2, '{"n": "c"}');
+        INSERT INTO TreeEdge (tree_version_id, incoming_node_id, outgoing_node_id, data)
+        VALUES (2, 3, 4, '{}'), (2, 4, 5, '{}');
+        INSERT INTO Tag (tree_version_id, tree_id, tag_name) VALUES (1, 1, 'v1'), (2, 1, 'v2');
+    """)
+
+    applied_names = migrate(conn)
+
+    assert applied_names[0] == "legacy_upgrade.sql"
+    assert applied(conn) == [version for version, _, _ in list_migrations()]
+    assert pending_migrations(conn) == []
+    configure(tmp_path / "tree_system.db")
+    try:
+        v1, v2 = Tree.get_by_tag("v1"), Tree.get_by_tag("v2")
+        assert [n.data for n in v1.get_all_nodes()] == [{"n": "a"}, {"n": "b"}]
+        assert [n.id for n in v2.get_all_nodes()] == [3, 4, 5]
+        assert [n.id for n in v2.get_descendants(3)] == [4, 5]
+        node = v2.add_node({"n": "d"})
+        v2.add_edge(5, node.id, {})
+        v2.create_tag("v3")
+        assert [n.id for n in Tree.get_by_tag("v3").get_descendants(3)] == [4, 5, node.id]
+        assert len(Tree.get_by_tag("v1").get_all_edges()) == 1
+    finally:
+        close_all_connections()
+
+
+def test_database_without_versions_is_refused(conn):
+    legacy = [path for version, _, path in list_migrations() if version == 2][0]
+    with open(legacy) as f:
+        conn.executescript(f.read())
+    conn.commit()
+
+    with pytest.raises(ValueError, match="predates tree versions"):
+        migrate(conn)
+    assert applied(conn) == []
@@ -0,0 +1,114 @@
+import re
+import pytest
+from db.database import configure, get_connection, initialize_db, close_all_connections
+from src.Tree import Tree
+from src.TreeNode import TreeNode
+from src.TreeEdge import TreeEdge
+from src.SqlTraversal import SqlTraversal
+from src.Payload import Payload
+
+"""
+Query-plan regression tests for the neighbour lookups.
+
+Every access to TreeEdge (aliases e, e1, e2 in the model SQL) has to be an index
+search on the version plus an endpoint or edge id. A plan that reads TreeEdge by
+tree_version_id alone scans the whole version's edge set on each call.
+"""
+
+EDGE_ACCESS = re.compile(r"^(SCAN|SEARCH) (TreeEdge|e|e1|e2)\b")
+
+
+@pytest.fixture(scope="function")
+def tree(tmp_path):
+    configure(tmp_path / "tree_system.db")
+    initialize_db(get_connection())
+    Tree.create("PlanTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"node": "A"})
+    node2 = tree.add_node({"node": "B"})
+    tree.add_edge(node1.id, node2.id, {})
+    tree.create_tag("v1")
+    tree.add_edge(node2.id, tree.add_node({"node": "C"}).id, {})
+    yield tree
+    close_all_connections()
+
+
+def query_plans(call) -> list[str]:
+    """
+    Run call and return the EXPLAIN QUERY PLAN lines of every statement it executed.
+    """
+    conn = get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+    lines = []
+    for sql in statements:
+        lines += [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    return lines
+
+
+def assert_no_edge_scans(plan: list[str]):
+    edge_steps = [line for line in plan if EDGE_ACCESS.match(line)]
+    assert edge_steps, plan
+    for line in edge_steps:
+        assert line.startswith("SEARCH"), line
+        assert "tree_version_id=? AND " in line, line
+    assert not [line for line in plan if "AUTOMATIC" in line], plan
+
+
+def test_get_for_node_plan(tree):
+    plan = query_plans(lambda: TreeEdge.get_for_node(tree.working_version.id, 2))
+    assert_no_edge_scans(plan)
+    assert any("idx_treeedge_version_incoming" in line for line in plan)
+    assert any("idx_treeedge_version_outgoing" in line for line in plan)
+
+
+@pytest.mark.parametrize("lookup", ["get_children", "get_parents"])
+def test_neighbour_plans(tree, lookup):
+    plan = query_plans(lambda: getattr(TreeNode, lookup)(tree.working_version.id, 2))
+    assert_no_edge_scans(plan)
+
+
+def test_get_roots_plan(tree):
+    plan = query_plans(lambda: TreeNode.get_roots(tree.working_version.id))
+    assert_no_edge_scans(plan)
+    assert not [line for line in plan if "LIST SUBQUERY" in line]
+
+
+@pytest.mark.parametrize("call", [
+    lambda t: t.children(2),
+    lambda t: t.parents(2),
+    lambda t: t.roots(),
+    lambda t: t.nodes_at_depth(2),
+    lambda t: t.descendants(1, max_depth=3),
+    lambda t: t.descendants(1),
+    lambda t: t.ancestors(3),
+    lambda t: t.find_path(1, 3),
+])
+def test_sql_traversal_plans(tree, call):
+    plan = query_plans(lambda: call(SqlTraversal(tree.working_version.id)))
+    assert_no_edge_scans(plan)
+
+
+def test_iter_edges_plan(tree):
+    plan = query_plans(lambda: list(tree.iter_edges(page_size=1)))
+    assert_no_edge_scans(plan)
+    # Keyset pages are index range reads
+    assert any("(tree_version_id=? AND edge_id>?)" in line for line in plan), plan
+
+
+def test_find_nodes_plan(tree):
+    Payload.create_index("node")
+    plan = query_plans(lambda: tree.find_nodes(node="B"))
+    assert any(line.startswith("SEARCH Payload USING INDEX idx_payload_node") for line in plan), plan
+    assert any("idx_treenode_data_hash" in line for line in plan), plan
+    assert not [line for line in plan if re.match(r"SCAN (n|n2|p|TreeNode|Payload)\b", line)], plan
+
+
+def test_version_descendants_plan(tree):
+    plan = query_plans(lambda: tree.descendants("v1"))
+    assert any("idx_treeversion_parent_version_id" in line for line in plan), plan
+    assert not [line for line in plan if re.match(r"SCAN (v|TreeVersion)\b", line)], plan
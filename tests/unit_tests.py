@@ -1,16 +1,28 @@
+import asyncio
+import contextlib
 import pytest
+import sqlite3
+import threading
 from src.Tree import Tree
 from src.TreeVersion import TreeVersion
 from src.Tag import Tag
 from src.TreeNode import TreeNode
-from db.database import get_connection, initialize_db
+from src.TreeEdge import TreeEdge
+from src.ReadCache import read_cache
+from src.GarbageCollector import GarbageCollector
+from src.Payload import Payload
+from src.AsyncTree import AsyncTree
+from src.VersionMerge import VersionMerge
+from db.database import configure, get_connection, initialize_db, close_all_connections, close_connection, transaction
+from db import instrumentation
 
 @pytest.fixture(scope="function")
-def db_conn():
+def db_conn(tmp_path):
+    configure(tmp_path / "tree_system.db")
     conn = get_connection()
     initialize_db(conn)
     yield conn
-    conn.close()
+    close_all_connections()
 
 
 def test_create_tree(db_conn):
@@ -130,3 +142,920 @@ def test_pathfinding(db_conn):
     assert path[0][0].data == {"node": "A"}
     assert path[1][0].data == {"node": "B"}
     assert path[2][0].data == {"node": "C"}
+
+
+def test_tag_shares_rows_with_working_version(db_conn):
+    Tree.create("CowTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "value"})
+    tree.create_tag("v1", "Baseline")
+    branch = tree.create_new_tree_version_from_tag("v1")
+
+    # Tagging and branching copy nothing and keep node identity
+    row_count = db_conn.execute("SELECT COUNT(*) FROM TreeNode").fetchone()[0]
+    assert row_count == 1
+    assert branch.get_node(node1.id).data == {"key": "value"}
+
+
+def test_modify_and_remove_in_child_version(db_conn):
+    Tree.create("CowEditTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a"})
+    node2 = tree.add_node({"key": "b"})
+    edge = tree.add_edge(node1.id, node2.id, {"relation": "connected"})
+    tree.create_tag("v1", "Baseline")
+
+    branch = tree.create_new_tree_version_from_tag("v1")
+    branch.update_node(node1.id, {"key": "changed"})
+    branch.remove_node(node2.id)
+
+    assert branch.get_node(node1.id).data == {"key": "changed"}
+    assert branch.get_node(node2.id) is None
+    assert len(branch.get_all_edges()) == 0
+
+    # The tagged version is untouched
+    restored = tree.restore_from_tag("v1")
+    assert restored.get_node(node1.id).data == {"key": "a"}
+    assert len(restored.get_all_nodes()) == 2
+    assert restored.get_all_edges()[0].id == edge.id
+
+
+def test_clone_version_materializes_resolved_rows(db_conn):
+    Tree.create("FlattenTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a"})
+    node2 = tree.add_node({"key": "b"})
+    tree.add_edge(node1.id, node2.id, {"relation": "connected"})
+    tree.create_tag("v1", "Baseline")
+    tree.update_node(node1.id, {"key": "changed"})
+    tree.remove_node(node2.id)
+
+    flat = TreeVersion.create(tree.id)
+    flat.clone_from(tree.working_version.id)
+
+    nodes = TreeNode.get_roots(flat.id)
+    assert [(n.id, n.data) for n in nodes] == [(node1.id, {"key": "changed"})]
+    assert db_conn.execute(
+        "SELECT COUNT(*) FROM TreeEdge WHERE tree_version_id = ?", (flat.id,)
+    ).fetchone()[0] == 0
+
+
+def test_connection_is_pooled_per_thread(db_conn):
+    assert get_connection() is db_conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not db_conn
+
+    close_connection()
+    reopened = get_connection()
+    assert reopened is not db_conn
+    assert reopened.execute("SELECT COUNT(*) FROM Tree").fetchone()[0] == 0
+
+
+def test_graph_index_tracks_working_version(db_conn):
+    Tree.create("IndexTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"node": "A"})
+    node2 = tree.add_node({"node": "B"})
+    tree.add_edge(node1.id, node2.id, {})
+
+    index = tree.graph_index()
+    assert index.children(node1.id) == [node2.id]
+    assert index.roots() == [node1.id]
+
+    # Later writes update the loaded index in place
+    node3 = tree.add_node({"node": "C"})
+    tree.add_edge(node2.id, node3.id, {})
+    assert tree.graph_index() is index
+    assert [n.data for n in tree.get_nodes_at_depth(2)] == [{"node": "C"}]
+    assert [n.id for n in tree.get_parent_nodes(node3.id)] == [node2.id]
+
+    index.compact()
+    assert index.parents(node3.id) == [node2.id]
+    assert [n.id for n, _ in tree.find_path(node1.id, node3.id)] == [node1.id, node2.id, node3.id]
+
+    tree.remove_node(node2.id)
+    assert tree.find_path(node1.id, node3.id) == []
+    assert sorted(n.id for n in tree.get_root_nodes()) == [node1.id, node3.id]
+
+
+@pytest.mark.parametrize("engine", Tree.TRAVERSAL_ENGINES)
+def test_traversal_engines(db_conn, engine):
+    """
+        A --> B --> D
+        |           ^
+        +---> C ----+      E (isolated)
+    """
+    Tree.create("EngineTree")
+    tree = Tree.get(tree_id=1)
+    tree.traversal_engine = engine
+    a, b, c, d, e = (tree.add_node({"node": name}) for name in "ABCDE")
+    tree.add_edge(a.id, b.id, {})
+    tree.add_edge(a.id, c.id, {})
+    tree.add_edge(b.id, d.id, {})
+    tree.add_edge(c.id, d.id, {})
+    tree.create_tag("v1")
+
+    def ids(nodes):
+        return sorted(n.id for n in nodes)
+
+    assert ids(tree.get_root_nodes()) == [a.id, e.id]
+    assert ids(tree.get_nodes_at_depth(1)) == [b.id, c.id]
+    assert ids(tree.get_nodes_at_depth(2)) == [d.id]
+    assert ids(tree.get_descendants(a.id)) == [b.id, c.id, d.id]
+    assert ids(tree.get_descendants(a.id, max_depth=1)) == [b.id, c.id]
+    assert ids(tree.get_ancestors(d.id)) == [a.id, b.id, c.id]
+    assert ids(tree.get_parent_nodes(d.id)) == [b.id, c.id]
+
+    path = tree.find_path(a.id, d.id)
+    assert [n.id for n, _ in path] == [a.id, b.id, d.id]
+    assert [edge.outgoing_node_id for _, edge in path[:-1]] == [b.id, d.id]
+    assert tree.find_path(d.id, a.id) == []
+
+    tree.remove_node(b.id)
+    assert [n.id for n, _ in tree.find_path(a.id, d.id)] == [a.id, c.id, d.id]
+
+
+def test_bulk_add_nodes_and_edges(db_conn):
+    Tree.create("BulkTree")
+    tree = Tree.get(tree_id=1)
+    tree.graph_index()
+
+    node_ids = tree.add_nodes(({"i": i} for i in range(25)), chunk_size=10)
+    edge_ids = tree.add_edges(
+        ((node_ids[0], node_id, {"w": k}) for k, node_id in enumerate(node_ids[1:])), chunk_size=10
+    )
+
+    assert len(node_ids) == 25 and len(set(node_ids)) == 25
+    assert [n.data for n in TreeNode.get_many(tree.working_version.id, node_ids[:3])] == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert [tree.get_node(node_id).data["i"] for node_id in node_ids] == list(range(25))
+    assert len(edge_ids) == 24
+    assert sorted(n.id for n in tree.get_child_nodes(node_ids[0])) == node_ids[1:]
+    assert [n.id for n in tree.get_root_nodes()] == [node_ids[0]]
+
+
+def test_transaction_defers_commits_and_rolls_back(db_conn):
+    Tree.create("BatchTree")
+    tree = Tree.get(tree_id=1)
+
+    with tree.transaction():
+        node1 = tree.add_node({"key": "a"})
+        node2 = tree.add_node({"key": "b"})
+        tree.add_edge(node1.id, node2.id, {})
+        assert db_conn.in_transaction
+    assert not db_conn.in_transaction
+    assert len(tree.get_all_nodes()) == 2
+
+    with pytest.raises(RuntimeError):
+        with tree.transaction():
+            tree.add_node({"key": "c"})
+            tree.add_nodes([{"key": "d"}, {"key": "e"}])
+            raise RuntimeError("abort")
+    assert len(tree.get_all_nodes()) == 2
+
+    # batch() is the same unit of work
+    with tree.batch():
+        tree.add_node({"key": "f"})
+        assert db_conn.in_transaction
+    assert len(tree.get_all_nodes()) == 3
+
+
+def test_failed_create_tag_resets_the_handle(db_conn):
+    tree = Tree.create("FailedTagTree")
+    Tree.get(tree.id).create_tag("v1")
+
+    # The working version is created inside create_tag, then rolled back with it
+    other = Tree.get(tree.id)
+    with pytest.raises(sqlite3.IntegrityError):
+        other.create_tag("v1")
+    assert other.working_version.id == TreeVersion.get(other.working_version.id).id
+    node = other.add_node({"key": "after"})
+    other.create_tag("v2")
+    assert [n.id for n in Tree.get_by_tag("v2").get_all_nodes()] == [node.id]
+
+
+def test_failed_remove_node_resets_the_handle(db_conn, monkeypatch):
+    tree = Tree.create("FailedRemoveTree")
+    node = tree.add_node({"from": "tree"})
+    tree.create_tag("r1")
+
+    def fail(*args):
+        raise sqlite3.OperationalError("disk I/O error")
+    handle = Tree.get_by_tag("r1")
+    with monkeypatch.context() as patch:
+        patch.setattr(TreeNode, "delete", fail)
+        with pytest.raises(sqlite3.OperationalError):
+            handle.remove_node(node.id)
+    assert handle.version_id == Tag.get_version_id_for_tag("r1")
+    handle.add_node({"from": "h"})
+    assert TreeVersion.get(handle.working_version.id) is not None
+
+    # A second handle gets a version of its own, without the first handle's node
+    other = Tree.get_by_tag("r1")
+    other.add_node({"from": "other"})
+    assert other.working_version.id != handle.working_version.id
+    assert sorted(n.data["from"] for n in other.get_all_nodes()) == ["other", "tree"]
+
+
+def test_failed_write_releases_the_write_lock(db_conn):
+    tree = Tree.create("FailedWriteTree")
+    version = TreeVersion.create(tree.id)
+    Tag.create(tree.id, version.id, "v1")
+    with pytest.raises(sqlite3.IntegrityError):
+        Tag.create(tree.id, version.id, "v1")
+    assert not db_conn.in_transaction
+
+    # Another connection can write straight away
+    created = []
+    thread = threading.Thread(target=lambda: (created.append(Tree.create("OtherTree")), close_connection()))
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive() and created
+
+
+def test_nested_transaction_rolls_back_to_savepoint(db_conn):
+    Tree.create("SavepointTree")
+    tree = Tree.get(tree_id=1)
+    working_version = tree.working_version
+
+    with tree.transaction():
+        tree.add_node({"key": "kept"})
+        with pytest.raises(ValueError):
+            with tree.transaction():
+                tree.add_node({"key": "dropped"})
+                tree.create_tag("release-v1.0")
+                raise ValueError("abort inner")
+        # The inner block's tag and version switch are undone, the outer block goes on
+        assert tree.working_version is working_version and tree.checkpoint_version is None
+        tree.create_tag("release-v1.1")
+
+    assert not db_conn.in_transaction
+    assert Tag.get_by_name("release-v1.0") is None
+    tagged = Tree.get_by_tag("release-v1.1")
+    assert [n.data for n in tagged.get_all_nodes()] == [{"key": "kept"}]
+
+
+def test_diff_between_tags(db_conn):
+    Tree.create("DiffTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"name": "root"})
+    node2 = tree.add_node({"name": "kept"})
+    node3 = tree.add_node({"name": "old"})
+    edge1 = tree.add_edge(node1.id, node2.id, {"w": 1})
+    edge2 = tree.add_edge(node1.id, node3.id, {})
+    tree.create_tag("release-v1.0")
+
+    tree.update_node(node2.id, {"name": "renamed"})
+    tree.remove_node(node3.id)
+    node4 = tree.add_node({"name": "new"})
+    edge3 = tree.add_edge(node1.id, node4.id, {})
+    # Written and reverted again: no change
+    tree.update_edge(edge1.id, {"w": 2})
+    tree.update_edge(edge1.id, {"w": 1})
+    tree.create_tag("release-v1.1")
+
+    changes = [(kind, change, (before or after).id) for kind, change, before, after
+               in tree.diff("release-v1.0", "release-v1.1")]
+    assert changes == [
+        ("node", "modified", node2.id),
+        ("node", "removed", node3.id),
+        ("node", "added", node4.id),
+        ("edge", "removed", edge2.id),
+        ("edge", "added", edge3.id),
+    ]
+    kind, change, before, after = next(tree.diff("release-v1.0", "release-v1.1"))
+    assert (before.data, after.data) == ({"name": "kept"}, {"name": "renamed"})
+
+    assert list(tree.diff("release-v1.1", "release-v1.1")) == []
+    reverse = [(change, (before or after).id) for _, change, before, after
+               in tree.diff("release-v1.1", tree.checkpoint_version.parent_version_id)]
+    assert ("added", node3.id) in reverse and ("removed", node4.id) in reverse
+    with pytest.raises(ValueError):
+        tree.diff("release-v1.0", "missing")
+
+
+def test_reads_do_not_create_versions(db_conn):
+    def version_count():
+        return db_conn.execute("SELECT COUNT(*) FROM TreeVersion").fetchone()[0]
+
+    Tree.create("LazyTree")
+    tree = Tree.get(tree_id=1)
+    assert tree.get_all_nodes() == [] and tree.get_root_nodes() == []
+    assert version_count() == 0
+
+    node1 = tree.add_node({"key": "a"})
+    tree.create_tag("v1")
+    assert version_count() == 1
+    # Tagging again without writes tags the same version
+    assert tree.create_tag("v1-again").tree_version_id == tree.checkpoint_version.id
+
+    for _ in range(3):
+        reader = Tree.get_by_tag("v1")
+        assert [n.id for n in reader.get_all_nodes()] == [node1.id]
+        assert reader.get_node(node1.id).data == {"key": "a"}
+        assert reader.find_path(node1.id, node1.id)[0][0].id == node1.id
+    tree.restore_from_tag("v1").get_all_nodes()
+    assert version_count() == 1
+
+    # The first write creates the working version as a child of the checkpoint
+    writer = Tree.get_by_tag("v1")
+    writer.update_node(node1.id, {"key": "b"})
+    assert version_count() == 2
+    assert writer.working_version.parent_version_id == writer.checkpoint_version.id
+    assert Tree.get_by_tag("v1").get_node(node1.id).data == {"key": "a"}
+
+
+def test_garbage_collector_sweeps_unreachable_versions(db_conn):
+    Tree.create("GcTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a"})
+    tree.create_tag("v1")
+    # Two branches nobody tagged: a working version and a restored copy
+    tree.add_nodes([{"key": "b"}, {"key": "c"}])
+    tree.add_edge(node1.id, tree.add_node({"key": "d"}).id, {})
+    restored = tree.restore_from_tag("v1")
+    restored.update_node(node1.id, {"key": "e"})
+    kept = Tree.get_by_tag("v1")
+    kept.add_node({"key": "kept"})
+
+    collector = GarbageCollector(grace_period=0, keep_version_ids=[kept.working_version.id], batch_size=2)
+    assert collector.report() == {"versions": 2, "nodes": 4, "edges": 1}
+    first = collector.collect(max_seconds=0)
+    assert first["rows"] == 2 and not first["complete"]
+    rest = collector.collect()
+    assert rest["complete"] and first["versions"] + rest["versions"] == 2
+    assert first["rows"] + rest["rows"] == 5
+    assert collector.report() == {"versions": 0, "nodes": 0, "edges": 0}
+    assert db_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    assert [n.data for n in Tree.get_by_tag("v1").get_all_nodes()] == [{"key": "a"}]
+    assert len(kept.get_all_nodes()) == 2
+
+
+def test_garbage_collector_spares_versions_tagged_between_batches(db_conn, monkeypatch):
+    Tree.create("GcTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a"})
+    tree.create_tag("v1")
+    tree.add_nodes([{"key": "b"}, {"key": "c"}])
+    restored = tree.restore_from_tag("v1")
+    restored.update_node(node1.id, {"key": "e"})
+    late_version_id = restored.working_version.id
+
+    batches = []
+
+    @contextlib.contextmanager
+    def tag_before_second_batch():
+        if len(batches) == 1:
+            Tag.create(tree.id, late_version_id, "late")
+        batches.append(None)
+        with transaction():
+            yield
+
+    monkeypatch.setattr("src.GarbageCollector.transaction", tag_before_second_batch)
+    result = GarbageCollector(grace_period=0, batch_size=2).collect()
+    assert result["complete"] and result["versions"] == 1 and result["rows"] == 2
+    assert [n.data for n in Tree.get_by_tag("late").get_all_nodes()] == [{"key": "e"}]
+
+
+def test_read_cache_hits_and_invalidation(db_conn):
+    read_cache.clear()
+    Tree.create("CacheTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a"})
+    node2 = tree.add_node({"key": "b"})
+    tree.add_edge(node1.id, node2.id, {})
+    tree.create_tag("v1")
+
+    version_id = Tag.get_by_name("v1").tree_version_id
+    before = read_cache.stats()
+    assert TreeNode.get(version_id, node1.id).id == TreeNode.get(version_id, node1.id).id
+    assert len(TreeEdge.get_for_node(version_id, node1.id)) == len(TreeEdge.get_for_node(version_id, node1.id)) == 1
+    assert TreeVersion.get_by_tag("v1").id == TreeVersion.get_by_tag("v1").id
+    stats = read_cache.stats()
+    assert stats["hits"] - before["hits"] >= 3
+    assert stats["misses"] - before["misses"] >= 3
+
+    # Every hit is a fresh object: modifying one does not change the tagged version
+    tagged = Tree.get_by_tag("v1")
+    tagged.get_node(node1.id).data["key"] = "mutated"
+    tagged.get_node_edges(node1.id).clear()
+    assert Tree.get_by_tag("v1").get_node(node1.id).data == {"key": "a"}
+    assert len(Tree.get_by_tag("v1").get_node_edges(node1.id)) == 1
+
+    # Writes to the working version drop its entries, not those of the tag
+    assert tree.get_node(node1.id).data == {"key": "a"}
+    tree.update_node(node1.id, {"key": "changed"})
+    assert tree.get_node(node1.id).data == {"key": "changed"}
+    tree.remove_edge(tree.get_node_edges(node1.id)[0].id)
+    assert tree.get_node_edges(node1.id) == []
+    assert TreeNode.get(version_id, node1.id).data == {"key": "a"}
+    assert len(TreeEdge.get_for_node(version_id, node1.id)) == 1
+
+    # A rolled back transaction leaves nothing stale behind
+    with pytest.raises(RuntimeError):
+        with tree.transaction():
+            tree.update_node(node2.id, {"key": "uncommitted"})
+            assert tree.get_node(node2.id).data == {"key": "uncommitted"}
+            raise RuntimeError("abort")
+    assert tree.get_node(node2.id).data == {"key": "b"}
+
+    read_cache.configure(max_entries=2)
+    try:
+        for node_id in (node1.id, node2.id, node1.id):
+            TreeNode.get(version_id, node_id)
+        assert read_cache.stats()["entries"] == 2
+        assert read_cache.stats()["evictions"] > stats["evictions"]
+    finally:
+        read_cache.configure(max_entries=100_000)
+
+
+def test_read_cache_is_invalidated_at_commit(db_conn):
+    tree = Tree.create("CommitCacheTree")
+    node = tree.add_node({"v": "old"})
+
+    # Another thread caches the committed row while the write is still pending
+    def read():
+        seen.append(tree.get_node(node.id).data)
+        close_connection()
+    seen = []
+    with tree.transaction():
+        tree.update_node(node.id, {"v": "new"})
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+    assert seen == [{"v": "old"}]
+    assert tree.get_node(node.id).data == {"v": "new"}
+
+    # A read that started before an invalidation is not cached
+    stamp = read_cache.stamp()
+    read_cache.invalidate_version(tree.working_version.id)
+    read_cache.put(("stale",), tree.working_version.id, "stale", stamp=stamp)
+    assert read_cache.get(("stale",)) is None
+
+
+def test_payloads_are_decoded_lazily(db_conn):
+    Tree.create("LazyJsonTree")
+    tree = Tree.get(tree_id=1)
+    node1 = tree.add_node({"key": "a", "nested": [1, 2]})
+    node2 = tree.add_node({})
+    tree.add_edge(node1.id, node2.id, {"w": 1})
+
+    nodes = TreeNode.get_many(tree.version_id, [node1.id, node2.id])
+    assert nodes[0]._raw == '{"key": "a", "nested": [1, 2]}' and nodes[0]._data is None
+    assert nodes[0].data == {"key": "a", "nested": [1, 2]} and nodes[0]._raw is None
+    assert nodes[1].data == {}
+    edge = tree.get_all_edges()[0]
+    assert edge._data is None and edge.data == {"w": 1}
+
+    for obj in (nodes[0], edge, TreeVersion.get(tree.version_id), Tag.get_by_name(tree.create_tag("v1").tag_name)):
+        assert not hasattr(obj, "__dict__")
+
+
+def test_iter_nodes_and_edges_page_through_the_chain(db_conn):
+    Tree.create("IterTree")
+    tree = Tree.get(tree_id=1)
+    ids = tree.add_nodes({"name": f"n{i}", "attrs": {"a": i}} for i in range(7))
+    tree.add_edges((ids[0], node_id, {"w": node_id}) for node_id in ids[1:])
+    tree.create_tag("v1")
+    tree.update_node(ids[2], {"name": "changed", "attrs": {"a": -1}})
+    tree.remove_node(ids[3])
+    tree.add_node({"name": "new"})
+
+    expected = sorted((n.id, n.data) for n in tree.get_all_nodes())
+    for page_size in (1, 2, 100):
+        assert sorted((n.id, n.data) for n in tree.iter_nodes(page_size=page_size)) == expected
+    assert sorted(e.id for e in tree.iter_edges(page_size=2)) == sorted(e.id for e in tree.get_all_edges())
+
+    projected = {n.id: n.data for n in tree.iter_nodes(fields=["attrs.a"], page_size=3)}
+    assert projected[ids[0]] == {"attrs.a": 0}
+    assert projected[ids[2]] == {"attrs.a": -1}
+    assert {e.data["w"] for e in tree.iter_edges(fields=["w"])} == {ids[1], ids[2], ids[4], ids[5], ids[6]}
+    assert list(Tree.get(tree_id=1).iter_nodes()) == []
+
+
+def test_payloads_are_stored_once(db_conn):
+    def payload_count():
+        return db_conn.execute("SELECT COUNT(*) FROM Payload").fetchone()[0]
+
+    Tree.create("DedupTree")
+    tree = Tree.get(tree_id=1)
+    node_ids = tree.add_nodes({"setting": "same"} for _ in range(5))
+    tree.add_edges((node_ids[0], node_id, {}) for node_id in node_ids[1:])
+    assert payload_count() == 2
+    tree.create_tag("v1")
+
+    tree.update_node(node_ids[1], {"setting": "other"})
+    flat = TreeVersion.create(1)
+    flat.clone_from(tree.working_version.id)
+    assert payload_count() == 3
+    assert [n.data for n in TreeNode.get_many(flat.id, node_ids[:2])] == [{"setting": "same"}, {"setting": "other"}]
+
+    # Once nothing references it, the garbage collector drops the payload
+    tree.update_node(node_ids[1], {"setting": "same"})
+    flat.delete_all_nodes_and_edges()
+    result = GarbageCollector(keep_version_ids=[flat.id]).collect()
+    assert result["payloads"] == 1 and payload_count() == 2
+
+
+def test_find_nodes_by_payload_keys(db_conn):
+    Tree.create("FindTree")
+    tree = Tree.get(tree_id=1)
+    ids = tree.add_nodes({"setting": "X" if i % 2 else "Y", "attrs": {"a": i}} for i in range(6))
+    tree.create_tag("v1")
+    tree.update_node(ids[1], {"setting": "Y", "attrs": {"a": 1}})
+    tree.remove_node(ids[3])
+    new_id = tree.add_node({"setting": "X", "flag": True}).id
+
+    def found(**predicates):
+        return [n.id for n in tree.find_nodes(**predicates)]
+
+    # Same answers with and without an index on the key
+    for indexed in (False, True):
+        if indexed:
+            Payload.create_index("setting")
+            Payload.create_index("attrs.a")
+        assert found(setting="X") == [ids[5], new_id]
+        assert found(setting="Y", attrs__a=1) == [ids[1]]
+        assert found(attrs__a=3) == []
+        assert [n.id for n in Tree.get_by_tag("v1").find_nodes(setting="X")] == [ids[1], ids[3], ids[5]]
+    assert Payload.indexed_keys() == ["attrs.a", "setting"]
+    assert found(flag=True) == [new_id]
+    assert found(flag=None) == ids[:3] + ids[4:6]
+
+    with pytest.raises(ValueError):
+        tree.find_nodes(**{"bad'key": 1})
+    with pytest.raises(ValueError):
+        tree.find_nodes(attrs={"a": 1})
+    Payload.drop_index("setting")
+    assert Payload.indexed_keys() == ["attrs.a"]
+    # Keys that a naive "." -> "__" name would collide on get their own index
+    Payload.create_index("attrs__a")
+    assert Payload.indexed_keys() == ["attrs.a", "attrs__a"]
+    Payload.drop_index("attrs.a")
+    assert Payload.indexed_keys() == ["attrs__a"]
+
+
+def test_snapshot_export_and_import(db_conn, tmp_path):
+    Tree.create("SnapshotTree")
+    tree = Tree.get(tree_id=1)
+    ids = tree.add_nodes({"setting": "same"} if i % 3 else {"name": f"n{i}", "big": 300 * i} for i in range(30))
+    tree.add_edges((ids[0], node_id, {"w": node_id % 2}) for node_id in ids[1:])
+    tree.create_tag("v1")
+    tree.update_node(ids[1], {"setting": "other"})
+    tree.remove_node(ids[2])
+    tree.create_tag("v2", "second")
+
+    for compress in (True, False):
+        path = tmp_path / f"v2-{compress}.snap"
+        with open(path, "wb") as f:
+            counts = tree.export_snapshot("v2", f, compress=compress)
+        assert counts["nodes"] == 29 and counts["edges"] == 28 and counts["payloads"] == 14
+
+        with open(path, "rb") as f:
+            copy = Tree.import_snapshot(f, tag_name=f"v2-copy-{compress}")
+        assert copy.id != tree.id and copy.name == "SnapshotTree"
+        assert Tag.get_by_name(f"v2-copy-{compress}").description == "second"
+        original = Tree.get_by_tag("v2")
+        assert sorted(n.data["setting" if "setting" in n.data else "name"] for n in copy.get_all_nodes()) == \
+            sorted(n.data["setting" if "setting" in n.data else "name"] for n in original.get_all_nodes())
+        # Endpoints are remapped to the new node ids
+        root = copy.get_root_nodes()
+        assert [n.data for n in root] == [{"name": "n0", "big": 0}]
+        assert len(copy.get_child_nodes(root[0].id)) == 28
+
+        # The imported tag is the new tree's head, and tagging from the handle moves it
+        assert copy.head_version_id == Tag.get_version_id_for_tag(f"v2-copy-{compress}")
+        copy.add_node({"name": "after-import"})
+        tag = copy.create_tag(f"v3-copy-{compress}")
+        assert Tree.get(copy.id).head_version_id == tag.tree_version_id == copy.head_version_id
+
+    data = tree.export_snapshot("v1")
+    with pytest.raises(ValueError):
+        Tree.import_snapshot(data)          # tag v1 exists
+    with pytest.raises(ValueError):
+        Tree.import_snapshot(data[:len(data) // 2], tag_name="half")
+    assert Tag.get_by_name("half") is None and len(Tree.get_by_tag("v1").get_all_nodes()) == 30
+    with pytest.raises(ValueError):
+        tree.export_snapshot("missing")
+
+
+def test_parallel_export_and_diff(db_conn):
+    Tree.create("ParallelTree")
+    tree = Tree.get(tree_id=1)
+    ids = tree.add_nodes({"shared": i % 4} for i in range(100))
+    tree.add_edges((ids[i // 2], ids[i], {"w": i % 3}) for i in range(1, 100))
+    tree.create_tag("v1")
+    for node_id in ids[::7]:
+        tree.update_node(node_id, {"changed": node_id})
+    tree.remove_edge(tree.get_node_edges(ids[99])[0].id)
+    tree.add_node({"new": True})
+    tree.create_tag("v2")
+
+    for compress in (True, False):
+        serial = tree.export_snapshot("v2", compress=compress)
+        data = tree.export_snapshot("v2", compress=compress, workers=3)
+        copy = Tree.import_snapshot(data, tag_name=f"parallel-{compress}")
+        assert Tree.import_snapshot(serial, tag_name=f"serial-{compress}") is not None
+        assert sorted(str(n.data) for n in copy.get_all_nodes()) == \
+            sorted(str(n.data) for n in Tree.get_by_tag("v2").get_all_nodes())
+        assert len(copy.get_all_edges()) == 98
+        assert sorted(len(copy.get_child_nodes(n.id)) for n in copy.get_all_nodes())[-2:] == [2, 2]
+
+    def summary(changes):
+        return [(kind, change, (before or after).id) for kind, change, before, after in changes]
+    assert summary(tree.diff("v1", "v2", workers=2)) == summary(tree.diff("v1", "v2"))
+    assert len(summary(tree.diff("v1", "v2"))) == 17
+
+
+def test_version_graph_queries(db_conn):
+    Tree.create("HistoryTree")
+    tree = Tree.get(tree_id=1)
+    node = tree.add_node({"v": 0})
+    tree.create_tag("base")
+    tree.update_node(node.id, {"v": 1})
+    tree.create_tag("main-1")
+    tree.create_tag("main-1-again")
+    tree.update_node(node.id, {"v": 2})
+
+    branch = tree.create_new_tree_version_from_tag("base")
+    branch.update_node(node.id, {"v": "b"})
+    branch.create_tag("feature-1")
+
+    assert [(v.id, tags) for v, tags in tree.log()] == [
+        (tree.version_id, []), (tree.checkpoint_version.id, ["main-1", "main-1-again"]),
+        (TreeVersion.get_by_tag("base").id, ["base"]),
+    ]
+    assert [tags for _, tags in tree.log("feature-1")] == [["feature-1"], ["base"]]
+    assert tree.merge_base("feature-1", "main-1").id == TreeVersion.get_by_tag("base").id
+    assert tree.merge_base(tree.version_id, "main-1").id == TreeVersion.get_by_tag("main-1").id
+    assert tree.merge_base("base", "base").id == TreeVersion.get_by_tag("base").id
+    assert sorted(tag for _, tags in tree.descendants("base") for tag in tags) == \
+        ["feature-1", "main-1", "main-1-again"]
+    assert tree.descendants(tree.version_id) == []
+    with pytest.raises(ValueError):
+        tree.merge_base("base", "missing")
+
+
+def test_three_way_merge(db_conn):
+    Tree.create("MergeTree")
+    tree = Tree.get(tree_id=1)
+    a, b, c, d = tree.add_nodes([{"n": "a"}, {"n": "b"}, {"n": "c"}, {"n": "d"}])
+    ab, bc = tree.add_edges([(a, b, {}), (b, c, {})])
+    tree.create_tag("base")
+
+    main = tree.create_new_tree_version_from_tag("base")
+    main.update_node(a, {"n": "a-main"})
+    main.update_node(b, {"n": "b-main"})
+    main.update_node(c, {"n": "same"})
+    main.add_edge(d, a, {"main": True})
+    main.create_tag("main")
+
+    feature = tree.create_new_tree_version_from_tag("base")
+    feature.update_node(b, {"n": "b-feature"})
+    feature.update_node(c, {"n": "same"})
+    feature.remove_node(d)
+    e = feature.add_node({"n": "e"}).id
+    feature.add_edge(c, e, {"feature": True})
+    feature.remove_edge(ab)
+    feature.create_tag("feature")
+
+    merge = tree.merge("feature", "main", "merged")
+    merged = Tree.get_by_tag("merged")
+    assert merged.checkpoint_version.parent_version_id == TreeVersion.get_by_tag("main").id
+    assert {n.id: n.data["n"] for n in merged.get_all_nodes()} == {
+        a: "a-main", b: "b-main", c: "same", d: "d", e: "e"
+    }
+    assert sorted((x.incoming_node_id, x.outgoing_node_id) for x in merged.get_all_edges()) == \
+        sorted([(b, c), (d, a), (c, e)])
+    # b changed on both sides; d was removed by feature but main added an edge to it
+    assert [(kind, item_id) for kind, item_id, *_ in merge.conflicts] == [("node", b), ("node", d)]
+    kind, _, base, source, target = merge.conflicts[0]
+    assert (base.data, source.data, target.data) == ({"n": "b"}, {"n": "b-feature"}, {"n": "b-main"})
+    # The branches themselves are untouched
+    assert Tree.get_by_tag("main").get_node(b).data == {"n": "b-main"}
+
+    theirs = tree.merge("feature", "main", "merged-source", prefer="source")
+    assert Tree.get_by_tag("merged-source").get_node(b).data == {"n": "b-feature"}
+    assert [item_id for _, item_id, *_ in theirs.conflicts] == [b, d]
+
+    with pytest.raises(ValueError):
+        tree.merge("feature", "main", prefer="mine")
+    assert Tag.get_by_name("feature-into-main") is None
+
+
+def test_concurrent_tags_move_the_head_in_line(db_conn):
+    Tree.create("HeadTree")
+    tree = Tree.get(tree_id=1)
+    root = tree.add_node({"n": "root"})
+    tree.create_tag("v0")
+    assert Tree.get(tree_id=1).head_version_id == tree.checkpoint_version.id
+
+    # Two workers branch off the same head; the second one to tag is rebased
+    first, second = Tree.get_head(1), Tree.get_head(1)
+    first.add_node({"n": "first"})
+    second.update_node(root.id, {"n": "root-second"})
+    first.create_tag("first")
+    second.create_tag("second")
+    head = Tree.get_head(1)
+    assert head.checkpoint_version.id == second.checkpoint_version.id
+    assert [tags for _, tags in head.log()] == [["second"], ["first"], ["v0"]]
+    assert sorted(n.data["n"] for n in head.get_all_nodes()) == ["first", "root-second"]
+
+    # Overlapping changes are not rebased
+    third, fourth = Tree.get_head(1), Tree.get_head(1)
+    third.update_node(root.id, {"n": "third"})
+    fourth.update_node(root.id, {"n": "fourth"})
+    third.create_tag("third")
+    with pytest.raises(ValueError):
+        fourth.create_tag("fourth")
+    assert Tag.get_by_name("fourth") is None
+    assert Tree.get_head(1).get_node(root.id).data == {"n": "third"}
+    # The failed tag did not move the handle's head
+    assert fourth.head_version_id == second.checkpoint_version.id
+
+    # Branches tag without moving the head
+    Tree.get(tree_id=1).create_new_tree_version_from_tag("v0").create_tag("branch")
+    assert Tree.get(tree_id=1).head_version_id == third.checkpoint_version.id
+
+
+def test_concurrent_first_tags_share_no_history(db_conn):
+    tree = Tree.create("UnrelatedTree")
+    first, second = Tree.get(tree.id), Tree.get(tree.id)
+    first.add_node({"n": "first"})
+    second.add_node({"n": "second"})
+    first.create_tag("first")
+    # Nothing to rebase the second onto: its changes must not be dropped silently
+    with pytest.raises(ValueError):
+        second.create_tag("second")
+    assert Tag.get_by_name("second") is None and second.head_version_id is None
+    with pytest.raises(ValueError):
+        VersionMerge(None, first.checkpoint_version.id, first.checkpoint_version.id)
+
+
+def test_concurrent_writers_and_readers(db_conn):
+    assert db_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    Tree.create("WorkerTree")
+    tree = Tree.get(tree_id=1)
+    tree.add_node({"n": "root"})
+    tree.create_tag("v0")
+
+    def worker(i):
+        handle = Tree.get_head(1)
+        handle.add_node({"n": f"worker-{i}"})
+        handle.create_tag(f"w{i}")
+        close_connection()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    head = Tree.get_head(1)
+    assert len(head.get_all_nodes()) == 9
+    assert len(head.log()) == 9
+
+    # A reader is not held up by an open write transaction
+    writing, done = threading.Event(), threading.Event()
+
+    def writer():
+        with transaction():
+            Tree.get_head(1).add_nodes({"n": i} for i in range(100))
+            writing.set()
+            done.wait(5)
+        close_connection()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writing.wait(5)
+    assert len(Tree.get_head(1).get_all_nodes()) == 9
+    done.set()
+    thread.join()
+
+
+def test_async_tree(db_conn):
+    async def scenario():
+        tree = await AsyncTree.create("AsyncTree")
+        ids = await tree.add_nodes({"n": i} for i in range(5))
+        await tree.add_edges((ids[0], node_id, {}) for node_id in ids[1:])
+        await tree.create_tag("v1")
+
+        def grow(t):
+            t.add_edge(ids[1], t.add_node({"n": "leaf"}).id, {})
+            return t.create_tag("v2")
+        tag = await tree.run(grow)
+        assert tag.tag_name == "v2"
+
+        v1 = await AsyncTree.get_by_tag("v1")
+        nodes, roots, path, streamed = await asyncio.gather(
+            v1.get_all_nodes(), tree.get_root_nodes(), tree.find_path(ids[0], ids[1]),
+            collect(tree.iter_nodes(page_size=2)),
+        )
+        assert len(nodes) == 5 and [n.id for n in roots] == [ids[0]]
+        assert [node.id for node, _ in path] == [ids[0], ids[1]]
+        assert sorted(n.data["n"] for n in streamed if n.data["n"] != "leaf") == list(range(5))
+        assert len(streamed) == 6
+        assert [change for _, change, _, _ in await tree.diff("v1", "v2")] == ["added", "added"]
+
+    async def collect(stream):
+        return [item async for item in stream]
+
+    asyncio.run(scenario())
+
+
+def test_reads_stay_on_the_checkpoint_until_the_working_version_commits(db_conn):
+    tree = Tree.create("PendingVersionTree")
+    node = tree.add_node({"n": "tagged"})
+    tree.create_tag("v1")
+    handle = Tree.get_by_tag("v1")
+    writing, done = threading.Event(), threading.Event()
+
+    def datas():
+        yield {"n": "new"}
+        writing.set()
+        done.wait(5)
+
+    # The first write creates the working version inside add_nodes' transaction
+    thread = threading.Thread(target=lambda: (handle.add_nodes(datas()), close_connection()))
+    thread.start()
+    writing.wait(5)
+    try:
+        assert [n.data for n in handle.get_all_nodes()] == [{"n": "tagged"}]
+        assert handle.get_node(node.id).data == {"n": "tagged"}
+    finally:
+        done.set()
+        thread.join()
+    assert sorted(n.data["n"] for n in handle.get_all_nodes()) == ["new", "tagged"]
+
+
+def test_async_reads_share_the_graph_index_with_writes(db_conn):
+    tree = Tree.create("SharedIndexTree")
+    ids = tree.add_nodes({"n": i} for i in range(3))
+    tree.add_edges([(ids[0], ids[1], {}), (ids[1], ids[2], {})])
+    assert [n.id for n in tree.get_nodes_at_depth(2)] == [ids[2]]
+
+    # A traversal waits while another thread holds the index
+    paths = []
+    with tree._index_lock:
+        thread = threading.Thread(target=lambda: (paths.append(tree.find_path(ids[0], ids[2])), close_connection()))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+    thread.join()
+    assert [node.id for node, _ in paths[0]] == ids
+
+    # Edges added (and the index compacted) while reads of the same handle run
+    async def scenario():
+        shared = AsyncTree(tree)
+        leaves = await shared.add_nodes({"leaf": i} for i in range(100))
+        await asyncio.gather(*(shared.add_edge(ids[2], leaf, {}) for leaf in leaves),
+                             *(shared.get_nodes_at_depth(3) for _ in range(50)),
+                             *(shared.find_path(ids[0], leaf) for leaf in leaves[::10]))
+        assert sorted(n.id for n in await shared.get_nodes_at_depth(3)) == leaves
+
+    asyncio.run(scenario())
+
+
+def test_instrumentation(db_conn):
+    tree = Tree.create("ProfiledTree")
+    tree.add_nodes({"i": i} for i in range(10))
+    tree.create_tag("v1")
+    read_cache.clear()
+    # profile() never reopens connections, which may be inside a transaction
+    with pytest.raises(ValueError, match="enable"):
+        with instrumentation.profile("off"):
+            pass
+    assert get_connection() is db_conn
+    try:
+        instrumentation.enable()
+        with instrumentation.profile("get_by_tag") as p:
+            copy = Tree.get_by_tag("v1")
+        assert p.counts["connections_opened"] == 1 and p.counts["commits"] == 0
+        assert p.counts["statements"] == len(p.statements) >= 2
+        assert p.counts["rows_read"] == sum(s[2] for s in p.statements) and p.wall_time >= p.counts["seconds"]
+
+        instrumentation.enable(slow_query_seconds=0)
+        with instrumentation.profile("get_all_nodes") as p:
+            assert len(copy.get_all_nodes()) == 10
+        assert p.counts["rows_read"] >= 10 and p.counts["rows_written"] == 0
+        assert any("SEARCH" in line for sample in p.slow_queries for line in sample["plan"])
+        with instrumentation.profile("add_node") as p:
+            copy.add_node({"i": 10})
+        assert p.counts["rows_written"] >= 1 and p.counts["commits"] >= 1
+
+        with instrumentation.operation("other"):
+            copy.get_node(1)
+        counters = instrumentation.registry.snapshot()
+        assert counters["get_by_tag"]["connections_opened"] == 1
+        assert counters["other"]["statements"] >= 1 and counters["add_node"]["commits"] >= 1
+        text = instrumentation.registry.prometheus()
+        assert 'tree_db_statements_total{operation="get_by_tag"}' in text
+        assert "# TYPE tree_db_commits_total counter" in text
+    finally:
+        instrumentation.enable(slow_query_seconds=instrumentation.DEFAULT_SLOW_QUERY_SECONDS)
+        instrumentation.disable()
+        instrumentation.registry.reset()
+    assert not instrumentation.enabled()